@@ -1 +1,2 @@
 from .angryfiles import random_bytes
+from .angryfiles import VirtualAngryTree
@@ -19,17 +19,50 @@
 # pylint: disable=too-many-boolean-expressions    # [R0916] in if statement
 from __future__ import annotations
 
+import base64
+import bisect
+import ctypes
+import errno
+import fcntl
+import hashlib
+import importlib.metadata
+import inspect
+import io
 import itertools
+import json
+import math
 import os
 import pprint
 import random
+import re
+import resource
+import shutil
+import stat
 import struct
 import subprocess
+import sys
+import tarfile
+import threading
 import time
+import unicodedata
+import urllib.parse
 from collections import defaultdict
+from collections import deque
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Iterator
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from contextlib import contextmanager
+from functools import cache
+from functools import partial
 from pathlib import Path
 from shutil import copy
 from tempfile import TemporaryDirectory
+from typing import BinaryIO
+from typing import NamedTuple
 
 import click
 from asserttool import ic
@@ -39,56 +72,276 @@ from clicktool import click_global_options
 from clicktool import tv
 from getdents import paths
 from mptool import output
-from with_chdir import chdir
 
-# from collections.abc import Sequence
 # from eprint import eprint
 # from asserttool import ic
 
 global TOTALS_DICT
 TOTALS_DICT = defaultdict(int)
+TOTALS_LOCK = threading.Lock()  # see count_total()
+# ns spent in each phase of create_object() and check_file_count(), summed over threads
+PHASE_NS = defaultdict(int)
+PHASE_NS_LOCK = threading.Lock()
+# the Journal of the run, None when nothing is journaled
+JOURNAL = None
+# creates create_objects() keeps in flight, and a sleep before each one to
+# stand in for a network round trip, see run_test_sets()
+IN_FLIGHT = 1
+SIMULATED_LATENCY_S = 0.0
 
 
-def make_working_dir(path: bytes) -> None:
+def count_total(kind: str, count: int) -> None:
+    # generators run on pool threads, every TOTALS_DICT count goes through here
+    with TOTALS_LOCK:
+        TOTALS_DICT[kind] += count
+
+
+def make_working_dir(
+    path: bytes,
+    *,
+    root_dir: None | bytes | Path = None,
+    dir_fd: None | int = None,
+    exist_ok: bool = False,
+) -> None:
     assert isinstance(path, bytes)
-    os.makedirs(path)
-    # path.mkdir(parents=True)
     new_dir_count = (
         len(Path(os.fsdecode(path)).parts) - 1
     )  # bug if other tests use same subfolder
-    TOTALS_DICT["working_dir"] += max(1, new_dir_count)
+    if dir_fd is not None:
+        try:
+            os.mkdir(path, dir_fd=dir_fd)
+        except FileExistsError:
+            if not exist_ok:
+                raise
+    elif root_dir is not None:
+        os.makedirs(os.path.join(os.fsencode(root_dir), path), exist_ok=exist_ok)
+    else:
+        os.makedirs(path, exist_ok=exist_ok)
+    # path.mkdir(parents=True)
+    count_total("working_dir", max(1, new_dir_count))
+
+
+@contextmanager
+def open_dir_fd(
+    path: bytes | Path,
+    *,
+    dir_fd: None | int = None,
+) -> Iterator[int]:
+    """
+    open a directory for use as the dir_fd= of fd relative calls
+
+    everything created through the fd skips re-resolving the dest_dir path
+    and does not depend on the process cwd, so there is no chdir
+    """
+    fd = os.open(
+        path,
+        os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC,
+        dir_fd=dir_fd,
+    )
+    try:
+        yield fd
+    finally:
+        os.close(fd)
 
 
 def random_bytes(count: int) -> bytes:
     assert isinstance(count, int)
-    with open("/dev/urandom", "rb") as fd:
-        return fd.read(count)
+    return os.urandom(count)
 
 
 def random_filename_length() -> int:
-    return random.SystemRandom().randint(0, 255)  # returns max of 255
+    return random.SystemRandom().randint(1, 255)  # returns max of 255
+
+
+def iter_random_filenames(
+    rng: random.Random,
+    *,
+    min_length: int = 1,
+    max_length: int = 255,
+    buffer_size: int = 2**16,
+) -> Iterator[bytes]:
+    """
+    endless valid file names, lengths uniform over min_length..max_length
+
+    the bytes come from rng.randbytes() with NULL and '/' deleted, so every
+    valid byte is equally likely and the same rng state gives the same names
+    """
+    assert 1 <= min_length <= max_length <= 255
+    assert buffer_size >= max_length
+    buffer = b""
+    offset = 0
+    while True:
+        length = rng.randint(min_length, max_length)
+        while len(buffer) - offset < length:
+            buffer = buffer[offset:] + rng.randbytes(buffer_size).translate(
+                None, b"\x00/"
+            )
+            offset = 0
+        name = buffer[offset : offset + length]
+        offset += length
+        if name in (b".", b".."):
+            continue
+        yield name
 
 
 def get_random_filename() -> bytes:
     length = random_filename_length()
-    name = random_bytes(length)  # broken
-    return name
+    return next(
+        iter_random_filenames(
+            random.SystemRandom(),
+            min_length=length,
+            max_length=length,
+            buffer_size=512,
+        )
+    )
+
+
+@cache
+def utf8_code_points(
+    planes: None | tuple[int, ...] = None,
+    categories: None | tuple[str, ...] = None,
+    surrogateescape: bool = False,
+) -> str:
+    """
+    every code point a random utf8 name may use, as one str to sample from
+
+    planes are 0-16, categories are unicodedata.category() prefixes like
+    "L" or "Zs". NULL, '/' and the surrogates are never in it, with
+    surrogateescape the 128 lone surrogates that encode to the bytes
+    0x80-0xFF are added, so the names are no longer valid utf8
+    """
+    if planes is None:
+        planes = tuple(range(17))
+    assert set(planes) <= set(range(17))
+    code_points = "".join(
+        chr(code_point)
+        for plane in sorted(set(planes))
+        for code_point in range(plane * 0x10000, (plane + 1) * 0x10000)
+        if not 0xD800 <= code_point <= 0xDFFF and code_point not in (0x00, 0x2F)
+    )
+    if categories:
+        code_points = "".join(
+            char
+            for char in code_points
+            if unicodedata.category(char).startswith(categories)
+        )
+    if surrogateescape:
+        code_points += "".join(chr(code_point) for code_point in range(0xDC80, 0xDD00))
+    assert code_points
+    return code_points
+
+
+@cache
+def utf8_code_point_width(
+    planes: None | tuple[int, ...] = None,
+    categories: None | tuple[str, ...] = None,
+    surrogateescape: bool = False,
+) -> float:
+    # mean encoded bytes per code point of utf8_code_points()
+    code_points = utf8_code_points(planes, categories, surrogateescape)
+    return len(code_points.encode("utf8", "surrogateescape")) / len(code_points)
+
+
+@cache
+def utf8_code_points_within(
+    planes: None | tuple[int, ...] = None,
+    categories: None | tuple[str, ...] = None,
+    surrogateescape: bool = False,
+) -> dict[int, str]:
+    """
+    the utf8_code_points() that encode to at most 1, 2, 3 and 4 bytes,
+    widths nothing encodes to are left out
+    """
+    code_points = utf8_code_points(planes, categories, surrogateescape)
+    within = {}
+    # the last code point of each width, the escaped bytes are 1 byte each
+    for width, last in enumerate(("\x7f", "\u07ff", "\uffff", "\U0010ffff"), 1):
+        fitting = re.sub(f"[^\x00-{last}\udc80-\udcff]", "", code_points)
+        if fitting and fitting != within.get(width - 1):
+            within[width] = fitting
+    return within
+
+
+def random_utf8_filenames(
+    count: int,
+    *,
+    rng: None | random.Random = None,
+    planes: None | tuple[int, ...] = None,
+    categories: None | tuple[str, ...] = None,
+    surrogateescape: bool = False,
+    min_length: int = 1,
+    max_length: int = 255,
+) -> list[bytes]:
+    """
+    count names sampled from utf8_code_points(), lengths in bytes
+
+    a byte length is drawn uniformly from min_length..max_length and
+    about that many bytes of code points are drawn, the name ends at the
+    last code point that fits. a name short of min_length is topped up with
+    code points narrow enough to fit, so short names are not left to chance
+
+    raises ValueError when no name min_length..max_length bytes long can be
+    made of these code points
+    """
+    assert 1 <= min_length <= max_length <= 255
+    if rng is None:
+        rng = random.Random()
+    code_points = utf8_code_points(planes, categories, surrogateescape)
+    width = utf8_code_point_width(planes, categories, surrogateescape)
+    within = utf8_code_points_within(planes, categories, surrogateescape)
+    # the byte lengths sums of these code point widths reach
+    reachable = {0}
+    for length in range(1, max_length + 1):
+        if any(length - fitting in reachable for fitting in within):
+            reachable.add(length)
+    if max(reachable) < min_length:
+        raise ValueError(
+            f"no name {min_length}-{max_length} bytes long is made of code points "
+            f"{min(within)}-{max(within)} bytes wide"
+        )
+    errors = "surrogateescape" if surrogateescape else "strict"
+    names = []
+    while len(names) < count:
+        length = rng.randint(min_length, max_length)
+        name = b""
+        for char in rng.choices(code_points, k=max(1, round(length / width))):
+            encoded = char.encode("utf8", errors)
+            if len(name) + len(encoded) > length:
+                break
+            name += encoded
+        while len(name) < min_length:
+            fitting = [key for key in within if key <= length - len(name)]
+            if not fitting:
+                break
+            name += rng.choice(within[max(fitting)]).encode("utf8", errors)
+        if len(name) < min_length or name in (b".", b".."):
+            continue
+        names.append(name)
+    return names
+
+
+def iter_random_utf8_filenames(
+    rng: random.Random,
+    *,
+    min_length: int = 1,
+    max_length: int = 255,
+    batch_size: int = 1024,
+    **kwargs,
+) -> Iterator[bytes]:
+    # endless random_utf8_filenames(), kwargs are passed on
+    while True:
+        yield from random_utf8_filenames(
+            batch_size,
+            rng=rng,
+            min_length=min_length,
+            max_length=max_length,
+            **kwargs,
+        )
 
 
-# evaluate /usr/lib64/python3.4/site-packages/bs4/dammit.py
 def random_utf8() -> bytes:
-    gotutf8 = False
-    while not gotutf8:
-        codepoint = random.SystemRandom().randint(0, 4294967296)
-        possible_utf8_bytes = struct.pack(">I", codepoint)
-        try:
-            possible_utf8_bytes.decode(
-                "UTF8"
-            )  # todo https://docs.python.org/3/library/codecs.html#error-handlers
-            gotutf8 = True
-        except UnicodeDecodeError:
-            pass
-    return possible_utf8_bytes
+    # one random code point, encoded
+    return random.choice(utf8_code_points()).encode("utf8")
 
 
 # inception bug here...?
@@ -97,22 +350,287 @@ def write_file(
     name: bytes,
     data: bytes,
     template_file: None | bytes = None,
+    dir_fd: None | int = None,
+    size: None | int = None,
+    source_fd: None | int = None,
 ):
+    # with size the file is size bytes of source_fd, or of holes without one
     assert isinstance(name, bytes)
     assert isinstance(data, bytes)
-    if template_file:
+    if size is not None:
+        assert data == b""
+        assert not template_file
+        fd = os.open(
+            name,
+            os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC,
+            0o666,
+            dir_fd=dir_fd,
+        )
+        try:
+            if size == FILESYSTEM_MAX_SIZE:
+                assert source_fd is None
+                size = max_file_size(fd)
+            if source_fd is None:
+                os.ftruncate(fd, size)
+            else:
+                clone_file(source_fd, fd, size=size)
+        finally:
+            os.close(fd)
+        return
+    if template_file and dir_fd is None:
         assert data == b""
         _name = Path(os.fsdecode(name))
         _template_file = Path(os.fsdecode(template_file))
         del name  # todo check exact file was written, needs to be a gateway for all file creation
         copy(_template_file, _name, follow_symlinks=False)
-    else:
-        with open(name, "xb") as fh:
+        return
+
+    fd = os.open(
+        name,
+        os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC,
+        0o666,
+        dir_fd=dir_fd,
+    )
+    with open(fd, "wb") as fh:
+        if template_file:
+            assert data == b""
+            with open(template_file, "rb") as template_fh:
+                clone_file(template_fh.fileno(), fh.fileno())
+            os.fchmod(fh.fileno(), stat.S_IMODE(os.stat(template_file).st_mode))
+        else:
             fh.write(data)
 
 
-# prob should be Set[bytes]
-def valid_filename_bytes() -> set[bytes]:
+FICLONE = 0x40049409  # linux/fs.h _IOW(0x94, 9, int)
+
+
+def _iter_data_ranges(fd: int, size: int) -> Iterator[tuple[int, int]]:
+    # (start, end) of each run of data in the first size bytes of fd, holes are skipped
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                return  # nothing but a hole left
+            if e.errno != errno.EINVAL:
+                raise
+            yield offset, size  # no SEEK_DATA, all of it is data
+            return
+        if start >= size:
+            return
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        yield start, end
+        offset = end
+
+
+def clone_file(src_fd: int, dst_fd: int, size: None | int = None) -> str:
+    """
+    copy the first size bytes (default all) of src_fd into the empty dst_fd
+    without reading them into python
+
+    reflink if the fs can share the extents, else copy_file_range, else
+    sendfile. holes in src_fd stay holes. returns the method that worked
+    """
+    src_size = os.fstat(src_fd).st_size
+    if size is None:
+        size = src_size
+    assert size <= src_size
+    if size == src_size:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return "reflink"
+        except OSError as e:
+            if e.errno not in {
+                errno.EOPNOTSUPP,
+                errno.ENOTTY,
+                errno.EXDEV,
+                errno.EINVAL,
+            }:
+                raise
+    os.ftruncate(dst_fd, size)  # the holes
+    method = "copy_file_range"
+    for start, end in _iter_data_ranges(src_fd, size):
+        offset = start
+        while offset < end:
+            if method == "copy_file_range":
+                try:
+                    copied = os.copy_file_range(
+                        src_fd, dst_fd, end - offset, offset, offset
+                    )
+                except OSError as e:
+                    if e.errno not in {errno.EXDEV, errno.ENOSYS, errno.EINVAL}:
+                        raise
+                    method = "sendfile"
+                    continue
+            else:
+                os.lseek(dst_fd, offset, os.SEEK_SET)
+                copied = os.sendfile(dst_fd, src_fd, offset, end - offset)
+            if copied == 0:
+                break
+            offset += copied
+    return method
+
+
+# what size matrix data files are filled with, byte n of a file is n % 256
+SIZE_PATTERN = bytes(range(256)) * 256
+
+
+def unlinked_file(*, dir_fd: int, prefix: str) -> int:
+    """
+    an O_TMPFILE on the fs of dir_fd, or on a fs without them a file that
+    is unlinked as soon as it is made. returns its fd, opened O_RDWR
+    """
+    try:
+        return os.open(
+            ".", os.O_TMPFILE | os.O_RDWR | os.O_CLOEXEC, 0o600, dir_fd=dir_fd
+        )
+    except OSError as e:
+        if e.errno not in {errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL}:
+            raise
+    name = f".angryfiles-{prefix}-{os.getpid()}-{threading.get_ident()}".encode()
+    fd = os.open(
+        name,
+        os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC,
+        0o600,
+        dir_fd=dir_fd,
+    )
+    os.unlink(name, dir_fd=dir_fd)
+    return fd
+
+
+def pattern_file(*, dir_fd: int, size: int) -> int:
+    """
+    an unlinked file on the fs of dir_fd holding size bytes of SIZE_PATTERN
+    repeated, returns its fd for clone_file() to fill files from
+
+    the pattern is written once and then doubled in the kernel
+    """
+    fd = unlinked_file(dir_fd=dir_fd, prefix="pattern")
+    filled = 0
+    while filled < min(size, len(SIZE_PATTERN)):
+        filled += os.pwrite(
+            fd, SIZE_PATTERN[filled : min(size, len(SIZE_PATTERN))], filled
+        )
+    while filled < size:
+        # the data at filled % 256 is what belongs at filled
+        source = filled % 256
+        try:
+            copied = os.copy_file_range(
+                fd, fd, min(filled - source, size - filled), source, filled
+            )
+        except OSError as e:
+            if e.errno not in {errno.EXDEV, errno.ENOSYS, errno.EINVAL}:
+                raise
+            copied = os.pwrite(
+                fd, SIZE_PATTERN[source : source + size - filled], filled
+            )
+        filled += copied
+    return fd
+
+
+FILESYSTEM_MAX_SIZE = -1  # size of a sparse_file, the largest the fs allows
+
+
+def max_file_size(fd: int) -> int:
+    # largest size fd can be truncated to, fd is left that size
+    low = os.fstat(fd).st_size
+    high = 2**63 - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        try:
+            os.ftruncate(fd, middle)
+            low = middle
+        except OSError as e:
+            if e.errno not in {errno.EFBIG, errno.EINVAL}:
+                raise
+            high = middle - 1
+    os.ftruncate(fd, low)
+    return low
+
+
+XATTR_NAME_MAX = 255  # linux limit on a name, namespace included
+XATTR_SIZE_MAX = 65536  # linux limit on one value
+# namespaces probed and cloned, security. and system. are owned by the kernel
+XATTR_NAMESPACES = (b"user.", b"trusted.")
+XATTR_REJECTED = {
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EPERM,
+    errno.EACCES,
+    errno.ENOSPC,
+    errno.E2BIG,
+    errno.ERANGE,
+}
+_XATTR_SUPPORT: dict[int, tuple[frozenset[bytes], int]] = {}
+_XATTR_SUPPORT_LOCK = threading.Lock()
+
+
+def xattr_support(dir_fd: int) -> tuple[frozenset[bytes], int]:
+    """
+    (the XATTR_NAMESPACES the fs of dir_fd takes on a file, the largest
+    value it takes), probed once per fs on an unlinked pattern_file()
+    """
+    st_dev = os.fstat(dir_fd).st_dev
+    with _XATTR_SUPPORT_LOCK:
+        if st_dev in _XATTR_SUPPORT:
+            return _XATTR_SUPPORT[st_dev]
+        fd = pattern_file(dir_fd=dir_fd, size=0)
+        try:
+            namespaces = set()
+            for namespace in XATTR_NAMESPACES:
+                try:
+                    os.setxattr(fd, namespace + b"angryfiles", b"")
+                    namespaces.add(namespace)
+                except OSError as e:
+                    if e.errno not in XATTR_REJECTED:
+                        raise
+            low = 0
+            high = XATTR_SIZE_MAX if namespaces else 0
+            name = min(namespaces, default=b"") + b"angryfiles"
+            while low < high:
+                middle = (low + high + 1) // 2
+                try:
+                    os.setxattr(fd, name, SIZE_PATTERN[:middle])
+                    low = middle
+                except OSError as e:
+                    if e.errno not in XATTR_REJECTED:
+                        raise
+                    high = middle - 1
+        finally:
+            os.close(fd)
+        _XATTR_SUPPORT[st_dev] = (frozenset(namespaces), low)
+        return _XATTR_SUPPORT[st_dev]
+
+
+def settable_xattrs(
+    xattrs: Iterable[tuple[bytes, None | bytes]],
+    *,
+    support: tuple[frozenset[bytes], int],
+) -> list[tuple[bytes, bytes]]:
+    # the xattrs an xattr_support() fs takes, a None value is as large as it allows
+    namespaces, max_size = support
+    settable = []
+    for name, value in xattrs:
+        if not name.startswith(tuple(namespaces)):
+            continue
+        _value = SIZE_PATTERN[:max_size] if value is None else value
+        if len(_value) <= max_size:
+            settable.append((name, _value))
+    return settable
+
+
+def _open_for_xattrs(name: bytes, *, dir_fd: int) -> int:
+    # an fd of a file, dir or fifo for f*xattr(), O_NONBLOCK so a fifo open does not wait
+    return os.open(
+        name,
+        os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK | os.O_CLOEXEC,
+        dir_fd=dir_fd,
+    )
+
+
+@cache
+def valid_filename_bytes() -> frozenset[bytes]:
     """
     valid bytes to include in a filename
 
@@ -135,7 +653,7 @@ def valid_filename_bytes() -> set[bytes]:
     assert b"/" not in ans  # /
     for byte in ans:
         assert isinstance(byte, bytes)
-    return ans
+    return frozenset(ans)
 
 
 def valid_symlink_dest_bytes() -> set[bytes]:  # todo use
@@ -147,27 +665,260 @@ def valid_symlink_dest_bytes() -> set[bytes]:  # todo use
     return ans
 
 
-def writable_one_byte_filenames():
+class FilenameSpace(Sequence):
+    """
+    every valid length byte file name in byte order, as an indexable sequence
+
+    a name is built from its index when it is accessed, so the 16M three
+    byte names cost nothing until they are iterated. excluded names are
+    skipped by index rather than filtered, len() and slicing are O(1) and
+    a slice (or shard()) is a FilenameSpace over a range of indexes
+    """
+
+    ALPHABET = bytes(sorted(byte[0] for byte in valid_filename_bytes()))
+
+    def __init__(
+        self,
+        length: int,
+        *,
+        exclude: Iterable[bytes] = (b".", b".."),
+        indexes: None | range = None,
+    ):
+        assert 1 <= length <= 4
+        self.length = length
+        self.exclude = tuple(sorted(name for name in exclude if len(name) == length))
+        # raw ranks count every name, indexes skip the excluded ones
+        self._excluded_ranks = [self._raw_rank(name) for name in self.exclude]
+        if indexes is None:
+            indexes = range(len(self.ALPHABET) ** length - len(self.exclude))
+        self.indexes = indexes
+
+    def _raw_rank(self, name: bytes) -> int:
+        if len(name) != self.length:
+            raise ValueError(f"{name!r} is not {self.length} bytes")
+        rank = 0
+        for byte in name:
+            digit = self.ALPHABET.find(byte)
+            if digit == -1:
+                raise ValueError(f"{name!r} is not a valid file name")
+            rank = rank * len(self.ALPHABET) + digit
+        return rank
+
+    def _index_of_raw_rank(self, rank: int) -> int:
+        return rank - bisect.bisect_left(self._excluded_ranks, rank)
+
+    def unrank(self, index: int) -> bytes:
+        # the name at index of the whole space, ignores any slice
+        rank = index
+        for excluded_rank in self._excluded_ranks:
+            if excluded_rank <= rank:
+                rank += 1
+        name = bytearray(self.length)
+        for position in range(self.length - 1, -1, -1):
+            rank, digit = divmod(rank, len(self.ALPHABET))
+            name[position] = self.ALPHABET[digit]
+        return bytes(name)
+
+    def rank(self, name: bytes) -> int:
+        # the index of name in the whole space
+        rank = self._raw_rank(name)
+        if name in self.exclude:
+            raise ValueError(f"{name!r} is excluded")
+        return self._index_of_raw_rank(rank)
+
+    def shard(self, prefix: bytes) -> FilenameSpace:
+        # the names of the whole space starting with prefix
+        assert 1 <= len(prefix) <= self.length
+        pad = self.length - len(prefix)
+        start = self._raw_rank(prefix + self.ALPHABET[:1] * pad)
+        stop = self._raw_rank(prefix + self.ALPHABET[-1:] * pad) + 1
+        return FilenameSpace(
+            self.length,
+            exclude=self.exclude,
+            indexes=range(
+                self._index_of_raw_rank(start), self._index_of_raw_rank(stop)
+            ),
+        )
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return FilenameSpace(
+                self.length, exclude=self.exclude, indexes=self.indexes[index]
+            )
+        return self.unrank(self.indexes[index])
+
+    def __iter__(self) -> Iterator[bytes]:
+        for index in self.indexes:
+            yield self.unrank(index)
+
+    def __contains__(self, name) -> bool:
+        try:
+            return self.rank(name) in self.indexes
+        except (ValueError, TypeError):
+            return False
+
+    def index(self, name, start=0, stop=None) -> int:
+        # position of name in this sequence, O(1)
+        position = self.indexes.index(self.rank(name))
+        if position < start or (stop is not None and position >= stop):
+            raise ValueError(f"{name!r} is not in range")
+        return position
+
+    def count(self, name) -> int:
+        return int(name in self)
+
+    def __repr__(self) -> str:
+        return f"FilenameSpace({self.length}, exclude={self.exclude!r}, indexes={self.indexes!r})"
+
+
+def writable_one_byte_filenames() -> FilenameSpace:
     """
     '.' (46) is not a valid one byte file name but is a valid symlink destination
     """
-    ans = valid_filename_bytes() - {b"."}
-    assert len(ans) == 253  # 256 - [\x00, \x46, \x47]
-    # 256 - [NULL, '.', '/']
+    ans = FilenameSpace(1)
+    assert len(ans) == 253  # 256 - [NULL, '.', '/']
     return ans
 
 
-def writable_two_byte_filenames():
+def writable_two_byte_filenames() -> FilenameSpace:
     """
     '..' (46, 46) is not a valid two byte file name but is a valid symlink destination
     """
-    ans = set(itertools.product(valid_filename_bytes(), repeat=2)) - {(b".", b".")}
-    assert len(ans) == 64515
-    assert b"\x46\x46" not in ans  # '..'
-    assert b".." not in ans  # '..'
+    ans = FilenameSpace(2)
+    assert len(ans) == 64515  # 254**2 - ['..']
+    assert b".." not in ans
     return ans
 
 
+def broken_symlink_target(name: bytes) -> bytes:
+    # setting target to a random byte does not gurantee a broken symlink
+    # in the case of a fixed target like b'a' _at least_ one symlink
+    # will be circular and therefore not broken
+    #   (in the complete coverage of n bytes case, when n=1 the 'a' symlink
+    #   will be circular if 'a' is the chosen random symlink dest)
+    # method:
+    #   1. set target ../ OUTSIDE (because one inside could name clash)
+    #      the current folder
+    #   2. choose a path guranteed to not exist
+    # to gurantee the target does not exist:
+    #   1. assume the "root" folder tree is deleted every run
+    #   2. assume a custom ../$dest_dir_$timestamp/name DOES NOT EXIST
+    non_existing_target = (
+        b"../" + str(time.time()).encode("UTF8") + b"/" + os.path.basename(name)
+    )
+    # assert non_existing_target does not exist
+    return non_existing_target
+
+
+def link_target_path(path: bytes, target: bytes) -> bytes:
+    # the path of what the "link" path is a hardlink to, target is relative to its dir
+    return os.path.normpath(os.path.join(os.path.dirname(path), target))
+
+
+def next_symlinkable_byte(name: bytes) -> bytes:
+    # any byte but NUL is a symlink target, 255 wraps to 1
+    if len(name) != 1:
+        raise ValueError(f"{name!r} is not a 1 byte name")
+    return bytes([name[0] % 255 + 1])
+
+
+def next_symlink(name: bytes) -> bytes:
+    # the 1 byte name after name, skipping b'.' and b'/', 255 wraps to 1
+    if len(name) != 1:
+        raise ValueError(f"{name!r} is not a 1 byte name")
+    names = writable_one_byte_filenames()
+    return names[(names.index(name) + 1) % len(names)]
+
+
+def symlink_target(angry_object: AngryObject) -> bytes:
+    # what create_object() points a symlink type angry_object at
+    name = os.path.basename(angry_object.path)
+    if angry_object.file_type == "self_symlink":
+        return name
+    if angry_object.file_type == "broken_symlink":
+        return broken_symlink_target(angry_object.path)
+    if angry_object.file_type == "next_symlink":
+        return next_symlink(name)
+    if angry_object.file_type == "next_symlinkable_byte":
+        return next_symlinkable_byte(name)
+    return angry_object.target
+
+
+UTIME_OMIT = (1 << 30) - 2
+AT_FDCWD = -100
+AT_SYMLINK_NOFOLLOW = 0x100
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _load_utimensat():
+    # libc utimensat() for UTIME_OMIT, which os.utime() has no way to pass
+    if not sys.platform.startswith("linux") or ctypes.sizeof(ctypes.c_long) != 8:
+        return None
+    try:
+        utimensat = ctypes.CDLL(None, use_errno=True).utimensat
+    except (OSError, AttributeError):
+        return None
+    utimensat.argtypes = [
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.POINTER(_Timespec),
+        ctypes.c_int,
+    ]
+    utimensat.restype = ctypes.c_int
+    return utimensat
+
+
+_UTIMENSAT = _load_utimensat()
+
+
+def _timespec(time_ns: None | int) -> _Timespec:
+    if time_ns is None:
+        return _Timespec(0, UTIME_OMIT)
+    return _Timespec(*divmod(time_ns, 10**9))
+
+
+def set_times(
+    name: bytes,
+    *,
+    atime_ns: None | int,
+    mtime_ns: None | int,
+    dir_fd: None | int = None,
+) -> None:
+    # a None time is left as it is, symlinks are not followed
+    if (mtime_ns is not None) or (atime_ns is not None):
+        # a os.utime call is gonna happen
+        if ((mtime_ns is None) or (atime_ns is None)) and _UTIMENSAT is not None:
+            times = (_Timespec * 2)(_timespec(atime_ns), _timespec(mtime_ns))
+            if _UTIMENSAT(
+                AT_FDCWD if dir_fd is None else dir_fd,
+                name,
+                times,
+                AT_SYMLINK_NOFOLLOW,
+            ):
+                _errno = ctypes.get_errno()
+                raise OSError(_errno, os.strerror(_errno), name)
+            return
+        if (mtime_ns is None) or (atime_ns is None):
+            _stat = os.stat(name, dir_fd=dir_fd, follow_symlinks=False)
+            if mtime_ns is None:
+                mtime_ns = _stat.st_mtime_ns
+            if atime_ns is None:
+                atime_ns = _stat.st_atime_ns
+        os.utime(
+            name,
+            times=None,
+            ns=(atime_ns, mtime_ns),
+            dir_fd=dir_fd,
+            follow_symlinks=False,
+        )
+
+
 def create_object(
     *,
     name: bytes,
@@ -177,8 +928,12 @@ def create_object(
     template_file: None | bytes = None,
     mtime_ns: None | int = None,
     atime_ns: None | int = None,
-    verbose: bool | int | float = False,
+    dir_fd: None | int = None,
+    size: None | int = None,
+    source_fd: None | int = None,
+    verbose: bool | float = False,
 ) -> None:  # fixme: dont imply target
+    # with dir_fd, name is relative to dir_fd and nothing depends on the cwd
     valid_types = [
         "file",
         "dir",
@@ -190,10 +945,12 @@ def create_object(
         "circular_symlink",
         "link",
         "fifo",
+        "sparse_file",
     ]
 
     # assert content is None
-    ic(name, file_type, content, target, template_file, mtime_ns, atime_ns)
+    ic(name, file_type, content, target, template_file, mtime_ns, atime_ns, dir_fd)
+    start_ns = time.perf_counter_ns()
 
     assert file_type in valid_types
     if template_file:
@@ -203,34 +960,34 @@ def create_object(
     if file_type == "file":
         if content is None:
             content = b""
-        write_file(name=name, data=content, template_file=template_file)
+        write_file(
+            name=name,
+            data=content,
+            template_file=template_file,
+            dir_fd=dir_fd,
+            size=size,
+            source_fd=source_fd,
+        )
+
+    elif file_type == "sparse_file":
+        assert size is not None
+        write_file(name=name, data=b"", dir_fd=dir_fd, size=size)
 
     elif file_type == "dir":
-        os.makedirs(name)
+        if dir_fd is None:
+            os.makedirs(name)
+        else:
+            os.mkdir(name, dir_fd=dir_fd)
 
     elif file_type == "symlink":
         assert target
-        os.symlink(target, name)
+        os.symlink(target, name, dir_fd=dir_fd)
 
     elif file_type == "broken_symlink":
-        # setting target to a random byte does not gurantee a broken symlink
-        # in the case of a fixed target like b'a' _at least_ one symlink
-        # will be circular and therefore not broken
-        #   (in the complete coverage of n bytes case, when n=1 the 'a' symlink
-        #   will be circular if 'a' is the chosen random symlink dest)
-        # method:
-        #   1. set target ../ OUTSIDE (because one inside could name clash)
-        #      the current folder
-        #   2. choose a path guranteed to not exist
-        # to gurantee the target does not exist:
-        #   1. assume the "root" folder tree is deleted every run
-        #   2. assume a custom ../$dest_dir_$timestamp/name DOES NOT EXIST
-        non_existing_target = b"../" + str(time.time()).encode("UTF8") + b"/" + name
-        # assert non_existing_target does not exist
-        os.symlink(non_existing_target, name)
+        os.symlink(broken_symlink_target(name), name, dir_fd=dir_fd)
 
     elif file_type == "self_symlink":
-        os.symlink(name, name)
+        os.symlink(os.path.basename(name), name, dir_fd=dir_fd)
 
     elif file_type == "next_symlinkable_byte":
         # symlink to the next valid symlink target byte
@@ -242,9 +999,7 @@ def create_object(
         #       target b'\x001' (001).
         #
         # Note: b'.', b'..' and b'/' are valid symlink targets
-        # assert next_symlinkable_byte is not b'\x00'
-        # os.symlink(next_symlinkable_byte, name)
-        pass
+        os.symlink(next_symlinkable_byte(os.path.basename(name)), name, dir_fd=dir_fd)
 
     elif file_type == "next_symlink":
         # symlink to the next valid symlink _name_ byte
@@ -255,42 +1010,364 @@ def create_object(
         #       b'\x377' (255) is reached), return the "first" valid symlink
         #       name b'\x001' (001).
         #
-        # assert next_symlink is not b'..'
-        # assert next_symlink is not b'.'
-        # assert next_symlink is not b'/'
-        # assert next_symlink is not b'\x00'
-        # os.symlink(next_symlink, name)
-        pass
+        # every 1 byte name made this way is one cycle through all of them
+        os.symlink(next_symlink(os.path.basename(name)), name, dir_fd=dir_fd)
 
-    if (mtime_ns is not None) or (atime_ns is not None):
-        # a os.utime call is gonna happen
-        if mtime_ns is None:
-            mtime_ns = os.lstat(name).st_mtime_ns
-        if atime_ns is None:
-            atime_ns = os.lstat(name).st_atime_ns
-        os.utime(
-            name, times=None, ns=(atime_ns, mtime_ns), follow_symlinks=False
-        )  # todo dir_fd
+    elif file_type == "circular_symlink":
+        # target is the next symlink in the cycle
+        assert target
+        os.symlink(target, name, dir_fd=dir_fd)
+
+    elif file_type == "link":
+        # hardlink, target is relative to the dir of name like a symlink target
+        assert target
+        os.link(
+            link_target_path(name, target),
+            name,
+            src_dir_fd=dir_fd,
+            dst_dir_fd=dir_fd,
+            follow_symlinks=False,
+        )
 
+    elif file_type == "fifo":
+        os.mkfifo(name, 0o644, dir_fd=dir_fd)
+
+    created_ns = time.perf_counter_ns()
+    set_times(name, atime_ns=atime_ns, mtime_ns=mtime_ns, dir_fd=dir_fd)
+
+    end_ns = time.perf_counter_ns()
+    with PHASE_NS_LOCK:
+        PHASE_NS["create"] += created_ns - start_ns
+        PHASE_NS["utime"] += end_ns - created_ns
     return
 
 
-def make_times_around_epoch_to_32bit_limit(
-    root_dir: bytes,
-    dest_dir: bytes,
-    file_type: str,
-    count: int,
-    target: None | bytes,
-    verbose: bool | int | float = False,
-):
-    make_working_dir(dest_dir)
+class AngryObject(NamedTuple):
+    # one object of a test set, path is relative to the dest_dir of the set
+    path: bytes
+    file_type: str  # create_object() file_type, or "working_dir"
+    target: None | bytes
+    content: None | bytes
+    atime_ns: None | int = None
+    mtime_ns: None | int = None
+    size: None | int = None  # file or sparse_file length, content is not used
+    mode: None | int = None  # permission bits, not applied to symlinks
+    uid: None | int = None
+    gid: None | int = None
+    # (name, value) pairs, None is as large a value as the fs takes, see settable_xattrs()
+    xattrs: None | tuple[tuple[bytes, None | bytes], ...] = None
+
+    def has_metadata(self) -> bool:
+        # set by apply_metadata() after everything is created
+        return not (
+            self.atime_ns is None
+            and self.mtime_ns is None
+            and self.mode is None
+            and self.uid is None
+            and self.gid is None
+            and self.xattrs is None
+        )
+
+
+class TemplateSource:
+    """
+    template_file cloned once into an unlinked_file() on the fs of dir_fd
+
+    write() makes each copy as a reflink or copy_file_range of it, so no data
+    goes through python, or with hardlink as a link to it. the links never
+    share the inode of template_file itself, and a new clone is started when
+    the fs runs out of links to one inode. only an O_TMPFILE can be linked
+    from its fd, without them the first copy is what the others link to
+    """
+
+    def __init__(
+        self,
+        template_file: bytes | str,
+        *,
+        dir_fd: int,
+        hardlink: bool = False,
+    ):
+        self.template_file = template_file
+        self.dir_fd = dir_fd
+        self.hardlink = hardlink
+        self.mode = stat.S_IMODE(os.stat(template_file).st_mode)
+        self.lock = threading.Lock()
+        self.fd = self._clone()
+        # (dir_fd, name) of the copy links are made to when fd can not be linked
+        self.link_source: None | tuple[int, bytes] = None
+
+    def _clone(self) -> int:
+        fd = unlinked_file(dir_fd=self.dir_fd, prefix="template")
+        try:
+            template_fd = os.open(self.template_file, os.O_RDONLY | os.O_CLOEXEC)
+            try:
+                clone_file(template_fd, fd)
+            finally:
+                os.close(template_fd)
+            os.fchmod(fd, self.mode)
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    def write(self, name: bytes, *, dir_fd: int, private: bool = False) -> None:
+        # private makes a copy even with hardlink, for names with their own metadata
+        fd = self.fd
+        link_source = self.link_source
+        if self.hardlink and not private:
+            try:
+                if link_source is None:
+                    os.link(
+                        f"/proc/self/fd/{fd}",
+                        name,
+                        dst_dir_fd=dir_fd,
+                        follow_symlinks=True,
+                    )
+                else:
+                    os.link(
+                        link_source[1],
+                        name,
+                        src_dir_fd=link_source[0],
+                        dst_dir_fd=dir_fd,
+                        follow_symlinks=False,
+                    )
+                return
+            except OSError as e:
+                if e.errno == errno.ENOENT and link_source is None:
+                    # fd is not an O_TMPFILE, this copy is linked to instead
+                    self._copy(name, dir_fd=dir_fd)
+                    with self.lock:
+                        if self.link_source is None:
+                            self.link_source = (dir_fd, name)
+                    return
+                if e.errno != errno.EMLINK:
+                    raise
+            with self.lock:
+                if link_source is not None:
+                    if self.link_source == link_source:
+                        self.link_source = None
+                elif self.fd == fd:
+                    self.fd = self._clone()
+                    os.close(fd)
+            self.write(name, dir_fd=dir_fd)
+            return
+        self._copy(name, dir_fd=dir_fd)
+
+    def _copy(self, name: bytes, *, dir_fd: int) -> None:
+        new_fd = os.open(
+            name,
+            os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC,
+            0o600,
+            dir_fd=dir_fd,
+        )
+        try:
+            clone_file(self.fd, new_fd)
+            os.fchmod(new_fd, self.mode)
+        finally:
+            os.close(new_fd)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def create_objects(
+    angry_objects: Iterable[AngryObject],
+    *,
+    dir_fd: int,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+    source_fd: None | int = None,
+) -> int:
+    """
+    source_fd is what files with a size are filled from, see pattern_file().
+    files without content or size are TemplateSource copies of template_file
+    """
+    template = None
+    if template_file:
+        template = TemplateSource(
+            template_file, dir_fd=dir_fd, hardlink=template_hardlink
+        )
+    try:
+        return _create_objects(
+            angry_objects, dir_fd=dir_fd, template=template, source_fd=source_fd
+        )
+    finally:
+        if template is not None:
+            template.close()
+
+
+def _create_one(
+    angry_object: AngryObject,
+    *,
+    dir_fd: int,
+    template: None | TemplateSource,
+    source_fd: None | int,
+) -> None:
+    if SIMULATED_LATENCY_S:
+        time.sleep(SIMULATED_LATENCY_S)
+    if angry_object.file_type == "working_dir":
+        make_working_dir(angry_object.path, dir_fd=dir_fd)
+        return
+    if (
+        template is not None
+        and angry_object.file_type == "file"
+        and angry_object.content is None
+        and angry_object.size is None
+    ):
+        start_ns = time.perf_counter_ns()
+        template.write(
+            angry_object.path, dir_fd=dir_fd, private=angry_object.has_metadata()
+        )
+        with PHASE_NS_LOCK:
+            PHASE_NS["create"] += time.perf_counter_ns() - start_ns
+        return
+    create_object(
+        name=angry_object.path,
+        file_type=angry_object.file_type,
+        content=angry_object.content,
+        target=angry_object.target,
+        dir_fd=dir_fd,
+        size=angry_object.size,
+        source_fd=source_fd,
+    )
+
+
+def _create_objects(
+    angry_objects: Iterable[AngryObject],
+    *,
+    dir_fd: int,
+    template: None | TemplateSource,
+    source_fd: None | int,
+) -> int:
+    """
+    with IN_FLIGHT > 1 up to that many creates run at once on a thread pool.
+    an object is only submitted once the dir it goes in (if made by this
+    call) exists, and the first hardlink to a file once everything before it
+    is made, so the order the objects come in is all that is needed
+
+    times, modes and owners are left to one apply_metadata() pass at the end
+    """
+    created = 0
+    with_metadata = []
+    if IN_FLIGHT == 1:
+        for angry_object in angry_objects:
+            _create_one(
+                angry_object, dir_fd=dir_fd, template=template, source_fd=source_fd
+            )
+            if angry_object.file_type != "working_dir":
+                created += 1
+                if angry_object.has_metadata():
+                    with_metadata.append(angry_object)
+        apply_metadata(with_metadata, dir_fd=dir_fd)
+        return created
+
+    in_flight = deque()
+    pending_dirs = {}
+    link_targets = set()
+    with ThreadPoolExecutor(max_workers=IN_FLIGHT) as executor:
+        for angry_object in angry_objects:
+            parent = os.path.dirname(angry_object.path)
+            if parent in pending_dirs:
+                pending_dirs.pop(parent).result()
+            if angry_object.file_type == "link":
+                link_target = link_target_path(angry_object.path, angry_object.target)
+                if link_target not in link_targets:
+                    # the file it links to may still be in flight
+                    while in_flight:
+                        in_flight.popleft().result()
+                    link_targets.add(link_target)
+            if len(in_flight) == IN_FLIGHT:
+                in_flight.popleft().result()
+            future = executor.submit(
+                _create_one,
+                angry_object,
+                dir_fd=dir_fd,
+                template=template,
+                source_fd=source_fd,
+            )
+            in_flight.append(future)
+            if ENTRY_TYPES[angry_object.file_type] == "dir":
+                pending_dirs[angry_object.path] = future
+            if angry_object.file_type != "working_dir":
+                created += 1
+                if angry_object.has_metadata():
+                    with_metadata.append(angry_object)
+        for future in in_flight:
+            future.result()
+    apply_metadata(with_metadata, dir_fd=dir_fd)
+    return created
+
+
+def apply_metadata(angry_objects: Iterable[AngryObject], *, dir_fd: int) -> None:
+    """
+    chown, chmod then set_times() each object, batched by the dir it is in
+    so each dir is opened once and every call is relative to it
 
-    def _write_object(
+    the deepest dirs go first, so a dir is only made unsearchable or has its
+    mtime set after nothing more is created, changed or opened inside it.
+    chown comes before chmod since it clears setuid and setgid, xattrs go on
+    through one fd per object before chmod can take away the right to open it.
+    xattrs the fs does not take are skipped, and counted with ic() since
+    every worker applying a set would say the same
+    """
+    by_dir = defaultdict(list)
+    for angry_object in angry_objects:
+        by_dir[os.path.dirname(angry_object.path)].append(angry_object)
+    if not by_dir:
+        return
+    start_ns = time.perf_counter_ns()
+    skipped_xattrs = 0
+    for parent in sorted(
+        by_dir, key=lambda _dir: _dir.count(b"/") + bool(_dir), reverse=True
+    ):
+        with open_dir_fd(parent or b".", dir_fd=dir_fd) as parent_fd:
+            for angry_object in by_dir[parent]:
+                name = os.path.basename(angry_object.path)
+                if angry_object.uid is not None or angry_object.gid is not None:
+                    os.chown(
+                        name,
+                        -1 if angry_object.uid is None else angry_object.uid,
+                        -1 if angry_object.gid is None else angry_object.gid,
+                        dir_fd=parent_fd,
+                        follow_symlinks=False,
+                    )
+                if angry_object.xattrs is not None:
+                    settable = settable_xattrs(
+                        angry_object.xattrs, support=xattr_support(parent_fd)
+                    )
+                    skipped_xattrs += len(angry_object.xattrs) - len(settable)
+                    fd = _open_for_xattrs(name, dir_fd=parent_fd)
+                    try:
+                        for xattr_name, value in settable:
+                            os.setxattr(fd, xattr_name, value)
+                    finally:
+                        os.close(fd)
+                if (
+                    angry_object.mode is not None
+                    and ENTRY_TYPES[angry_object.file_type] != "symlink"
+                ):
+                    os.chmod(name, angry_object.mode, dir_fd=parent_fd)
+                set_times(
+                    name,
+                    atime_ns=angry_object.atime_ns,
+                    mtime_ns=angry_object.mtime_ns,
+                    dir_fd=parent_fd,
+                )
+    with PHASE_NS_LOCK:
+        PHASE_NS["metadata"] += time.perf_counter_ns() - start_ns
+    if skipped_xattrs:
+        ic(skipped_xattrs)
+
+
+def iter_times_around_epoch_to_32bit_limit(
+    *,
+    file_type: str,
+) -> Iterator[AngryObject]:
+    def _object(
         *,
         atime_ns: int,
         mtime_ns: int,
-        file_type: str,
-    ):
+    ) -> AngryObject:
         if atime_ns >= 0:
             _name_a = f"atime_ns:+{atime_ns:019}"
         else:
@@ -303,14 +1380,11 @@ def make_times_around_epoch_to_32bit_limit(
 
         _name = f"{_name_a}__{_name_m}"
 
-        _destination = (
-            Path(os.fsdecode(root_dir)) / Path(os.fsdecode(dest_dir)) / Path(_name)
-        )
-        create_object(
-            name=os.fsencode(_destination),
+        return AngryObject(
+            path=os.fsencode(_name),
             file_type=file_type,
-            content=None,
             target=None,
+            content=None,
             atime_ns=atime_ns,
             mtime_ns=mtime_ns,
         )
@@ -320,9 +1394,9 @@ def make_times_around_epoch_to_32bit_limit(
     while True:
         ic(_ns)
         _atime_ns = _mtime_ns = _ns
-        _write_object(file_type=file_type, atime_ns=_atime_ns, mtime_ns=_mtime_ns)
+        yield _object(atime_ns=_atime_ns, mtime_ns=_mtime_ns)
         if _ns != 0:
-            _write_object(file_type=file_type, atime_ns=-_atime_ns, mtime_ns=-_mtime_ns)
+            yield _object(atime_ns=-_atime_ns, mtime_ns=-_mtime_ns)
         if _ns == 0:
             _ns += 1
         else:
@@ -332,27 +1406,63 @@ def make_times_around_epoch_to_32bit_limit(
         if _ns >= _last_32bit_nanosecond:
             _ns = _last_32bit_nanosecond
             _atime_ns = _mtime_ns = _ns
-            _write_object(
-                file_type=file_type, atime_ns=_atime_ns - 1, mtime_ns=_mtime_ns - 1
+            yield _object(
+                atime_ns=_atime_ns - 1, mtime_ns=_mtime_ns - 1
             )  # one nanosecond before 32bit limit
-            _write_object(
-                file_type=file_type,
-                atime_ns=-(_atime_ns - 1),
-                mtime_ns=-(_mtime_ns - 1),
-            )
-            _write_object(file_type=file_type, atime_ns=_atime_ns, mtime_ns=_mtime_ns)
-            _write_object(file_type=file_type, atime_ns=-_atime_ns, mtime_ns=-_mtime_ns)
+            yield _object(atime_ns=-(_atime_ns - 1), mtime_ns=-(_mtime_ns - 1))
+            yield _object(atime_ns=_atime_ns, mtime_ns=_mtime_ns)
+            yield _object(atime_ns=-_atime_ns, mtime_ns=-_mtime_ns)
             break
 
-    with chdir(root_dir):
-        check_file_count(
-            dest_dir=dest_dir,
+
+def make_times_around_epoch_to_32bit_limit(
+    root_dir: bytes,
+    dest_dir: bytes,
+    file_type: str,
+    count: int,
+    target: None | bytes,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+    verbose: bool | float = False,
+):
+    make_working_dir(dest_dir, root_dir=root_dir)
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        create_objects(
+            iter_times_around_epoch_to_32bit_limit(file_type=file_type),
+            dir_fd=dest_fd,
+            template_file=template_file,
+            template_hardlink=template_hardlink,
+        )
+        check_file_count(
+            dest_dir=dest_dir,
             count=count,
             file_type=file_type,
+            dir_fd=dest_fd,
         )
     return
 
 
+def iter_all_one_byte_objects(
+    *,
+    file_type: str,
+    target: None | bytes,
+    self_content: bool,
+    prepend: None | bytes = None,
+) -> Iterator[AngryObject]:
+    for byte in writable_one_byte_filenames():
+        if prepend:
+            byte = prepend + byte
+        content = None
+        if self_content:
+            content = byte
+        yield AngryObject(
+            path=byte,
+            file_type=file_type,
+            target=target,
+            content=content,
+        )
+
+
 def make_all_one_byte_objects(
     *,
     root_dir: bytes,
@@ -362,71 +1472,152 @@ def make_all_one_byte_objects(
     target: None | bytes,
     self_content: bool,
     prepend: None | bytes = None,
-    verbose: bool | int | float = False,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+    verbose: bool | float = False,
 ):
-    make_working_dir(dest_dir)
-
-    with chdir(dest_dir):
-        for byte in writable_one_byte_filenames():
-            if prepend:
-                byte = prepend + byte
-            if self_content:
-                create_object(
-                    name=byte,
-                    file_type=file_type,
-                    target=target,
-                    content=byte,
-                )
-            else:
-                create_object(
-                    name=byte,
-                    file_type=file_type,
-                    target=target,
-                    content=None,
-                )
-
-    with chdir(root_dir):
+    make_working_dir(dest_dir, root_dir=root_dir)
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        create_objects(
+            iter_all_one_byte_objects(
+                file_type=file_type,
+                target=target,
+                self_content=self_content,
+                prepend=prepend,
+            ),
+            dir_fd=dest_fd,
+            template_file=template_file,
+            template_hardlink=template_hardlink,
+        )
         check_file_count(
             dest_dir=dest_dir,
             count=count,
             file_type=file_type,
+            dir_fd=dest_fd,
         )
 
 
-def make_all_one_byte_objects_each_in_byte_number_folder(
+def iter_all_one_byte_objects_each_in_byte_number_folder(
     *,
-    root_dir: bytes,
-    dest_dir: bytes,
     file_type: str,
-    count: int,
     self_content: bool,
     prepend: None | bytes = None,
-    verbose: bool | int | float = False,
-) -> None:
-    make_working_dir(dest_dir)
-    os.chdir(dest_dir)
+) -> Iterator[AngryObject]:
     for byte in writable_one_byte_filenames():
-        byte_folder = str(ord(byte)).zfill(3)
-        make_working_dir(byte_folder.encode("utf8"))
-        os.chdir(byte_folder)
+        byte_folder = str(ord(byte)).zfill(3).encode("utf8")
+        yield AngryObject(
+            path=byte_folder,
+            file_type="working_dir",
+            target=None,
+            content=None,
+        )
         content = None
         if self_content:
             content = byte
         if prepend:
             byte = prepend + byte
-        create_object(
-            name=byte,
+        yield AngryObject(
+            path=byte_folder + b"/" + byte,
             file_type=file_type,
-            content=content,
             target=b".",
+            content=content,
+        )
+
+
+def make_all_one_byte_objects_each_in_byte_number_folder(
+    *,
+    root_dir: bytes,
+    dest_dir: bytes,
+    file_type: str,
+    count: int,
+    self_content: bool,
+    prepend: None | bytes = None,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+    verbose: bool | float = False,
+) -> None:
+    make_working_dir(dest_dir, root_dir=root_dir)
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        create_objects(
+            iter_all_one_byte_objects_each_in_byte_number_folder(
+                file_type=file_type,
+                self_content=self_content,
+                prepend=prepend,
+            ),
+            dir_fd=dest_fd,
+            template_file=template_file,
+            template_hardlink=template_hardlink,
+        )
+        check_file_count(
+            dest_dir=dest_dir,
+            count=count,
+            file_type=file_type,
+            dir_fd=dest_fd,
         )
-        os.chdir(b"../")
-    os.chdir(root_dir)
-    check_file_count(
-        dest_dir=dest_dir,
-        count=count,
+
+
+def iter_all_two_byte_objects(
+    *,
+    file_type: str,
+    target: None | bytes,
+    first_bytes: None | Iterable[bytes] = None,
+) -> Iterator[AngryObject]:
+    # first_bytes limits the names to those shards
+    names = writable_two_byte_filenames()
+    if first_bytes is None:
+        shards = [names]
+    else:
+        shards = [names.shard(first_byte) for first_byte in first_bytes]
+    for shard in shards:
+        for file_name in shard:
+            yield AngryObject(
+                path=file_name,
+                file_type=file_type,
+                target=target,
+                content=None,
+            )
+
+
+def _make_two_byte_shard(
+    *,
+    dir_fd: int,
+    dest_dir: bytes,
+    first_byte: bytes,
+    file_type: str,
+    target: None | bytes,
+    resuming: bool = False,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+) -> int:
+    # one shard is every two byte name starting with first_byte
+    angry_objects = iter_all_two_byte_objects(
         file_type=file_type,
+        target=target,
+        first_bytes=[first_byte],
     )
+    shard = first_byte.hex()
+    if resuming:
+        count = JOURNAL.result(dest_dir, shard)
+        if count is not None:
+            return count
+        # not journaled, so it may be partly made
+        _unlink_batch(
+            [angry_object.path for angry_object in angry_objects], dir_fd=dir_fd
+        )
+        angry_objects = iter_all_two_byte_objects(
+            file_type=file_type,
+            target=target,
+            first_bytes=[first_byte],
+        )
+    count = create_objects(
+        angry_objects,
+        dir_fd=dir_fd,
+        template_file=template_file,
+        template_hardlink=template_hardlink,
+    )
+    if JOURNAL is not None:
+        JOURNAL.record(dest_dir, shard, count)
+    return count
 
 
 def make_all_two_byte_objects(
@@ -436,27 +1627,66 @@ def make_all_two_byte_objects(
     file_type: str,
     count: int,
     target: None | bytes,
-    verbose: bool | int | float = False,
+    jobs: int = 1,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+    verbose: bool | float = False,
 ) -> None:
-    make_working_dir(dest_dir)
-    os.chdir(dest_dir)
-    for first_byte in valid_filename_bytes():
-        for second_byte in valid_filename_bytes():
-            file_name = first_byte + second_byte
-            if (
-                file_name != b".."
-            ):  # '..' is not a valid 2 byte file name but is a valid symlink destination
-                create_object(
-                    name=file_name,
+    # 254 shards keyed by first byte, run on jobs threads sharing the dest_dir fd
+    resuming = JOURNAL is not None and os.path.isdir(
+        os.path.join(os.fsencode(root_dir), dest_dir)
+    )
+    make_working_dir(dest_dir, root_dir=root_dir, exist_ok=resuming)
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                first_byte: executor.submit(
+                    _make_two_byte_shard,
+                    dir_fd=dest_fd,
+                    dest_dir=dest_dir,
+                    first_byte=first_byte,
                     file_type=file_type,
                     target=target,
-                    content=None,
+                    resuming=resuming,
+                    template_file=template_file,
+                    template_hardlink=template_hardlink,
                 )
-    os.chdir(root_dir)
-    check_file_count(
-        dest_dir=dest_dir,
-        count=count,
-        file_type=file_type,
+                for first_byte in sorted(valid_filename_bytes())
+            }
+            shard_counts = {
+                first_byte: future.result() for first_byte, future in futures.items()
+            }
+        ic(shard_counts)
+        shard_total = sum(shard_counts.values())
+        if shard_total != count:
+            # not fatal, verify_tree() reports the difference
+            print(
+                "dest_dir:",
+                dest_dir,
+                "shards made",
+                shard_total,
+                "Expected:",
+                count,
+                file=sys.stderr,
+            )
+        check_file_count(
+            dest_dir=dest_dir,
+            count=count,
+            file_type=file_type,
+            dir_fd=dest_fd,
+        )
+
+
+def iter_one_all_byte_file() -> Iterator[AngryObject]:
+    file_name = b""
+    for next_byte in sorted(valid_filename_bytes()):
+        file_name += next_byte
+    # print(repr(file_name))
+    yield AngryObject(
+        path=file_name,
+        file_type="file",
+        target=b".",
+        content=None,
     )
 
 
@@ -465,27 +1695,59 @@ def make_one_all_byte_file(
     root_dir: bytes,
     dest_dir: bytes,
     template_file: None | bytes,
-    verbose: bool | int | float = False,
+    template_hardlink: bool = False,
+    verbose: bool | float = False,
 ) -> None:
-    make_working_dir(dest_dir)
-    os.chdir(dest_dir)
-    file_name = b""
-    for next_byte in valid_filename_bytes():
-        file_name += next_byte
-    # print(repr(file_name))
-    create_object(
-        name=file_name,
-        file_type="file",
-        template_file=template_file,
-        content=None,
-        target=b".",
-    )
-    os.chdir(root_dir)
-    check_file_count(
-        dest_dir=dest_dir,
-        count=1,
-        file_type="file",
-    )
+    make_working_dir(dest_dir, root_dir=root_dir)
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        create_objects(
+            iter_one_all_byte_file(),
+            dir_fd=dest_fd,
+            template_file=template_file,
+            template_hardlink=template_hardlink,
+        )
+        check_file_count(
+            dest_dir=dest_dir,
+            count=1,
+            file_type="file",
+            dir_fd=dest_fd,
+        )
+
+
+def iter_all_length_objects(
+    *,
+    file_type: str,
+    self_content: bool,
+    target: None | bytes,
+    all_bytes: bool,
+) -> Iterator[AngryObject]:
+    byte_length = 1
+    all_valid_bytes = list(valid_filename_bytes())
+    assert all_valid_bytes
+    all_valid_bytes.sort(reverse=True)
+    file_name = None
+    while byte_length < 256:
+        if all_bytes:
+            try:
+                next_byte = all_valid_bytes.pop()
+            except IndexError:
+                next_byte = b"\x01"
+            if file_name is None:
+                file_name = next_byte
+            else:
+                file_name = file_name + next_byte
+        else:
+            file_name = b"a" * byte_length
+        content = None
+        if self_content:
+            content = file_name
+        yield AngryObject(
+            path=file_name,
+            file_type=file_type,
+            target=target,
+            content=content,
+        )
+        byte_length += 1
 
 
 def make_all_length_objects(
@@ -497,345 +1759,4165 @@ def make_all_length_objects(
     self_content: bool,
     target: None | bytes,
     all_bytes: bool,
-    verbose: bool | int | float = False,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+    verbose: bool | float = False,
 ) -> None:
-    make_working_dir(dest_dir)
-    with chdir(
-        dest_dir,
-    ):
-        byte_length = 1
-        all_valid_bytes = list(valid_filename_bytes())
-        assert all_valid_bytes
-        all_valid_bytes.sort(reverse=True)
-        file_name = None
-        while byte_length < 256:
-            if all_bytes:
-                try:
-                    next_byte = all_valid_bytes.pop()
-                except IndexError:
-                    next_byte = b"\x01"
-                if file_name is None:
-                    file_name = next_byte
-                else:
-                    file_name = file_name + next_byte
-            else:
-                file_name = b"a" * byte_length
-            if self_content:
-                create_object(
-                    name=file_name,
-                    file_type=file_type,
-                    target=target,
-                    content=file_name,
-                )
-            else:
-                create_object(
-                    name=file_name,
-                    file_type=file_type,
-                    target=target,
-                    content=None,
-                )
-            byte_length += 1
-
-    with chdir(
-        root_dir,
-    ):
+    make_working_dir(dest_dir, root_dir=root_dir)
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        create_objects(
+            iter_all_length_objects(
+                file_type=file_type,
+                self_content=self_content,
+                target=target,
+                all_bytes=all_bytes,
+            ),
+            dir_fd=dest_fd,
+            template_file=template_file,
+            template_hardlink=template_hardlink,
+        )
         check_file_count(
             dest_dir=dest_dir,
             count=count,
             file_type=file_type,
+            dir_fd=dest_fd,
         )
 
 
-def check_file_count(
-    dest_dir: bytes,
+def _hash_index_leaf(
+    index: int,
+    *,
+    algorithm: str,
+    depth: int,
+    width: int,
+) -> tuple[bytes, bytes, bytes]:
+    # (prefix dirs, hexdigest name, content), the name is the hash of the content
+    content = str(index).encode("utf8")
+    name = hashlib.new(algorithm, content).hexdigest().encode("utf8")
+    prefix = b"/".join(
+        name[level * width : (level + 1) * width] for level in range(depth)
+    )
+    return prefix, name, content
+
+
+def iter_hash_index_tree(
+    *,
     count: int,
-    file_type: str,
-    verbose: bool | int | float = False,
-):
-    if not os.path.isdir(dest_dir):
-        print("dest_dir:", dest_dir, "is not a dir")
-        os._exit(1)
-    manual_count = len(os.listdir(dest_dir))
-    if manual_count != count:
-        print("dest_dir:", dest_dir, "has", manual_count, "files. Expected:", count)
-        os._exit(1)
-    TOTALS_DICT[file_type] += manual_count
+    algorithm: str = "sha1",
+    depth: int = 3,
+    width: int = 1,
+) -> Iterator[AngryObject]:
+    """
+    a content addressed index like .iridb/.../e/1/3/e13...
 
+    leaf i holds str(i) and is named by its hexdigest, nested under depth
+    dirs named by the next width hex chars of the digest (16**width fan-out).
+    only the prefix dirs already yielded are held in memory
+    """
+    assert 1 <= depth <= 5
+    seen_dirs = set()
+    for index in range(count):
+        prefix, name, content = _hash_index_leaf(
+            index, algorithm=algorithm, depth=depth, width=width
+        )
+        parts = prefix.split(b"/")
+        for level in range(1, depth + 1):
+            _dir = b"/".join(parts[:level])
+            if _dir not in seen_dirs:
+                seen_dirs.add(_dir)
+                yield AngryObject(
+                    path=_dir,
+                    file_type="working_dir",
+                    target=None,
+                    content=None,
+                )
+        yield AngryObject(
+            path=prefix + b"/" + name,
+            file_type="file",
+            target=None,
+            content=content,
+        )
 
-def main(
-    root_dir,
-    long_tests: bool,
-    verbose: bool | int | float = False,
-):
-    # 1 byte names
-    # expected file count = 255 - 2 = 253 (. and / note 0 is NULL)
-    # /bin/ls -A 1/1_byte_file_names | wc -l returns 254 because one file is '\n'
-    make_all_one_byte_objects(
-        root_dir=root_dir,
-        dest_dir=b"files/all_1_byte_file_names",
-        file_type="file",
-        count=253,
-        self_content=False,
-        target=None,
-    )
-    make_all_one_byte_objects(
-        root_dir=root_dir,
-        dest_dir=b"files/all_1_byte_file_names_with_a_~_folder/~",
-        file_type="file",
-        count=253,
-        self_content=False,
-        target=None,
-    )  # 254 not 253 because of the ~ parent dir, but cant set here
-    make_all_one_byte_objects(
-        root_dir=root_dir,
-        dest_dir=b"files/all_1_byte_file_names_prepended_with_~",
-        file_type="file",
-        count=253,
-        self_content=False,
-        target=None,
-        prepend=b"~",
-    )
-    make_all_one_byte_objects(
-        root_dir=root_dir,
-        dest_dir=b"files/all_1_byte_file_names_self_content",
-        file_type="file",
-        count=253,
-        self_content=True,
-        target=None,
-    )
-    make_all_one_byte_objects_each_in_byte_number_folder(
-        root_dir=root_dir,
-        dest_dir=b"files/all_1_byte_file_names_one_per_folder",
-        file_type="file",
-        count=253,
-        self_content=False,
-    )
-    make_all_one_byte_objects_each_in_byte_number_folder(
-        root_dir=root_dir,
-        dest_dir=b"files/all_1_byte_file_names_one_per_folder_prepended_with_~",
-        file_type="file",
-        count=253,
-        self_content=False,
-        prepend=b"~",
+
+def _make_hash_index_shard(
+    *,
+    dir_fd: int,
+    top: bytes,
+    leaves: list[tuple[bytes, bytes, bytes]],
+    created_dirs: set[bytes],
+    dest_dir: bytes,
+    shard: str,
+    resuming: bool = False,
+    template: None | TemplateSource = None,
+) -> tuple[int, int]:
+    # every leaf of one batch under one top level prefix dir, returns (dirs, files)
+    new_dirs = set()
+    for prefix, _, _ in leaves:
+        parts = prefix.split(b"/")
+        for level in range(1, len(parts) + 1):
+            _dir = b"/".join(parts[:level])
+            if _dir not in created_dirs:
+                new_dirs.add(_dir)
+    if resuming:
+        counts = JOURNAL.result(dest_dir, shard)
+        if counts is not None:
+            created_dirs.update(new_dirs)
+            return tuple(counts)
+    for _dir in sorted(new_dirs):  # parents sort before their children
+        try:
+            os.mkdir(_dir, dir_fd=dir_fd)
+        except FileExistsError:
+            if not resuming:
+                raise
+        created_dirs.add(_dir)
+    names = [
+        prefix[len(top) + 1 :] + b"/" + name if b"/" in prefix else name
+        for prefix, name, _ in leaves
+    ]
+    with open_dir_fd(top, dir_fd=dir_fd) as top_fd:
+        if resuming:
+            _unlink_batch(names, dir_fd=top_fd)  # not journaled, may be partly made
+        _create_objects(
+            (
+                AngryObject(
+                    path=name,
+                    file_type="file",
+                    target=None,
+                    content=None if template is not None else content,
+                )
+                for name, (_, _, content) in zip(names, leaves, strict=True)
+            ),
+            dir_fd=top_fd,
+            template=template,
+            source_fd=None,
+        )
+    if JOURNAL is not None:
+        JOURNAL.record(dest_dir, shard, (len(new_dirs), len(leaves)))
+    return len(new_dirs), len(leaves)
+
+
+def make_hash_index_tree(
+    *,
+    root_dir: bytes,
+    dest_dir: bytes,
+    count: int,
+    algorithm: str = "sha1",
+    depth: int = 3,
+    width: int = 1,
+    jobs: int = 1,
+    batch_size: int = 2**16,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+) -> None:
+    """
+    build iter_hash_index_tree() on disk in batches of batch_size leaves
+
+    each batch is split by top level prefix and the prefixes run on jobs
+    threads, so memory is bounded by the batch and the prefix dirs. with
+    template_file the leaves are copies of it instead of their index
+    """
+    assert 1 <= depth <= 5
+    resuming = JOURNAL is not None and os.path.isdir(
+        os.path.join(os.fsencode(root_dir), dest_dir)
     )
-    make_all_one_byte_objects_each_in_byte_number_folder(
-        root_dir=root_dir,
-        dest_dir=b"dirs/all_1_byte_dir_names_one_per_folder",
-        file_type="dir",
-        count=253,
-        self_content=False,
-    )  # not counting the parent int folders?
-    make_all_one_byte_objects(
-        root_dir=root_dir,
-        dest_dir=b"dirs/all_1_byte_dir_names",
-        file_type="dir",
-        count=253,
-        self_content=False,
+    make_working_dir(dest_dir, root_dir=root_dir, exist_ok=resuming)
+    created_dirs: dict[bytes, set[bytes]] = defaultdict(set)
+    dir_count = 0
+    file_count = 0
+    with open_dir_fd(
+        os.path.join(os.fsencode(root_dir), dest_dir)
+    ) as dest_fd, ThreadPoolExecutor(max_workers=jobs) as executor:
+        template = None
+        if template_file:
+            template = TemplateSource(
+                template_file, dir_fd=dest_fd, hardlink=template_hardlink
+            )
+        for batch_start in range(0, count, batch_size):
+            shards = defaultdict(list)
+            for index in range(batch_start, min(batch_start + batch_size, count)):
+                leaf = _hash_index_leaf(
+                    index, algorithm=algorithm, depth=depth, width=width
+                )
+                shards[leaf[0][:width]].append(leaf)
+            futures = [
+                executor.submit(
+                    _make_hash_index_shard,
+                    dir_fd=dest_fd,
+                    top=top,
+                    leaves=leaves,
+                    created_dirs=created_dirs[top],
+                    dest_dir=dest_dir,
+                    shard=f"{batch_start}/{top.decode('ascii')}",
+                    resuming=resuming,
+                    template=template,
+                )
+                for top, leaves in shards.items()
+            ]
+            for future in futures:  # a prefix is only ever in one running shard
+                _dir_count, _file_count = future.result()
+                dir_count += _dir_count
+                file_count += _file_count
+        if template is not None:
+            template.close()
+    ic(dest_dir, dir_count, file_count)
+    if file_count != count:
+        print(
+            "dest_dir:",
+            dest_dir,
+            "has",
+            file_count,
+            "files. Expected:",
+            count,
+            file=sys.stderr,
+        )
+    count_total("working_dir", dir_count)
+    count_total("file", file_count)
+
+
+def iter_random_tree(
+    *,
+    seed: int,
+    count: int,
+    min_name_length: int = 1,
+    max_name_length: int = 255,
+    max_depth: int = 4,
+    dir_ratio: float = 0.1,
+    utf8: bool = False,
+) -> Iterator[AngryObject]:
+    """
+    count random files and dirs, the same seed always gives the same tree
+
+    each object goes in a dir picked from a depth chosen uniformly among
+    the depths made so far, and is a dir with probability dir_ratio unless
+    it would be deeper than max_depth. with utf8 the names are valid utf8
+    """
+    # paths are relative to the dest_dir fd and must fit in PATH_MAX
+    assert (max_depth + 1) * (max_name_length + 1) <= 4096
+    rng = random.Random(seed)
+    if utf8:
+        names = iter_random_utf8_filenames(
+            rng, min_length=min_name_length, max_length=max_name_length
+        )
+    else:
+        names = iter_random_filenames(
+            rng, min_length=min_name_length, max_length=max_name_length
+        )
+    dirs_by_depth = [[b""]]
+    seen = set()  # 8 byte digests, a false collision only redraws the name
+    for _ in range(count):
+        depth = rng.randrange(len(dirs_by_depth))
+        parent = rng.choice(dirs_by_depth[depth])
+        is_dir = depth < max_depth and rng.random() < dir_ratio
+        while True:
+            path = os.path.join(parent, next(names)) if parent else next(names)
+            key = hashlib.blake2b(path, digest_size=8).digest()
+            if key not in seen:
+                break
+        seen.add(key)
+        if is_dir:
+            if depth + 1 == len(dirs_by_depth):
+                dirs_by_depth.append([])
+            dirs_by_depth[depth + 1].append(path)
+        yield AngryObject(
+            path=path,
+            file_type="dir" if is_dir else "file",
+            target=None,
+            content=None,
+        )
+
+
+def make_random_tree(
+    *,
+    root_dir: bytes,
+    dest_dir: bytes,
+    seed: int,
+    count: int,
+    min_name_length: int = 1,
+    max_name_length: int = 255,
+    max_depth: int = 4,
+    dir_ratio: float = 0.1,
+    utf8: bool = False,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+) -> None:
+    make_working_dir(dest_dir, root_dir=root_dir)
+    type_counts = defaultdict(int)
+
+    def counted(angry_objects):
+        for angry_object in angry_objects:
+            type_counts[angry_object.file_type] += 1
+            yield angry_object
+
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        create_objects(
+            counted(
+                iter_random_tree(
+                    seed=seed,
+                    count=count,
+                    min_name_length=min_name_length,
+                    max_name_length=max_name_length,
+                    max_depth=max_depth,
+                    dir_ratio=dir_ratio,
+                    utf8=utf8,
+                )
+            ),
+            dir_fd=dest_fd,
+            template_file=template_file,
+            template_hardlink=template_hardlink,
+        )
+    ic(dest_dir, type_counts)
+    for file_type, type_count in type_counts.items():
+        count_total(file_type, type_count)
+
+
+def size_matrix_sizes(max_size: int) -> list[int]:
+    """
+    every size to 1KiB, every KiB to 1MiB, each power of two from 1KiB with
+    a byte either side of it (block boundaries), and max_size
+    """
+    sizes = set(range(min(1024, max_size) + 1))
+    sizes.update(range(1024, min(2**20, max_size) + 1, 1024))
+    power = 1024
+    while power <= max_size:
+        sizes.update((power - 1, power, power + 1))
+        power *= 2
+    sizes.add(max_size)
+    return sorted(size for size in sizes if size <= max_size)
+
+
+def iter_size_matrix(
+    *,
+    max_size: int,
+    sparse: bool,
+) -> Iterator[AngryObject]:
+    # named by size, sparse adds one more as large as the fs allows
+    file_type = "sparse_file" if sparse else "file"
+    for size in size_matrix_sizes(max_size):
+        yield AngryObject(
+            path=b"%d" % size,
+            file_type=file_type,
+            target=None,
+            content=None,
+            size=size,
+        )
+    if sparse:
+        yield AngryObject(
+            path=b"filesystem_max",
+            file_type=file_type,
+            target=None,
+            content=None,
+            size=FILESYSTEM_MAX_SIZE,
+        )
+
+
+def make_size_matrix(
+    *,
+    root_dir: bytes,
+    dest_dir: bytes,
+    max_size: int,
+    sparse: bool,
+) -> None:
+    """
+    sparse files are only truncated, data files are cloned from one
+    pattern_file(), so neither needs a buffer of the file in memory
+    """
+    make_working_dir(dest_dir, root_dir=root_dir)
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        source_fd = None
+        if not sparse:
+            source_fd = pattern_file(dir_fd=dest_fd, size=max_size)
+        try:
+            count = create_objects(
+                iter_size_matrix(max_size=max_size, sparse=sparse),
+                dir_fd=dest_fd,
+                source_fd=source_fd,
+            )
+        finally:
+            if source_fd is not None:
+                os.close(source_fd)
+        check_file_count(
+            dest_dir=dest_dir,
+            count=count,
+            file_type="sparse_file" if sparse else "file",
+            dir_fd=dest_fd,
+        )
+
+
+# edges of the common timestamp formats, in ns. ext4 clamps to its own range.
+# times are set and compared as signed 64 bit ns counts, so edges past 2262
+# (34 bit seconds, 9999) could never round trip and are left out
+TIME_MATRIX_NS = sorted(
+    {
+        0,
+        1,  # smallest step on a ns resolution fs
+        10**9 - 1,  # last ns of the first second
+        10**9,
+        10**9 + 1,
+        (2**31 - 1) * 10**9,  # 2038, signed 32 bit time_t
+        2**31 * 10**9,
+        (2**32 - 1) * 10**9,  # 2106, unsigned 32 bit seconds
+        2**63 - 1,  # 2262, the most a signed 64 bit ns count holds
+    }
+    | {
+        -(10**9) + 1,
+        -1,  # a ns before the epoch
+        -(10**9),
+        -(2**31) * 10**9,  # 1901, signed 32 bit time_t
+        -(2**31) * 10**9 - 1,
+        -(2**63),  # 1677
+    }
+)
+
+
+def iter_mode_matrix(*, file_type: str) -> Iterator[AngryObject]:
+    # every combination of the 12 permission, setuid, setgid and sticky bits
+    for mode in range(0o10000):
+        yield AngryObject(
+            path=b"mode_%04o" % mode,
+            file_type=file_type,
+            target=None,
+            content=None,
+            mode=mode,
+        )
+
+
+def _time_name(kind: str, time_ns: None | int) -> str:
+    if time_ns is None:
+        return f"{kind}:omit"
+    if time_ns >= 0:
+        return f"{kind}:+{time_ns:019}"
+    return f"{kind}:{time_ns:020}"
+
+
+def iter_time_matrix(*, file_type: str) -> Iterator[AngryObject]:
+    # every TIME_MATRIX_NS atime with every mtime, None leaves that time as made
+    times = [None, *TIME_MATRIX_NS]
+    for atime_ns, mtime_ns in itertools.product(times, times):
+        if atime_ns is None and mtime_ns is None:
+            continue
+        yield AngryObject(
+            path=os.fsencode(
+                f"{_time_name('atime_ns', atime_ns)}__{_time_name('mtime_ns', mtime_ns)}"
+            ),
+            file_type=file_type,
+            target=None,
+            content=None,
+            atime_ns=atime_ns,
+            mtime_ns=mtime_ns,
+        )
+
+
+# root, the first user, nobody, the old 16 bit nobody, and the 32 bit edges
+OWNER_MATRIX_IDS = (0, 1, 65534, 65535, 2**31 - 1, 2**31, 2**32 - 2)
+
+
+def iter_owner_matrix(*, file_type: str) -> Iterator[AngryObject]:
+    # every OWNER_MATRIX_IDS uid with every gid, needs root
+    for uid, gid in itertools.product(OWNER_MATRIX_IDS, OWNER_MATRIX_IDS):
+        yield AngryObject(
+            path=b"uid_%d__gid_%d" % (uid, gid),
+            file_type=file_type,
+            target=None,
+            content=None,
+            uid=uid,
+            gid=gid,
+        )
+
+
+METADATA_MATRICES = {
+    "modes": iter_mode_matrix,
+    "times": iter_time_matrix,
+    "owners": iter_owner_matrix,
+}
+
+
+def iter_metadata_matrix(*, matrix: str, file_type: str) -> Iterator[AngryObject]:
+    yield from METADATA_MATRICES[matrix](file_type=file_type)
+
+
+def make_metadata_matrix(
+    *,
+    root_dir: bytes,
+    dest_dir: bytes,
+    matrix: str,
+    file_type: str,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+) -> None:
+    """
+    one object per combination of a METADATA_MATRICES matrix, each named for
+    what it gets. the metadata is set in one pass after they are all made
+    """
+    make_working_dir(dest_dir, root_dir=root_dir)
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        count = create_objects(
+            iter_metadata_matrix(matrix=matrix, file_type=file_type),
+            dir_fd=dest_fd,
+            template_file=template_file,
+            template_hardlink=template_hardlink,
+        )
+        check_file_count(
+            dest_dir=dest_dir,
+            count=count,
+            file_type=file_type,
+            dir_fd=dest_fd,
+        )
+
+
+def xattr_value_sizes() -> list[int]:
+    # 0, 1 and each power of two with a byte either side of it, to XATTR_SIZE_MAX
+    sizes = {0, 1}
+    power = 2
+    while power <= XATTR_SIZE_MAX:
+        sizes.update((power - 1, power, power + 1))
+        power *= 2
+    return sorted(size for size in sizes if size <= XATTR_SIZE_MAX)
+
+
+def iter_xattr_matrix(
+    *,
+    names: str,
+    namespace: bytes,
+    file_type: str,
+) -> Iterator[AngryObject]:
+    """
+    one xattr per object, so no object runs into a per inode xattr limit
+
+    one_byte: every byte after namespace, the value is that byte
+    all_length: a name of every length to XATTR_NAME_MAX, value empty
+    value_sizes: xattr_value_sizes() and filesystem_max, as large as the fs takes
+    """
+    assert names in {"one_byte", "all_length", "value_sizes"}
+    if names == "one_byte":
+        for byte in range(1, 256):
+            yield AngryObject(
+                path=b"byte_%03d" % byte,
+                file_type=file_type,
+                target=None,
+                content=None,
+                xattrs=((namespace + bytes([byte]), bytes([byte])),),
+            )
+    elif names == "all_length":
+        for length in range(1, XATTR_NAME_MAX - len(namespace) + 1):
+            yield AngryObject(
+                path=b"length_%03d" % length,
+                file_type=file_type,
+                target=None,
+                content=None,
+                xattrs=((namespace + b"a" * length, b""),),
+            )
+    else:
+        for size in [*xattr_value_sizes(), None]:
+            yield AngryObject(
+                path=b"filesystem_max" if size is None else b"size_%d" % size,
+                file_type=file_type,
+                target=None,
+                content=None,
+                xattrs=(
+                    (
+                        namespace + b"angryfiles",
+                        None if size is None else SIZE_PATTERN[:size],
+                    ),
+                ),
+            )
+
+
+def make_xattr_matrix(
+    *,
+    root_dir: bytes,
+    dest_dir: bytes,
+    names: str,
+    namespace: bytes,
+    file_type: str,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+) -> None:
+    make_working_dir(dest_dir, root_dir=root_dir)
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        count = create_objects(
+            iter_xattr_matrix(names=names, namespace=namespace, file_type=file_type),
+            dir_fd=dest_fd,
+            template_file=template_file,
+            template_hardlink=template_hardlink,
+        )
+        check_file_count(
+            dest_dir=dest_dir,
+            count=count,
+            file_type=file_type,
+            dir_fd=dest_fd,
+        )
+
+
+def deep_tree_depth(*, name_length: int, path_length: int) -> int:
+    # fewest dirs of name_length names for the path of the file at the bottom to reach path_length
+    return max(0, -(-(path_length - name_length) // (name_length + 1)))
+
+
+def walk_open_files(depth: int) -> int:
+    # fds walk_at() and remove_tree_at() hold depth levels down
+    return 2 * depth + 64
+
+
+def iter_deep_tree(*, name: bytes, path_length: int) -> Iterator[AngryObject]:
+    # name/name/.../name dirs with a file name at the bottom, its path path_length bytes or more
+    path = b""
+    for _ in range(deep_tree_depth(name_length=len(name), path_length=path_length)):
+        path = os.path.join(path, name)
+        yield AngryObject(path=path, file_type="dir", target=None, content=None)
+    yield AngryObject(
+        path=os.path.join(path, name), file_type="file", target=None, content=None
+    )
+
+
+def make_deep_tree(
+    *,
+    root_dir: bytes,
+    dest_dir: bytes,
+    name: bytes,
+    path_length: int,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+) -> dict:
+    """
+    iter_deep_tree() made one level at a time through the fd of the last
+    dir, so each mkdir resolves one name however deep it is and the tree
+    can go past PATH_MAX
+
+    stops at the first error the fs has about the depth or length (reported,
+    verify_tree() has the rest as missing). returns the NAME_MAX and
+    PATH_MAX of the fs, and the depth and path length reached
+
+    raises ValueError before making anything when RLIMIT_NOFILE, raised as
+    far as it goes, is too low to walk the tree afterwards
+    """
+    depth = deep_tree_depth(name_length=len(name), path_length=path_length)
+    open_file_limit = raise_open_file_limit()
+    if walk_open_files(depth) > open_file_limit:
+        raise ValueError(
+            f"{dest_dir!r}: walking {depth} levels needs {walk_open_files(depth)} "
+            f"open files, RLIMIT_NOFILE allows {open_file_limit}"
+        )
+    make_working_dir(dest_dir, root_dir=root_dir)
+    reached = {"depth": 0, "path_length": 0, "file": 0}
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        reached["name_max"] = os.fpathconf(dest_fd, "PC_NAME_MAX")
+        reached["path_max"] = os.fpathconf(dest_fd, "PC_PATH_MAX")
+        fd = os.dup(dest_fd)
+        try:
+            for _ in range(depth):
+                create_object(
+                    name=name, file_type="dir", content=None, target=None, dir_fd=fd
+                )
+                child_fd = os.open(
+                    name,
+                    os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC,
+                    dir_fd=fd,
+                )
+                os.close(fd)
+                fd = child_fd
+                reached["depth"] += 1
+                reached["path_length"] += len(name) + 1
+            create_objects(
+                [AngryObject(path=name, file_type="file", target=None, content=None)],
+                dir_fd=fd,
+                template_file=template_file,
+                template_hardlink=template_hardlink,
+            )
+            reached["file"] = 1
+            reached["path_length"] += len(name)
+        except OSError as e:
+            if e.errno not in {
+                errno.ENAMETOOLONG,
+                errno.ENOSPC,
+                errno.EDQUOT,
+                errno.EMLINK,
+                errno.ELOOP,
+            }:
+                raise
+            print(
+                f"{dest_dir!r}: stopped at depth {reached['depth']}: {e}",
+                file=sys.stderr,
+            )
+        finally:
+            os.close(fd)
+    ic(dest_dir, reached)
+    count_total("dir", reached["depth"])
+    count_total("file", reached.pop("file"))
+    return reached
+
+
+MAXSYMLINKS = 40  # symlinks linux follows resolving one path before ELOOP
+SYMLINK_CHAIN_ENDS = ("file", "dir", "fifo", "link", "broken_symlink", "self_symlink")
+
+
+def symlink_chain_lengths() -> list[int]:
+    # every length to one past MAXSYMLINKS, then far past it
+    # (251 and a link end is every 1 byte name)
+    return [*range(1, MAXSYMLINKS + 2), 64, 128, 251]
+
+
+def symlink_chain_dir(end_type: str, length: int) -> bytes:
+    return b"to_%s/length_%03d" % (end_type.encode("utf8"), length)
+
+
+def symlink_cycle_dir(length: int) -> bytes:
+    return b"cycles/length_%03d" % length
+
+
+def iter_symlink_graph(*, cycle_max: int) -> Iterator[AngryObject]:
+    """
+    \\x01 -> \\x02 -> ... chains of 1 byte name symlinks for every length
+    in symlink_chain_lengths() ending in each SYMLINK_CHAIN_ENDS type (the
+    link end is symlink -> hardlink -> file), and \\x01 -> ... -> \\x01
+    cycles of circular_symlinks of every length to cycle_max
+    """
+    names = writable_one_byte_filenames()
+    assert 1 <= cycle_max <= len(names)
+    for end_type in SYMLINK_CHAIN_ENDS:
+        yield AngryObject(
+            path=os.path.dirname(symlink_chain_dir(end_type, 1)),
+            file_type="dir",
+            target=None,
+            content=None,
+        )
+        for length in symlink_chain_lengths():
+            chain_dir = symlink_chain_dir(end_type, length)
+            yield AngryObject(
+                path=chain_dir, file_type="dir", target=None, content=None
+            )
+            for index in range(length):
+                yield AngryObject(
+                    path=os.path.join(chain_dir, names[index]),
+                    file_type="symlink",
+                    target=names[index + 1],
+                    content=None,
+                )
+            target = None
+            if end_type == "link":
+                target = names[length + 1]
+                yield AngryObject(
+                    path=os.path.join(chain_dir, target),
+                    file_type="file",
+                    target=None,
+                    content=None,
+                )
+            yield AngryObject(
+                path=os.path.join(chain_dir, names[length]),
+                file_type=end_type,
+                target=target,
+                content=None,
+            )
+    yield AngryObject(
+        path=os.path.dirname(symlink_cycle_dir(1)),
+        file_type="dir",
+        target=None,
+        content=None,
+    )
+    for length in range(1, cycle_max + 1):
+        cycle_dir = symlink_cycle_dir(length)
+        yield AngryObject(path=cycle_dir, file_type="dir", target=None, content=None)
+        for index in range(length):
+            yield AngryObject(
+                path=os.path.join(cycle_dir, names[index]),
+                file_type="circular_symlink",
+                target=names[(index + 1) % length],
+                content=None,
+            )
+
+
+def time_symlink_resolution(path: bytes, *, dir_fd: int, repeat: int = 5) -> dict:
+    # fastest of repeat stat()s following path, and "ok" or the errno name it ended with
+    best_ns = None
+    for _ in range(repeat):
+        start_ns = time.perf_counter_ns()
+        try:
+            os.stat(path, dir_fd=dir_fd)
+            result = "ok"
+        except OSError as e:
+            result = errno.errorcode.get(e.errno, str(e.errno))
+        elapsed_ns = time.perf_counter_ns() - start_ns
+        best_ns = elapsed_ns if best_ns is None else min(best_ns, elapsed_ns)
+    return {"ns": best_ns, "result": result}
+
+
+def make_symlink_graph(
+    *,
+    root_dir: bytes,
+    dest_dir: bytes,
+    cycle_max: int,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+) -> dict:
+    """
+    iter_symlink_graph(), then the time to stat() through the head of every
+    chain and cycle, so what resolution depth costs a scanner is in the
+    metrics. eloop_length is the shortest chain to a file the kernel will
+    not follow
+    """
+    make_working_dir(dest_dir, root_dir=root_dir)
+    type_counts = defaultdict(int)
+
+    def counted(angry_objects):
+        for angry_object in angry_objects:
+            type_counts[angry_object.file_type] += 1
+            yield angry_object
+
+    head = writable_one_byte_filenames()[0]
+    resolve = {}
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        create_objects(
+            counted(iter_symlink_graph(cycle_max=cycle_max)),
+            dir_fd=dest_fd,
+            template_file=template_file,
+            template_hardlink=template_hardlink,
+        )
+        start_ns = time.perf_counter_ns()
+        for end_type in SYMLINK_CHAIN_ENDS:
+            for length in symlink_chain_lengths():
+                chain_dir = symlink_chain_dir(end_type, length)
+                resolve[os.fsdecode(chain_dir)] = time_symlink_resolution(
+                    os.path.join(chain_dir, head), dir_fd=dest_fd
+                )
+        for length in range(1, cycle_max + 1):
+            cycle_dir = symlink_cycle_dir(length)
+            resolve[os.fsdecode(cycle_dir)] = time_symlink_resolution(
+                os.path.join(cycle_dir, head), dir_fd=dest_fd
+            )
+        with PHASE_NS_LOCK:
+            PHASE_NS["resolve"] += time.perf_counter_ns() - start_ns
+    eloop_length = min(
+        (
+            length
+            for length in symlink_chain_lengths()
+            if resolve[os.fsdecode(symlink_chain_dir("file", length))]["result"]
+            == "ELOOP"
+        ),
+        default=None,
+    )
+    ic(dest_dir, type_counts, eloop_length)
+    for file_type, type_count in type_counts.items():
+        count_total(file_type, type_count)
+    return {"eloop_length": eloop_length, "resolve": resolve}
+
+
+EXT4_LINK_MAX = 65000
+
+
+def iter_hardlinks(
+    *, names: str, count: None | int = 0, per_dir: int = 1000
+) -> Iterator[AngryObject]:
+    """
+    one file and hardlinks to it. names is one_byte (every 1 byte name),
+    all_length (b'a' to 255 b'a's) or spread (an inode file with count
+    st_nlink, the links per_dir 2 byte names in each dir). count None is
+    LINK_MAX, without a fs to ask (--stream) the one of ext4
+    """
+    if names == "spread":
+        if count is None:
+            count = EXT4_LINK_MAX
+        yield AngryObject(path=b"inode", file_type="file", target=None, content=None)
+        two_byte_names = writable_two_byte_filenames()
+        assert 1 <= per_dir <= len(two_byte_names)
+        for index in range(count - 1):
+            dir_name = b"%05d" % (index // per_dir)
+            if not index % per_dir:
+                yield AngryObject(
+                    path=dir_name, file_type="dir", target=None, content=None
+                )
+            yield AngryObject(
+                path=os.path.join(dir_name, two_byte_names[index % per_dir]),
+                file_type="link",
+                target=b"../inode",
+                content=None,
+            )
+        return
+    if names == "one_byte":
+        paths = list(writable_one_byte_filenames())
+    elif names == "all_length":
+        paths = [b"a" * length for length in range(1, 256)]
+    else:
+        raise ValueError(names)
+    yield AngryObject(path=paths[0], file_type="file", target=None, content=None)
+    for path in paths[1:]:
+        yield AngryObject(path=path, file_type="link", target=paths[0], content=None)
+
+
+def hardlinks_made(test_set: partial, *, dest_fd: int) -> partial:
+    """
+    test_set with the count a spread make_hardlinks() set has in dest_fd
+
+    count None is the LINK_MAX of the fs, and when the file has as many
+    links as LINK_MAX but fewer than count the fs ran out of links, which
+    make_hardlinks() stops at, so that count is cut to st_nlink
+    """
+    if test_set.func is not make_hardlinks or test_set.keywords["names"] != "spread":
+        return test_set
+    link_max = os.fpathconf(dest_fd, "PC_LINK_MAX")
+    count = test_set.keywords["count"]
+    if count is None:
+        count = link_max
+    try:
+        nlink = os.stat(b"inode", dir_fd=dest_fd, follow_symlinks=False).st_nlink
+    except FileNotFoundError:
+        nlink = 0
+    if link_max <= nlink < count:
+        count = nlink
+    return partial(test_set, count=count)
+
+
+def make_hardlinks(
+    *,
+    root_dir: bytes,
+    dest_dir: bytes,
+    names: str,
+    count: None | int = 0,
+    per_dir: int = 1000,
+    template_file: None | bytes = None,
+    template_hardlink: bool = False,
+) -> dict:
+    """
+    iter_hardlinks(), no data is written past the one file. count None is
+    the LINK_MAX of the fs. stops at the first EMLINK, reaching the limit of
+    the fs is what the set is for, so verify_tree() expects the links made
+    up to it (hardlinks_made()). counts the links with one lstat() of the
+    file, returns its st_nlink and the LINK_MAX of the fs
+    """
+    make_working_dir(dest_dir, root_dir=root_dir)
+    type_counts = defaultdict(int)
+
+    def counted(angry_objects):
+        for angry_object in angry_objects:
+            type_counts[angry_object.file_type] += 1
+            yield angry_object
+
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        link_max = os.fpathconf(dest_fd, "PC_LINK_MAX")
+        if count is None:
+            count = link_max
+        angry_objects = iter_hardlinks(names=names, count=count, per_dir=per_dir)
+        inode = next(angry_objects)
+        try:
+            create_objects(
+                counted(itertools.chain([inode], angry_objects)),
+                dir_fd=dest_fd,
+                template_file=template_file,
+                template_hardlink=template_hardlink,
+            )
+        except OSError as e:
+            if e.errno != errno.EMLINK:
+                raise
+            ic(dest_dir, e)
+        nlink = os.stat(inode.path, dir_fd=dest_fd, follow_symlinks=False).st_nlink
+    ic(dest_dir, type_counts, nlink)
+    # a --template-hardlink file is linked from outside too
+    count_total("link", min(nlink - 1, type_counts["link"]))
+    count_total("file", 1)
+    count_total("dir", type_counts["dir"])
+    return {"nlink": nlink, "link_max": link_max}
+
+
+DEDUP_MIN_SIZE = 8  # room for the group number that keeps each content unique
+DEDUP_SIZE_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+
+class DedupFile(NamedTuple):
+    # one file of a dedup corpus, see plan_dedup_corpus()
+    path: bytes
+    group: int  # files of a group have the same content
+    size: int
+    base: int  # the group the random bytes are from, its own unless a near duplicate
+    flip: None | int  # offset of the byte a near duplicate has inverted
+    source: None | bytes  # the file it is cloned from, None for the first of a group
+
+
+def dedup_size(
+    rng: random.Random, *, sizes: str, max_size: int, median: int = 4096
+) -> int:
+    if sizes == "fixed":
+        return max_size
+    if sizes == "uniform":
+        return rng.randint(DEDUP_MIN_SIZE, max_size)
+    if sizes == "lognormal":
+        # mostly small files with a long tail, like a home dir
+        size = int(rng.lognormvariate(math.log(median), 2))
+        return min(max_size, max(DEDUP_MIN_SIZE, size))
+    raise ValueError(sizes)
+
+
+def plan_dedup_corpus(
+    *,
+    seed: int,
+    count: int,
+    ratio: float,
+    near_ratio: float,
+    sizes: str,
+    max_size: int,
+) -> Iterator[DedupFile]:
+    """
+    count files in a/ and b/. each is a duplicate of a random earlier file
+    (so big groups get bigger) with chance ratio, a near duplicate of an
+    earlier content with one byte inverted with chance near_ratio, else new
+    content. new contents and near duplicates go in a/, duplicates in a/
+    or b/, so b/ only has duplicates of files in a/ and not all of them
+    """
+    rng = random.Random(seed)
+    groups = {}  # group: the DedupFile of its first file
+    file_groups = []
+    flips = set()
+    for index in range(count):
+        name = b"%08d" % index
+        draw = rng.random()
+        if file_groups and draw < ratio:
+            first = groups[rng.choice(file_groups)]
+            dedup_file = first._replace(
+                path=os.path.join(rng.choice((b"a", b"b")), name), source=first.path
+            )
+        else:
+            group = len(groups)
+            dedup_file = DedupFile(
+                path=os.path.join(b"a", name),
+                group=group,
+                size=dedup_size(rng, sizes=sizes, max_size=max_size),
+                base=group,
+                flip=None,
+                source=None,
+            )
+            if groups and draw < ratio + near_ratio:
+                base = groups[rng.randrange(len(groups))]
+                if base.flip is None and base.size > DEDUP_MIN_SIZE:
+                    flip = rng.randrange(DEDUP_MIN_SIZE, base.size)
+                    if (base.group, flip) not in flips:
+                        flips.add((base.group, flip))
+                        dedup_file = dedup_file._replace(
+                            size=base.size,
+                            base=base.group,
+                            flip=flip,
+                            source=base.path,
+                        )
+            groups[dedup_file.group] = dedup_file
+        file_groups.append(dedup_file.group)
+        yield dedup_file
+
+
+def dedup_content(dedup_file: DedupFile, *, seed: int) -> bytes:
+    # the same bytes for every file of a group, from the seed and its base group
+    content = bytearray(dedup_file.base.to_bytes(DEDUP_MIN_SIZE, "little"))
+    content += random.Random(f"{seed}/{dedup_file.base}").randbytes(
+        dedup_file.size - DEDUP_MIN_SIZE
+    )
+    if dedup_file.flip is not None:
+        content[dedup_file.flip] ^= 0xFF
+    return bytes(content)
+
+
+def dedup_manifest(dedup_files: Iterable[DedupFile], **parameters) -> dict:
+    """
+    the ground truth to score a dedup tool with, paths relative to the
+    dest_dir: every group of more than one file, and every near duplicate
+    with the file it is one byte off from
+    """
+    paths = defaultdict(list)
+    sizes = {}
+    near_duplicates = []
+    total_bytes = 0
+    for dedup_file in dedup_files:
+        paths[dedup_file.group].append(os.fsdecode(dedup_file.path))
+        sizes[dedup_file.group] = dedup_file.size
+        total_bytes += dedup_file.size
+        if dedup_file.group != dedup_file.base and len(paths[dedup_file.group]) == 1:
+            near_duplicates.append(
+                {
+                    "path": os.fsdecode(dedup_file.path),
+                    "of": os.fsdecode(dedup_file.source),
+                    "offset": dedup_file.flip,
+                }
+            )
+    return {
+        **parameters,
+        "files": sum(len(group_paths) for group_paths in paths.values()),
+        "contents": len(paths),
+        "bytes": total_bytes,
+        "unique_bytes": sum(sizes.values()),
+        "groups": [
+            {"size": sizes[group], "paths": group_paths}
+            for group, group_paths in paths.items()
+            if len(group_paths) > 1
+        ],
+        "near_duplicates": near_duplicates,
+    }
+
+
+def iter_dedup_corpus(
+    *,
+    seed: int,
+    count: int,
+    ratio: float,
+    near_ratio: float,
+    sizes: str,
+    max_size: int,
+) -> Iterator[AngryObject]:
+    # plan_dedup_corpus() with its contents, and the dedup_manifest() as manifest.json
+    parameters = {
+        "seed": seed,
+        "count": count,
+        "ratio": ratio,
+        "near_ratio": near_ratio,
+        "sizes": sizes,
+        "max_size": max_size,
+    }
+    for dir_name in (b"a", b"b"):
+        yield AngryObject(path=dir_name, file_type="dir", target=None, content=None)
+    dedup_files = []
+    for dedup_file in plan_dedup_corpus(**parameters):
+        dedup_files.append(dedup_file)
+        yield AngryObject(
+            path=dedup_file.path,
+            file_type="file",
+            target=None,
+            content=dedup_content(dedup_file, seed=seed),
+        )
+    yield AngryObject(
+        path=b"manifest.json",
+        file_type="file",
+        target=None,
+        content=json.dumps(
+            dedup_manifest(dedup_files, **parameters), indent=2
+        ).encode("utf8"),
+    )
+
+
+def make_dedup_corpus(
+    *,
+    root_dir: bytes,
+    dest_dir: bytes,
+    seed: int,
+    count: int,
+    ratio: float,
+    near_ratio: float,
+    sizes: str,
+    max_size: int,
+) -> dict:
+    """
+    iter_dedup_corpus() with each content written once, every other file of
+    its group and each near duplicate (then one byte is rewritten) cloned
+    from the first one with clone_file(). returns the manifest totals and
+    how many files each clone method made
+    """
+    parameters = {
+        "seed": seed,
+        "count": count,
+        "ratio": ratio,
+        "near_ratio": near_ratio,
+        "sizes": sizes,
+        "max_size": max_size,
+    }
+    make_working_dir(dest_dir, root_dir=root_dir)
+    methods = defaultdict(int)
+    dedup_files = []
+    made = set()  # groups with a file
+    with open_dir_fd(os.path.join(os.fsencode(root_dir), dest_dir)) as dest_fd:
+        for dir_name in (b"a", b"b"):
+            create_object(
+                name=dir_name,
+                file_type="dir",
+                content=None,
+                target=None,
+                dir_fd=dest_fd,
+            )
+        for dedup_file in plan_dedup_corpus(**parameters):
+            dedup_files.append(dedup_file)
+            if dedup_file.source is None:
+                made.add(dedup_file.group)
+                create_object(
+                    name=dedup_file.path,
+                    file_type="file",
+                    content=dedup_content(dedup_file, seed=seed),
+                    target=None,
+                    dir_fd=dest_fd,
+                )
+                methods["write"] += 1
+                continue
+            start_ns = time.perf_counter_ns()
+            src_fd = os.open(
+                dedup_file.source,
+                os.O_RDONLY | os.O_NOFOLLOW | os.O_CLOEXEC,
+                dir_fd=dest_fd,
+            )
+            try:
+                dst_fd = os.open(
+                    dedup_file.path,
+                    os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC,
+                    0o644,
+                    dir_fd=dest_fd,
+                )
+                try:
+                    methods[clone_file(src_fd, dst_fd)] += 1
+                    if dedup_file.flip is not None and dedup_file.group not in made:
+                        # a near duplicate, only the block with the byte is unshared
+                        byte = os.pread(dst_fd, 1, dedup_file.flip)[0]
+                        os.pwrite(dst_fd, bytes([byte ^ 0xFF]), dedup_file.flip)
+                finally:
+                    os.close(dst_fd)
+            finally:
+                os.close(src_fd)
+            made.add(dedup_file.group)
+            with PHASE_NS_LOCK:
+                PHASE_NS["create"] += time.perf_counter_ns() - start_ns
+        manifest = dedup_manifest(dedup_files, **parameters)
+        create_object(
+            name=b"manifest.json",
+            file_type="file",
+            content=json.dumps(manifest, indent=2).encode("utf8"),
+            target=None,
+            dir_fd=dest_fd,
+        )
+    ic(dest_dir, methods)
+    count_total("dir", 2)
+    count_total("file", len(dedup_files) + 1)
+    return {
+        key: value
+        for key, value in manifest.items()
+        if key not in {"groups", "near_duplicates"}
+    } | {
+        "duplicate_groups": len(manifest["groups"]),
+        "near_duplicates": len(manifest["near_duplicates"]),
+        "methods": dict(methods),
+    }
+
+
+def check_file_count(
+    dest_dir: bytes,
+    count: int,
+    file_type: str,
+    dir_fd: None | int = None,
+    verbose: bool | float = False,
+) -> int:
+    # a mismatch is not fatal, verify_tree() reports every difference at the end
+    if dir_fd is None:
+        with open_dir_fd(dest_dir) as _dir_fd:
+            return check_file_count(
+                dest_dir=dest_dir,
+                count=count,
+                file_type=file_type,
+                dir_fd=_dir_fd,
+            )
+    # dir_fd was opened with O_DIRECTORY, so dest_dir is a dir
+    start_ns = time.perf_counter_ns()
+    with os.scandir(dir_fd) as entries:
+        manual_count = sum(1 for _ in entries)
+    with PHASE_NS_LOCK:
+        PHASE_NS["check"] += time.perf_counter_ns() - start_ns
+    if manual_count != count:
+        print(
+            "dest_dir:",
+            dest_dir,
+            "has",
+            manual_count,
+            "files. Expected:",
+            count,
+            file=sys.stderr,
+        )
+    count_total(file_type, manual_count)
+    return manual_count
+
+
+TEST_SET_ITERATORS = {
+    make_times_around_epoch_to_32bit_limit: iter_times_around_epoch_to_32bit_limit,
+    make_all_one_byte_objects: iter_all_one_byte_objects,
+    make_all_one_byte_objects_each_in_byte_number_folder: iter_all_one_byte_objects_each_in_byte_number_folder,
+    make_all_two_byte_objects: iter_all_two_byte_objects,
+    make_one_all_byte_file: iter_one_all_byte_file,
+    make_all_length_objects: iter_all_length_objects,
+    make_hash_index_tree: iter_hash_index_tree,
+    make_random_tree: iter_random_tree,
+    make_size_matrix: iter_size_matrix,
+    make_metadata_matrix: iter_metadata_matrix,
+    make_xattr_matrix: iter_xattr_matrix,
+    make_deep_tree: iter_deep_tree,
+    make_symlink_graph: iter_symlink_graph,
+    make_hardlinks: iter_hardlinks,
+    make_dedup_corpus: iter_dedup_corpus,
+}
+
+
+def iter_test_set(test_set: partial) -> Iterator[AngryObject]:
+    # the objects the test set would create, paths relative to its dest_dir
+    iterator = TEST_SET_ITERATORS[test_set.func]
+    parameters = inspect.signature(iterator).parameters
+    kwargs = {
+        key: value for key, value in test_set.keywords.items() if key in parameters
+    }
+    yield from iterator(**kwargs)
+
+
+def iter_test_sets(test_sets: Iterable[partial]) -> Iterator[AngryObject]:
+    """
+    every object the test sets would create, paths relative to root_dir
+
+    the dest_dir components are yielded once as "working_dir" objects
+    before the first object inside them, nothing touches the filesystem
+    """
+    seen_dirs = set()
+    for test_set in test_sets:
+        dest_dir = test_set.keywords["dest_dir"]
+        _dest_dir = b""
+        for part in dest_dir.split(b"/"):
+            _dest_dir = os.path.join(_dest_dir, part)
+            if _dest_dir not in seen_dirs:
+                seen_dirs.add(_dest_dir)
+                yield AngryObject(
+                    path=_dest_dir,
+                    file_type="working_dir",
+                    target=None,
+                    content=None,
+                )
+        for angry_object in iter_test_set(test_set):
+            yield angry_object._replace(path=dest_dir + b"/" + angry_object.path)
+
+
+def write_stream(
+    angry_objects: Iterable[AngryObject],
+    *,
+    stream_format: str,
+    fh: BinaryIO,
+) -> None:
+    """
+    nul: each path followed by NUL
+    length: path, file_type, target, content and size (decimal ascii), each
+            a signed 32 bit big endian length followed by that many bytes,
+            -1 is None. a size of -1 is FILESYSTEM_MAX_SIZE
+    """
+    assert stream_format in {"nul", "length"}
+    for angry_object in angry_objects:
+        if stream_format == "nul":
+            fh.write(angry_object.path + b"\0")
+            continue
+        for field in (
+            angry_object.path,
+            angry_object.file_type.encode("utf8"),
+            angry_object.target,
+            angry_object.content,
+            None if angry_object.size is None else b"%d" % angry_object.size,
+        ):
+            if field is None:
+                fh.write(struct.pack(">i", -1))
+            else:
+                fh.write(struct.pack(">i", len(field)) + field)
+
+
+class _RepeatReader(io.RawIOBase):
+    # size bytes of pattern repeated from its start, tarfile reads it in chunks
+
+    def __init__(self, pattern: bytes, size: int):
+        self.pattern = pattern
+        self.remaining = size
+        self.offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = min(len(buffer), self.remaining, len(self.pattern) - self.offset)
+        buffer[:count] = self.pattern[self.offset : self.offset + count]
+        self.offset = (self.offset + count) % len(self.pattern)
+        self.remaining -= count
+        return count
+
+
+def _pax_time(ns: int) -> str:
+    # exact decimal seconds, float would lose the nanoseconds
+    sign = "-" if ns < 0 else ""
+    seconds, nanoseconds = divmod(abs(ns), 10**9)
+    return f"{sign}{seconds}.{nanoseconds:09}"
+
+
+def write_tar(
+    angry_objects: Iterable[AngryObject],
+    *,
+    fh: BinaryIO,
+    template_file: None | bytes = None,
+) -> None:
+    """
+    write the objects as a streamed pax tar, nothing is created on disk
+
+    names and link targets keep their exact bytes (pax hdrcharset=BINARY when
+    they are not utf8) and atime_ns/mtime_ns are stored to the nanosecond.
+    xattrs are SCHILY.xattr records, or LIBARCHIVE.xattr ones when the name
+    is not utf8 or has a "=". a filesystem max value is XATTR_SIZE_MAX
+    """
+    now = int(time.time())
+    uid = os.getuid()
+    gid = os.getgid()
+    with tarfile.open(
+        fileobj=fh,
+        mode="w|",
+        format=tarfile.PAX_FORMAT,
+        encoding="utf-8",
+        errors="surrogateescape",
+    ) as tar:
+        for angry_object in angry_objects:
+            ic(angry_object)
+            tarinfo = tarfile.TarInfo(os.fsdecode(angry_object.path))
+            tarinfo.mtime = now
+            tarinfo.uid = uid
+            tarinfo.gid = gid
+            if angry_object.mtime_ns is not None:
+                tarinfo.mtime = angry_object.mtime_ns // 10**9
+                tarinfo.pax_headers["mtime"] = _pax_time(angry_object.mtime_ns)
+            if angry_object.atime_ns is not None:
+                tarinfo.pax_headers["atime"] = _pax_time(angry_object.atime_ns)
+
+            open_fileobj = None  # opens the file content of a file
+            entry_type = ENTRY_TYPES[angry_object.file_type]
+            if angry_object.file_type == "link":
+                tarinfo.type = tarfile.LNKTYPE
+                tarinfo.linkname = os.fsdecode(
+                    link_target_path(angry_object.path, angry_object.target)
+                )
+            elif entry_type == "file":
+                tarinfo.mode = 0o644
+                if angry_object.size == FILESYSTEM_MAX_SIZE:
+                    # there is no fs to be as large as, the rest of the tar still goes
+                    print(
+                        f"{angry_object.path!r} is as large as the fs it is made on, not streamed",
+                        file=sys.stderr,
+                    )
+                    continue
+                if angry_object.size is not None:
+                    pattern = SIZE_PATTERN
+                    if angry_object.file_type == "sparse_file":
+                        pattern = bytes(len(SIZE_PATTERN))
+                    open_fileobj = partial(_RepeatReader, pattern, angry_object.size)
+                    tarinfo.size = angry_object.size
+                elif template_file and not angry_object.content:
+                    open_fileobj = partial(open, template_file, "rb")
+                    tarinfo.size = os.stat(template_file).st_size
+                else:
+                    content = angry_object.content or b""
+                    open_fileobj = partial(io.BytesIO, content)
+                    tarinfo.size = len(content)
+            elif entry_type == "dir":
+                tarinfo.type = tarfile.DIRTYPE
+                tarinfo.mode = 0o755
+            elif entry_type == "symlink":
+                tarinfo.type = tarfile.SYMTYPE
+                tarinfo.mode = 0o777
+                tarinfo.linkname = os.fsdecode(symlink_target(angry_object))
+            elif angry_object.file_type == "fifo":
+                tarinfo.type = tarfile.FIFOTYPE
+                tarinfo.mode = 0o644
+            else:
+                raise ValueError(angry_object.file_type)
+            if angry_object.mode is not None and entry_type != "symlink":
+                tarinfo.mode = angry_object.mode
+            if angry_object.uid is not None:
+                tarinfo.uid = angry_object.uid
+            if angry_object.gid is not None:
+                tarinfo.gid = angry_object.gid
+            for xattr_name, xattr_value in angry_object.xattrs or ():
+                value = xattr_value
+                if value is None:
+                    value = SIZE_PATTERN[:XATTR_SIZE_MAX]
+                try:
+                    keyword = "SCHILY.xattr." + xattr_name.decode("utf8")
+                except UnicodeDecodeError:
+                    keyword = None
+                if keyword is None or "=" in keyword:
+                    # pax keywords are utf8 and end at "=", libarchive escapes the rest
+                    tarinfo.pax_headers[
+                        "LIBARCHIVE.xattr." + urllib.parse.quote(xattr_name)
+                    ] = base64.b64encode(value).rstrip(b"=").decode("ascii")
+                    continue
+                tarinfo.pax_headers[keyword] = os.fsdecode(value)
+
+            if open_fileobj is None:
+                tar.addfile(tarinfo)
+            else:
+                with open_fileobj() as fileobj:
+                    tar.addfile(tarinfo, fileobj=fileobj)
+
+
+class VirtualDirEntry:
+    """
+    os.DirEntry of a VirtualAngryTree entry, name and path are str when the
+    path given to scandir() was
+    """
+
+    __slots__ = ("_tree", "_tree_path", "name", "path")
+
+    def __init__(self, tree: VirtualAngryTree, tree_path: bytes, name, path):
+        self.name = name
+        self.path = path
+        self._tree = tree
+        self._tree_path = tree_path
+
+    def inode(self) -> int:
+        return self._tree._inodes[self._tree_path]
+
+    def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+        if follow_symlinks and self.is_symlink():
+            return self._tree.stat(self._tree_path)
+        return self._tree._stat(self._tree_path)
+
+    def _is(self, entry_type: str, s_is, follow_symlinks: bool) -> bool:
+        # the entry type, no stat_result is made unless a symlink leaves the tree
+        _entry_type = self._tree._entry_type(self._tree_path)
+        if _entry_type != "symlink" or not follow_symlinks:
+            return _entry_type == entry_type
+        try:
+            resolved = self._tree._resolve(self._tree_path)
+        except OSError:
+            return False
+        if isinstance(resolved, str):
+            try:
+                return s_is(os.stat(resolved).st_mode)
+            except OSError:
+                return False
+        return self._tree._entry_type(resolved) == entry_type
+
+    def is_dir(self, *, follow_symlinks: bool = True) -> bool:
+        return self._is("dir", stat.S_ISDIR, follow_symlinks)
+
+    def is_file(self, *, follow_symlinks: bool = True) -> bool:
+        return self._is("file", stat.S_ISREG, follow_symlinks)
+
+    def is_symlink(self) -> bool:
+        return self._tree._entry_type(self._tree_path) == "symlink"
+
+    def is_junction(self) -> bool:
+        return False
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self) -> str:
+        return f"<VirtualDirEntry {self.name!r}>"
+
+
+class _VirtualScandirIterator:
+    # like the iterator os.scandir() returns, also a context manager
+    def __init__(self, entries: Iterator[VirtualDirEntry]):
+        self._entries = entries
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> VirtualDirEntry:
+        return next(self._entries)
+
+    def close(self) -> None:
+        self._entries.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class VirtualAngryTree:
+    """
+    the tree test_sets would make (angry_test_sets() by default, like
+    main()), in memory: scandir(), walk(), listdir(), lstat(), stat() and
+    readlink() act like the os functions on the made tree, with paths
+    relative to its root, so traversal code can be fed hostile entries
+    without a filesystem
+
+    a test set is only iterated once something below its dest_dir is looked
+    up. symlinks resolve like the kernel resolves them (ELOOP past
+    MAXSYMLINKS, ENOTDIR, ENOENT above the root), absolute targets like
+    /dev/null are looked up on the real fs. times are when the tree was
+    made unless the object has its own, hardlinks share an inode
+    """
+
+    def __init__(
+        self,
+        test_sets: None | Iterable[partial] = None,
+        *,
+        long_tests: bool = False,
+    ):
+        if test_sets is None:
+            test_sets = angry_test_sets(long_tests=long_tests)
+        self._now_ns = time.time_ns()
+        self._objects: dict[bytes, AngryObject] = {}
+        self._children: dict[bytes, dict[bytes, None]] = {b"": {}}
+        self._inodes: dict[bytes, int] = {b"": 1}
+        self._nlinks: dict[int, int] = defaultdict(int)
+        self._nlinks[1] = 2
+        # the object each hardlink is to, for its size and times
+        self._inode_objects: dict[int, AngryObject] = {}
+        # made once, a broken_symlink target has the time in it
+        self._targets: dict[bytes, bytes] = {}
+        self._pending: dict[bytes, partial] = {}
+        for test_set in test_sets:
+            dest_dir = test_set.keywords["dest_dir"]
+            path = b""
+            for part in dest_dir.split(b"/"):
+                path = os.path.join(path, part)
+                if path not in self._objects:
+                    working_dir = AngryObject(
+                        path=path, file_type="working_dir", target=None, content=None
+                    )
+                    self._add(path, working_dir, prefix=b"")
+            self._pending[dest_dir] = test_set
+
+    def _add(self, path: bytes, angry_object: AngryObject, *, prefix: bytes) -> None:
+        # path is prefix (the dest_dir) and the path of angry_object
+        parent, _, name = path.rpartition(b"/")
+        self._objects[path] = angry_object
+        self._children[parent][name] = None
+        if angry_object.file_type == "link":
+            inode = self._inodes[
+                os.path.join(
+                    prefix, link_target_path(angry_object.path, angry_object.target)
+                )
+            ]
+        else:
+            inode = len(self._inodes) + 1
+            self._inode_objects[inode] = angry_object
+        self._inodes[path] = inode
+        self._nlinks[inode] += 1
+        if ENTRY_TYPES[angry_object.file_type] == "dir":
+            self._children[path] = {}
+            self._nlinks[inode] += 1  # .
+            self._nlinks[self._inodes[parent]] += 1  # ..
+
+    def _expand(self, path: bytes) -> None:
+        # iterate the test set with dest_dir path into the tree, once
+        test_set = self._pending.pop(path, None)
+        if test_set is None:
+            return
+        for angry_object in iter_test_set(test_set):
+            self._add(path + b"/" + angry_object.path, angry_object, prefix=path)
+
+    def _entry_type(self, path: bytes) -> str:
+        if not path:
+            return "dir"
+        return ENTRY_TYPES[self._objects[path].file_type]
+
+    def _target(self, path: bytes) -> bytes:
+        target = self._targets.get(path)
+        if target is None:
+            target = self._targets[path] = symlink_target(self._objects[path])
+        return target
+
+    def _resolve(self, path, *, follow_symlinks: bool = True) -> bytes | str:
+        """
+        the path in the tree that path names, or a str path on the real fs
+        when a symlink on the way has an absolute target
+        """
+        _path = os.fsencode(path)
+        if _path.startswith(b"/"):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        if _path.startswith(b"./"):
+            _path = _path[2:]
+        if _path in self._objects:
+            # a path in the tree only has dirs above it, just its name is looked up
+            current = os.path.dirname(_path)
+            pending = deque([os.path.basename(_path)])
+        else:
+            current = b""
+            pending = deque(_path.split(b"/"))
+        hops = 0
+        while pending:
+            name = pending.popleft()
+            if name in {b"", b"."}:
+                continue
+            if self._entry_type(current) != "dir":
+                raise NotADirectoryError(
+                    errno.ENOTDIR, os.strerror(errno.ENOTDIR), path
+                )
+            if name == b"..":
+                if not current:
+                    # above the root, where the tree was never made
+                    raise FileNotFoundError(
+                        errno.ENOENT, os.strerror(errno.ENOENT), path
+                    )
+                current = os.path.dirname(current)
+                continue
+            self._expand(current)
+            child = current + b"/" + name if current else name
+            if child not in self._objects:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+            if self._entry_type(child) == "symlink" and (
+                follow_symlinks or any(part not in {b"", b"."} for part in pending)
+            ):
+                hops += 1
+                if hops > MAXSYMLINKS:
+                    raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), path)
+                target = self._target(child)
+                if target.startswith(b"/"):
+                    return os.fsdecode(os.path.join(target, *pending))
+                pending.extendleft(reversed(target.split(b"/")))
+                continue
+            current = child
+        return current
+
+    def _stat(self, path: bytes) -> os.stat_result:
+        # the stat of the object at path in the tree, symlinks are not followed
+        # a dest_dir st_nlink counts the dirs of its set, so the set goes in first
+        self._expand(path)
+        inode = self._inodes[path]
+        if not path:
+            angry_object = AngryObject(
+                path=b"", file_type="working_dir", target=None, content=None
+            )
+        else:
+            angry_object = self._inode_objects[inode]
+        entry_type = ENTRY_TYPES[angry_object.file_type]
+        size = 0
+        if entry_type == "symlink":
+            mode = stat.S_IFLNK | 0o777
+            size = len(self._target(path))
+        elif entry_type == "dir":
+            mode = stat.S_IFDIR | 0o755
+        elif entry_type == "other":
+            mode = stat.S_IFIFO | 0o644
+        else:
+            mode = stat.S_IFREG | 0o644
+            if angry_object.size == FILESYSTEM_MAX_SIZE:
+                size = 2**63 - 1  # no fs, the largest off_t
+            elif angry_object.size is not None:
+                size = angry_object.size
+            else:
+                size = len(angry_object.content or b"")
+        if angry_object.mode is not None and entry_type != "symlink":
+            mode = stat.S_IFMT(mode) | angry_object.mode
+        atime_ns = angry_object.atime_ns
+        mtime_ns = angry_object.mtime_ns
+        if atime_ns is None:
+            atime_ns = self._now_ns
+        if mtime_ns is None:
+            mtime_ns = self._now_ns
+        uid = angry_object.uid if angry_object.uid is not None else os.getuid()
+        gid = angry_object.gid if angry_object.gid is not None else os.getgid()
+        return os.stat_result(
+            (
+                mode,
+                inode,
+                0,
+                self._nlinks[inode],
+                uid,
+                gid,
+                size,
+                atime_ns // 10**9,
+                mtime_ns // 10**9,
+                self._now_ns // 10**9,
+                atime_ns / 1e9,
+                mtime_ns / 1e9,
+                self._now_ns / 1e9,
+                atime_ns,
+                mtime_ns,
+                self._now_ns,
+            )
+        )
+
+    def lstat(self, path) -> os.stat_result:
+        return self.stat(path, follow_symlinks=False)
+
+    def stat(self, path, *, follow_symlinks: bool = True) -> os.stat_result:
+        resolved = self._resolve(path, follow_symlinks=follow_symlinks)
+        if isinstance(resolved, str):
+            return os.stat(resolved, follow_symlinks=follow_symlinks)
+        return self._stat(resolved)
+
+    def readlink(self, path):
+        resolved = self._resolve(path, follow_symlinks=False)
+        if isinstance(resolved, str):
+            target = os.readlink(os.fsencode(resolved))
+        elif self._entry_type(resolved) != "symlink":
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), path)
+        else:
+            target = self._target(resolved)
+        return target if isinstance(path, bytes) else os.fsdecode(target)
+
+    def scandir(self, path="."):
+        resolved = self._resolve(path)
+        if isinstance(resolved, str):
+            if isinstance(path, bytes):
+                resolved = os.fsencode(resolved)
+            return os.scandir(resolved)
+        if self._entry_type(resolved) != "dir":
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        self._expand(resolved)
+
+        def entries() -> Iterator[VirtualDirEntry]:
+            for child in list(self._children[resolved]):
+                tree_path = resolved + b"/" + child if resolved else child
+                name = child if isinstance(path, bytes) else os.fsdecode(child)
+                yield VirtualDirEntry(self, tree_path, name, os.path.join(path, name))
+
+        return _VirtualScandirIterator(entries())
+
+    def listdir(self, path=".") -> list:
+        with self.scandir(path) as entries:
+            return [entry.name for entry in entries]
+
+    def walk(
+        self,
+        top=".",
+        topdown: bool = True,
+        onerror=None,
+        followlinks: bool = False,
+    ):
+        # os.walk(), symlinks to dirs are in dirnames and only walked with followlinks
+        stack = [top]
+        while stack:
+            top = stack.pop()
+            if isinstance(top, tuple):
+                yield top
+                continue
+            dirs = []
+            nondirs = []
+            walk_dirs = []
+            symlinks = set()
+            try:
+                entries = self.scandir(top)
+            except OSError as error:
+                if onerror is not None:
+                    onerror(error)
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        dirs.append(entry.name)
+                        if entry.is_symlink():
+                            symlinks.add(entry.name)
+                        if followlinks or entry.name not in symlinks:
+                            walk_dirs.append(entry.path)
+                    else:
+                        nondirs.append(entry.name)
+            if topdown:
+                yield top, dirs, nondirs
+                # dirs may be changed in place to prune the walk
+                for dir_name in reversed(dirs):
+                    new_path = os.path.join(top, dir_name)
+                    if followlinks or dir_name not in symlinks:
+                        stack.append(new_path)
+            else:
+                stack.append((top, dirs, nondirs))
+                stack.extend(reversed(walk_dirs))
+
+
+# what each create_object() file_type looks like to scandir()
+ENTRY_TYPES = {
+    "file": "file",
+    "dir": "dir",
+    "working_dir": "dir",
+    "symlink": "symlink",
+    "broken_symlink": "symlink",
+    "self_symlink": "symlink",
+    "next_symlink": "symlink",
+    "next_symlinkable_byte": "symlink",
+    "circular_symlink": "symlink",
+    "link": "file",
+    "fifo": "other",
+    "sparse_file": "file",
+}
+
+
+class Mismatch(NamedTuple):
+    path: bytes  # relative to root_dir
+    problem: str  # "missing", "unexpected", "wrong_type", "unreadable", "xattrs" or "nlink"
+    expected: None | str
+    found: None | str
+
+
+class VerificationResult(NamedTuple):
+    entry_count: int  # like find, includes root_dir
+    expected_count: int
+    mismatches: list[Mismatch]
+    xattr_counts: dict[bytes, int]  # of each object given xattrs, by path
+
+    @property
+    def ok(self) -> bool:
+        return (not self.mismatches) and (self.entry_count == self.expected_count)
+
+
+def _entry_type(entry: os.DirEntry) -> str:
+    # d_type from getdents, no stat unless the fs returns DT_UNKNOWN
+    if entry.is_symlink():
+        return "symlink"
+    if entry.is_dir(follow_symlinks=False):
+        return "dir"
+    if entry.is_file(follow_symlinks=False):
+        return "file"
+    return "other"
+
+
+def iter_tree_at(
+    dir_fd: int,
+    *,
+    prefix: bytes = b"",
+    errors: None | list[Mismatch] = None,
+) -> Iterator[tuple[bytes, str]]:
+    """
+    (path, entry type) of everything below dir_fd, streamed with scandir
+
+    depth first without recursion, each directory is opened relative to its
+    parent with O_NOFOLLOW and its listing is never held in memory
+    """
+    for _, _, path, entry_type, _ in walk_at(dir_fd, prefix=prefix, errors=errors):
+        yield path, entry_type
+
+
+def walk_at(
+    dir_fd: int,
+    *,
+    prefix: bytes = b"",
+    errors: None | list[Mismatch] = None,
+) -> Iterator[tuple[int, bytes, bytes, str, int]]:
+    """
+    iter_tree_at() as (fd of the parent, name, path, entry type, depth), so
+    nothing below has to resolve a path, which can be past PATH_MAX
+
+    the entries of a dir follow it right away, one fd is open per level
+    """
+    fd = os.dup(dir_fd)
+    stack = [(fd, os.scandir(fd), prefix)]
+    try:
+        while stack:
+            fd, entries, _prefix = stack[-1]
+            entry = next(entries, None)
+            if entry is None:
+                entries.close()
+                os.close(fd)
+                stack.pop()
+                continue
+            name = os.fsencode(entry.name)
+            path = os.path.join(_prefix, name)
+            entry_type = _entry_type(entry)
+            yield fd, name, path, entry_type, len(stack) - 1
+            if entry_type != "dir":
+                continue
+            try:
+                child_fd = os.open(
+                    entry.name,
+                    os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC,
+                    dir_fd=fd,
+                )
+            except PermissionError:
+                if errors is not None:
+                    errors.append(Mismatch(path, "unreadable", "dir", None))
+                continue
+            stack.append((child_fd, os.scandir(child_fd), path))
+    finally:
+        for fd, entries, _ in stack:
+            entries.close()
+            os.close(fd)
+
+
+def _tree_digest(items: Iterable[tuple[bytes, str]]) -> tuple[int, int]:
+    # order independent, so the expected and found streams need not be sorted
+    count = 0
+    digest = 0
+    for path, entry_type in items:
+        count += 1
+        digest += int.from_bytes(
+            hashlib.blake2b(
+                entry_type.encode("utf8") + b"\0" + path, digest_size=16
+            ).digest(),
+            "big",
+        )
+    return count, digest % 2**128
+
+
+def _expected_entries(
+    test_set: partial,
+    xattrs: None | dict[bytes, tuple] = None,
+    links: None | dict[bytes, int] = None,
+) -> Iterator[tuple[bytes, str]]:
+    # with xattrs, the xattrs of each object that has them are put in it by path
+    # with links, the number of hardlinks to each file linked to
+    for angry_object in iter_test_set(test_set):
+        if xattrs is not None and angry_object.xattrs is not None:
+            xattrs[angry_object.path] = angry_object.xattrs
+        if links is not None and angry_object.file_type == "link":
+            link_target = link_target_path(angry_object.path, angry_object.target)
+            links[link_target] = links.get(link_target, 0) + 1
+        yield angry_object.path, ENTRY_TYPES[angry_object.file_type]
+
+
+def _verify_xattrs(
+    expected: dict[bytes, tuple],
+    *,
+    dest_fd: int,
+    prefix: bytes,
+) -> tuple[dict[bytes, int], list[Mismatch]]:
+    """
+    (xattr count of each object, mismatches) against the settable_xattrs()
+    of expected, so namespaces or sizes the fs rejects are not a mismatch
+    """
+    counts = {}
+    mismatches = []
+    if not expected:
+        return counts, mismatches
+    support = xattr_support(dest_fd)
+    for path, xattrs in expected.items():
+        try:
+            fd = _open_for_xattrs(path, dir_fd=dest_fd)
+        except (FileNotFoundError, PermissionError):
+            continue  # already a missing or unreadable mismatch
+        try:
+            found = {}
+            for name in os.listxattr(fd):
+                found[os.fsencode(name)] = os.getxattr(fd, name)
+        finally:
+            os.close(fd)
+        counts[os.path.join(prefix, path)] = len(found)
+        settable = settable_xattrs(xattrs, support=support)
+        if any(found.get(name) != value for name, value in settable):
+            mismatches.append(
+                Mismatch(
+                    os.path.join(prefix, path),
+                    "xattrs",
+                    f"{len(settable)} xattrs",
+                    f"{len(found)} xattrs",
+                )
+            )
+    return counts, mismatches
+
+
+def _verify_link_counts(
+    expected: dict[bytes, int],
+    *,
+    dest_fd: int,
+    prefix: bytes,
+) -> list[Mismatch]:
+    """
+    one lstat() per linked file instead of one per name. st_nlink may be
+    more than the file and its links (a hardlink clone of the cache or
+    --template-hardlink share the inode), never less
+    """
+    mismatches = []
+    for path, link_count in expected.items():
+        try:
+            nlink = os.stat(path, dir_fd=dest_fd, follow_symlinks=False).st_nlink
+        except FileNotFoundError:
+            continue  # already a missing mismatch
+        if nlink < 1 + link_count:
+            mismatches.append(
+                Mismatch(
+                    os.path.join(prefix, path),
+                    "nlink",
+                    str(1 + link_count),
+                    str(nlink),
+                )
+            )
+    return mismatches
+
+
+def _diff_entries(
+    *,
+    expected: Iterable[tuple[bytes, str]],
+    found: Iterable[tuple[bytes, str]],
+    prefix: bytes,
+) -> list[Mismatch]:
+    # only called when the digests differ, so only then is a manifest held in memory
+    expected_types = dict(expected)
+    mismatches = []
+    for path, entry_type in found:
+        expected_type = expected_types.pop(path, None)
+        if expected_type is None:
+            mismatches.append(
+                Mismatch(os.path.join(prefix, path), "unexpected", None, entry_type)
+            )
+        elif expected_type != entry_type:
+            mismatches.append(
+                Mismatch(
+                    os.path.join(prefix, path), "wrong_type", expected_type, entry_type
+                )
+            )
+    for path, expected_type in expected_types.items():
+        mismatches.append(
+            Mismatch(os.path.join(prefix, path), "missing", expected_type, None)
+        )
+    return mismatches
+
+
+def verify_test_set(
+    *,
+    root_fd: int,
+    test_set: partial,
+) -> tuple[int, int, list[Mismatch], dict[bytes, int]]:
+    # (found count, expected count, mismatches, xattr counts) for everything below dest_dir
+    dest_dir = test_set.keywords["dest_dir"]
+    errors: list[Mismatch] = []
+    xattrs: dict[bytes, tuple] = {}
+    links: dict[bytes, int] = {}
+    with open_dir_fd(dest_dir, dir_fd=root_fd) as dest_fd:
+        test_set = hardlinks_made(test_set, dest_fd=dest_fd)
+        found_count, found_digest = _tree_digest(iter_tree_at(dest_fd, errors=errors))
+        expected_count, expected_digest = _tree_digest(
+            _expected_entries(test_set, xattrs=xattrs, links=links)
+        )
+        xattr_counts, xattr_mismatches = _verify_xattrs(
+            xattrs, dest_fd=dest_fd, prefix=dest_dir
+        )
+        errors += xattr_mismatches
+        errors += _verify_link_counts(links, dest_fd=dest_fd, prefix=dest_dir)
+        if (found_count, found_digest) == (expected_count, expected_digest):
+            return found_count, expected_count, errors, xattr_counts
+        mismatches = _diff_entries(
+            expected=_expected_entries(test_set),
+            found=iter_tree_at(dest_fd),
+            prefix=dest_dir,
+        )
+    return found_count, expected_count, errors + mismatches, xattr_counts
+
+
+def verify_tree(
+    *,
+    root_dir: bytes | Path,
+    test_sets: list[partial],
+    jobs: int = 1,
+) -> VerificationResult:
+    """
+    compare the tree under root_dir to the objects test_sets create
+
+    the dirs above each dest_dir are checked here, the dest_dirs are walked
+    in parallel on jobs threads. every difference ends up in the result
+    """
+    dest_dirs = {test_set.keywords["dest_dir"]: test_set for test_set in test_sets}
+    parent_dirs = set()
+    for dest_dir in dest_dirs:
+        parent = os.path.dirname(dest_dir)
+        while parent:
+            parent_dirs.add(parent)
+            parent = os.path.dirname(parent)
+
+    entry_count = 1
+    expected_count = 1 + len(dest_dirs) + len(parent_dirs)
+    mismatches = []
+    xattr_counts = {}
+    seen = set()
+    with open_dir_fd(os.fsencode(root_dir)) as root_fd, ThreadPoolExecutor(
+        max_workers=jobs
+    ) as executor:
+        futures = []
+        pending = [b""]
+        while pending:
+            parent = pending.pop()
+            with open_dir_fd(
+                parent or b".", dir_fd=root_fd
+            ) as parent_fd, os.scandir(parent_fd) as entries:
+                for entry in entries:
+                    path = os.path.join(parent, os.fsencode(entry.name))
+                    if path in {MARKER_NAME, JOURNAL_NAME}:
+                        continue
+                    entry_type = _entry_type(entry)
+                    entry_count += 1
+                    if path not in dest_dirs and path not in parent_dirs:
+                        mismatches.append(
+                            Mismatch(path, "unexpected", None, entry_type)
+                        )
+                        if entry_type == "dir":
+                            with open_dir_fd(
+                                entry.name, dir_fd=parent_fd
+                            ) as unexpected_fd:
+                                entry_count += sum(
+                                    1 for _ in iter_tree_at(unexpected_fd)
+                                )
+                        continue
+                    seen.add(path)
+                    if entry_type != "dir":
+                        mismatches.append(
+                            Mismatch(path, "wrong_type", "dir", entry_type)
+                        )
+                        continue
+                    if path in dest_dirs:
+                        futures.append(
+                            executor.submit(
+                                verify_test_set,
+                                root_fd=root_fd,
+                                test_set=dest_dirs[path],
+                            )
+                        )
+                    if path in parent_dirs:
+                        pending.append(path)
+        for future in futures:
+            found_count, _expected_count, _mismatches, _xattr_counts = (
+                future.result()
+            )
+            entry_count += found_count
+            expected_count += _expected_count
+            mismatches += _mismatches
+            xattr_counts.update(_xattr_counts)
+
+    for path in sorted((set(dest_dirs) | parent_dirs) - seen):
+        mismatches.append(Mismatch(path, "missing", "dir", None))
+    return VerificationResult(
+        entry_count=entry_count,
+        expected_count=expected_count,
+        mismatches=mismatches,
+        xattr_counts=xattr_counts,
+    )
+
+
+def _open_dir_for_removal(name: bytes | str, *, dir_fd: int) -> int:
+    flags = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC
+    try:
+        return os.open(name, flags, dir_fd=dir_fd)
+    except PermissionError:
+        # a generated dir without r or x, it still has to go
+        os.chmod(name, 0o700, dir_fd=dir_fd, follow_symlinks=False)
+        return os.open(name, flags, dir_fd=dir_fd)
+
+
+def remove_tree_at(dir_fd: int, name: bytes) -> int:
+    """
+    rm -rf name below dir_fd, returns the number of entries removed
+
+    fd relative and without recursion, so symlinks are never followed and
+    trees deeper than PATH_MAX or the python recursion limit still go
+    """
+    try:
+        os.unlink(name, dir_fd=dir_fd)
+        return 1
+    except IsADirectoryError:
+        pass
+    removed = 0
+    fd = _open_dir_for_removal(name, dir_fd=dir_fd)
+    stack = [(fd, os.scandir(fd), name)]
+    try:
+        while stack:
+            fd, entries, _name = stack[-1]
+            entry = next(entries, None)
+            if entry is None:
+                entries.close()
+                os.close(fd)
+                stack.pop()
+                os.rmdir(_name, dir_fd=stack[-1][0] if stack else dir_fd)
+                removed += 1
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                child_fd = _open_dir_for_removal(entry.name, dir_fd=fd)
+                stack.append((child_fd, os.scandir(child_fd), entry.name))
+            else:
+                os.unlink(entry.name, dir_fd=fd)
+                removed += 1
+    finally:
+        for fd, entries, _ in stack:
+            entries.close()
+            os.close(fd)
+    return removed
+
+
+def _unlink_batch(paths: list[bytes], *, dir_fd: int) -> tuple[int, int]:
+    # (removed, fallback removed), a path that turned out to be a dir is removed whole
+    removed = 0
+    fallback = 0
+    for path in paths:
+        try:
+            os.unlink(path, dir_fd=dir_fd)
+            removed += 1
+        except IsADirectoryError:
+            fallback += remove_tree_at(dir_fd, path)
+        except FileNotFoundError:
+            pass  # never made, a partial tree
+        except OSError as e:
+            if e.errno != errno.ENAMETOOLONG:
+                raise
+            # left for the rmdir of its parent to fall back on
+    return removed, fallback
+
+
+@contextmanager
+def path_at(path: bytes, *, dir_fd: int) -> Iterator[tuple[int, bytes]]:
+    """
+    (dir_fd, name) that reach path below dir_fd, for a path past PATH_MAX
+    the dirs it is in are opened less than a PATH_MAX at a time
+    """
+    fds = []
+    try:
+        while len(path) >= 4096:
+            cut = path.rindex(b"/", 0, 4096)
+            dir_fd = os.open(
+                path[:cut],
+                os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC,
+                dir_fd=dir_fd,
+            )
+            fds.append(dir_fd)
+            path = path[cut + 1 :]
+        yield dir_fd, path
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def _remove_at(remove: Callable, path: bytes, *, dir_fd: int) -> None:
+    # remove (os.unlink or os.rmdir) path below dir_fd, past PATH_MAX too
+    try:
+        remove(path, dir_fd=dir_fd)
+    except OSError as e:
+        if e.errno != errno.ENAMETOOLONG:
+            raise
+        with path_at(path, dir_fd=dir_fd) as (fd, name):
+            remove(name, dir_fd=fd)
+
+
+def _clean_batch(
+    remove: Callable, paths: list[bytes], *, dir_fd: int
+) -> tuple[int, list[bytes]]:
+    """
+    remove (os.unlink or os.rmdir) each path, returns (removed, dirs kept
+    since something the manifest does not have is in them). a path that is
+    not the type the manifest has is left for clean_tree() to report
+    """
+    removed = 0
+    kept = []
+    for path in paths:
+        try:
+            _remove_at(remove, path, dir_fd=dir_fd)
+            removed += 1
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            pass  # never made (a partial tree), or not the type it should be
+        except OSError as e:
+            if e.errno not in {errno.ENOTEMPTY, errno.EEXIST}:
+                raise
+            kept.append(path)
+    return removed, kept
+
+
+def clean_test_set(
+    *,
+    root_fd: int,
+    test_set: partial,
+    executor: ThreadPoolExecutor,
+    batch_size: int = 4096,
+) -> tuple[int, list[bytes]]:
+    """
+    remove a test set using the objects it was built from, no discovery walk
+
+    non dirs are unlinked in batches on the executor, then the dirs are
+    removed deepest level first, each level in parallel. returns (removed,
+    dirs kept since something else is in them, relative to root_fd)
+    """
+    dest_dir = test_set.keywords["dest_dir"]
+    try:
+        dest_fd = os.open(
+            dest_dir,
+            os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC,
+            dir_fd=root_fd,
+        )
+    except FileNotFoundError:
+        return 0, []
+    removed = 0
+    kept = []
+    try:
+        test_set = hardlinks_made(test_set, dest_fd=dest_fd)
+        dirs_by_depth = defaultdict(list)
+        futures = []
+        batch = []
+        for angry_object in iter_test_set(test_set):
+            if ENTRY_TYPES[angry_object.file_type] == "dir":
+                dirs_by_depth[angry_object.path.count(b"/")].append(angry_object.path)
+                continue
+            batch.append(angry_object.path)
+            if len(batch) == batch_size:
+                futures.append(
+                    executor.submit(_clean_batch, os.unlink, batch, dir_fd=dest_fd)
+                )
+                batch = []
+        futures.append(executor.submit(_clean_batch, os.unlink, batch, dir_fd=dest_fd))
+        for future in futures:
+            removed += future.result()[0]  # nothing is kept by an unlink
+
+        for depth in sorted(dirs_by_depth, reverse=True):
+            dirs = dirs_by_depth[depth]
+            futures = [
+                executor.submit(
+                    _clean_batch,
+                    os.rmdir,
+                    dirs[index : index + batch_size],
+                    dir_fd=dest_fd,
+                )
+                for index in range(0, len(dirs), batch_size)
+            ]
+            for future in futures:
+                _removed, _kept = future.result()
+                removed += _removed
+                kept += [os.path.join(dest_dir, path) for path in _kept]
+    finally:
+        os.close(dest_fd)
+    _removed, _kept = _clean_batch(os.rmdir, [dest_dir], dir_fd=root_fd)
+    return removed + _removed, kept + _kept
+
+
+def clean_tree(
+    *,
+    root_dir: bytes | Path,
+    test_sets: list[partial],
+    jobs: int = 1,
+) -> dict[str, int | list[bytes]]:
+    """
+    remove the tree test_sets built under root_dir, then root_dir
+
+    raises ValueError unless root_dir has the marker of the same test sets
+    (write_marker()). only what the test sets account for is removed, the
+    paths of anything else are returned as left, and root_dir, the dirs
+    they are in and the marker stay
+    """
+    root_dir = os.fsencode(root_dir)
+    try:
+        key = read_marker(root_dir)
+    except FileNotFoundError:
+        raise ValueError(
+            f"{os.fsdecode(root_dir)} has no {os.fsdecode(MARKER_NAME)}, "
+            "angryfiles did not make it"
+        ) from None
+    if key != test_sets_key(test_sets, template_contents=False):
+        raise ValueError(
+            f"{os.fsdecode(root_dir)} was made with other test set options"
+        )
+    removed = 0
+    kept = []
+    parent_dirs = set()
+    for test_set in test_sets:
+        parent = os.path.dirname(test_set.keywords["dest_dir"])
+        while parent:
+            parent_dirs.add(parent)
+            parent = os.path.dirname(parent)
+    left = set()
+    with open_dir_fd(root_dir) as root_fd:
+        # the sets feed the executor from their own threads
+        with ThreadPoolExecutor(max_workers=jobs) as executor, ThreadPoolExecutor(
+            max_workers=max(1, len(test_sets))
+        ) as feeders:
+            futures = [
+                feeders.submit(
+                    clean_test_set,
+                    root_fd=root_fd,
+                    test_set=test_set,
+                    executor=executor,
+                )
+                for test_set in test_sets
+            ]
+            for future in futures:
+                _removed, _kept = future.result()
+                removed += _removed
+                kept += _kept
+        _removed, _kept = _clean_batch(
+            os.rmdir,
+            sorted(parent_dirs, key=lambda path: path.count(b"/"), reverse=True),
+            dir_fd=root_fd,
+        )
+        removed += _removed
+        kept += _kept
+        try:
+            os.unlink(JOURNAL_NAME, dir_fd=root_fd)
+        except FileNotFoundError:
+            pass
+        # what is in the kept dirs and root_dir that they do not account for
+        for path in [b"", *kept]:
+            with path_at(path, dir_fd=root_fd) as (fd, name), open_dir_fd(
+                name or b".", dir_fd=fd
+            ) as kept_fd:
+                names = [os.fsencode(name) for name in os.listdir(kept_fd)]
+            for name in names:
+                if not path and name == MARKER_NAME:
+                    continue
+                left.add(os.path.join(path, name))
+        left.difference_update(kept)
+    if not left:
+        os.unlink(os.path.join(root_dir, MARKER_NAME))
+        with open_dir_fd(os.path.dirname(os.path.abspath(root_dir))) as parent_fd:
+            os.rmdir(os.path.basename(root_dir), dir_fd=parent_fd)
+        removed += 1
+    return {"removed": removed, "left": sorted(left)}
+
+
+def angry_test_sets(
+    *,
+    long_tests: bool,
+    shard_jobs: int = 1,
+) -> list[partial]:
+    """
+    every independent test set main() runs, as partials missing only root_dir
+
+    each set writes to its own dest_dir, so they can run in any order or in parallel
+    """
+    test_sets = [
+        # 1 byte names
+        # expected file count = 255 - 2 = 253 (. and / note 0 is NULL)
+        # /bin/ls -A 1/1_byte_file_names | wc -l returns 254 because one file is '\n'
+        partial(
+            make_all_one_byte_objects,
+            dest_dir=b"files/all_1_byte_file_names",
+            file_type="file",
+            count=253,
+            self_content=False,
+            target=None,
+        ),
+        partial(
+            make_all_one_byte_objects,
+            dest_dir=b"files/all_1_byte_file_names_with_a_~_folder/~",
+            file_type="file",
+            count=253,
+            self_content=False,
+            target=None,
+        ),  # 254 not 253 because of the ~ parent dir, but cant set here
+        partial(
+            make_all_one_byte_objects,
+            dest_dir=b"files/all_1_byte_file_names_prepended_with_~",
+            file_type="file",
+            count=253,
+            self_content=False,
+            target=None,
+            prepend=b"~",
+        ),
+        partial(
+            make_all_one_byte_objects,
+            dest_dir=b"files/all_1_byte_file_names_self_content",
+            file_type="file",
+            count=253,
+            self_content=True,
+            target=None,
+        ),
+        partial(
+            make_all_one_byte_objects_each_in_byte_number_folder,
+            dest_dir=b"files/all_1_byte_file_names_one_per_folder",
+            file_type="file",
+            count=253,
+            self_content=False,
+        ),
+        partial(
+            make_all_one_byte_objects_each_in_byte_number_folder,
+            dest_dir=b"files/all_1_byte_file_names_one_per_folder_prepended_with_~",
+            file_type="file",
+            count=253,
+            self_content=False,
+            prepend=b"~",
+        ),
+        partial(
+            make_all_one_byte_objects_each_in_byte_number_folder,
+            dest_dir=b"dirs/all_1_byte_dir_names_one_per_folder",
+            file_type="dir",
+            count=253,
+            self_content=False,
+        ),  # not counting the parent int folders?
+        partial(
+            make_all_one_byte_objects,
+            dest_dir=b"dirs/all_1_byte_dir_names",
+            file_type="dir",
+            count=253,
+            self_content=False,
+            target=None,
+        ),
+        partial(
+            make_all_one_byte_objects,
+            dest_dir=b"symlinks/all_1_byte_symlink_names_to_dot",
+            file_type="symlink",
+            count=253,
+            self_content=False,
+            target=b".",
+        ),  # can cause code to fail on recursion +/+/+/+ -> .
+        partial(
+            make_all_one_byte_objects,
+            dest_dir=b"symlinks/all_1_byte_symlink_names_to_dotdot",
+            file_type="symlink",
+            count=253,
+            self_content=False,
+            target=b"..",
+        ),
+        partial(
+            make_all_one_byte_objects,
+            dest_dir=b"symlinks/all_1_byte_symlink_names_to_dev_null",
+            file_type="symlink",
+            count=253,
+            self_content=False,
+            target=b"/dev/null",
+        ),
+        partial(
+            make_all_one_byte_objects,
+            dest_dir=b"symlinks/all_1_byte_broken_symlink_names",
+            file_type="broken_symlink",
+            count=253,
+            self_content=False,
+            target=b".",
+        ),
+        partial(
+            make_all_one_byte_objects,
+            dest_dir=b"symlinks/all_1_byte_self_symlink_names",
+            file_type="self_symlink",
+            count=253,
+            self_content=False,
+            target=b".",
+        ),
+
+        # all length objects
+        # expected file count = 255
+        partial(
+            make_all_length_objects,
+            dest_dir=b"files/all_length_file_names",
+            file_type="file",
+            count=255,
+            self_content=False,
+            target=None,
+            all_bytes=False,
+        ),
+        partial(
+            make_all_length_objects,
+            dest_dir=b"files/all_length_file_names_self_content",
+            file_type="file",
+            count=255,
+            self_content=True,
+            target=None,
+            all_bytes=False,
+        ),
+        partial(
+            make_all_length_objects,
+            dest_dir=b"files/all_length_file_names_all_bytes__self_content",
+            file_type="file",
+            count=255,
+            self_content=True,
+            all_bytes=True,
+            target=b".",
+        ),
+        partial(
+            make_all_length_objects,
+            dest_dir=b"symlinks/all_length_symlink_names_to_dot",
+            file_type="symlink",
+            count=255,
+            self_content=False,
+            target=b".",
+            all_bytes=False,
+        ),
+        partial(
+            make_all_length_objects,
+            dest_dir=b"symlinks/all_length_symlink_names_to_dotdot",
+            file_type="symlink",
+            count=255,
+            target=b"..",
+            self_content=False,
+            all_bytes=False,
+        ),
+        partial(
+            make_all_length_objects,
+            dest_dir=b"symlinks/all_length_symlink_names_to_dev_null",
+            file_type="symlink",
+            count=255,
+            target=b"/dev/null",
+            self_content=False,
+            all_bytes=False,
+        ),
+        partial(
+            make_all_length_objects,
+            dest_dir=b"symlinks/all_length_broken_symlink_names",
+            file_type="broken_symlink",
+            count=255,
+            self_content=False,
+            target=b".",
+            all_bytes=False,
+        ),
+        partial(
+            make_all_length_objects,
+            dest_dir=b"symlinks/all_length_self_symlink_names",
+            file_type="self_symlink",
+            count=255,
+            self_content=False,
+            target=b".",
+            all_bytes=False,
+        ),
+        partial(
+            make_all_length_objects,
+            dest_dir=b"dirs/all_length_dir_names",
+            file_type="dir",
+            count=255,
+            self_content=False,
+            target=None,
+            all_bytes=False,
+        ),
+        partial(
+            make_times_around_epoch_to_32bit_limit,
+            dest_dir=b"files/32bit_limit_times",
+            file_type="file",
+            count=127,
+            target=None,
+        ),
+    ]
+
+    if long_tests:
+        test_sets += [
+            # 2 byte names
+            # expected file count = (255 - 1) * (255 - 1) = 64516 - 1 = 64515
+            # since only NULL and / are invalid, and there is no '..' file
+            # /bin/ls -A -f --hide-control-chars 1/2_byte_file_names | wc -l returns 64515
+            partial(
+                make_all_two_byte_objects,
+                dest_dir=b"files/all_2_byte_file_names",
+                file_type="file",
+                count=64515,
+                target=None,
+                jobs=shard_jobs,
+            ),
+            partial(
+                make_all_two_byte_objects,
+                dest_dir=b"dirs/all_2_byte_dir_names",
+                file_type="dir",
+                count=64515,
+                target=None,
+                jobs=shard_jobs,
+            ),  # takes forever to delete
+            partial(
+                make_all_two_byte_objects,
+                dest_dir=b"symlinks/all_2_byte_symlink_names_to_dot",
+                file_type="symlink",
+                count=64515,
+                target=b".",
+                jobs=shard_jobs,
+            ),
+            partial(
+                make_all_two_byte_objects,
+                dest_dir=b"symlinks/all_2_byte_symlink_names_to_dotdot",
+                file_type="symlink",
+                count=64515,
+                target=b"..",
+                jobs=shard_jobs,
+            ),
+            partial(
+                make_all_two_byte_objects,
+                dest_dir=b"symlinks/all_2_byte_symlink_names_to_dev_null",
+                file_type="symlink",
+                count=64515,
+                target=b"/dev/null",
+                jobs=shard_jobs,
+            ),
+            partial(
+                make_all_two_byte_objects,
+                dest_dir=b"symlinks/all_2_byte_broken_symlink_names",
+                file_type="broken_symlink",
+                count=64515,
+                target=b".",
+                jobs=shard_jobs,
+            ),
+        ]
+
+    # max length objects: deep_tree_test_sets()
+    return test_sets
+
+
+def hash_index_test_sets(
+    *,
+    count: int,
+    algorithm: str = "sha1",
+    depth: int = 3,
+    width: int = 1,
+    jobs: int = 1,
+) -> list[partial]:
+    if not count:
+        return []
+    return [
+        partial(
+            make_hash_index_tree,
+            dest_dir=f"hash_index/{algorithm}_depth_{depth}_width_{width}_count_{count}".encode(),
+            count=count,
+            algorithm=algorithm,
+            depth=depth,
+            width=width,
+            jobs=jobs,
+        )
+    ]
+
+
+def random_tree_test_sets(
+    *,
+    count: int,
+    seed: None | int = None,
+    min_name_length: int = 1,
+    max_name_length: int = 255,
+    max_depth: int = 4,
+    dir_ratio: float = 0.1,
+    utf8: bool = False,
+) -> list[partial]:
+    # the seed is in the dest_dir, pass it back with --random-tree-seed to replay a tree
+    if not count:
+        return []
+    if seed is None:
+        seed = int.from_bytes(os.urandom(4), "big")
+        print("random tree seed:", seed, file=sys.stderr)
+    return [
+        partial(
+            make_random_tree,
+            dest_dir=f"random/seed_{seed}_count_{count}_depth_{max_depth}_names_{min_name_length}-{max_name_length}_dirs_{dir_ratio}{'_utf8' if utf8 else ''}".encode(),
+            seed=seed,
+            count=count,
+            min_name_length=min_name_length,
+            max_name_length=max_name_length,
+            max_depth=max_depth,
+            dir_ratio=dir_ratio,
+            utf8=utf8,
+        )
+    ]
+
+
+class Journal:
+    """
+    append only record of the test sets and shards a run has finished
+
+    a line is written once the work it names is done, so after a crash a
+    set or shard missing from the journal is made again, after removing
+    whatever it left behind. lines are single O_APPEND writes, so worker
+    processes and threads can share the file
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.results = {}
+        data = b""
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            pass
+        for line in data.splitlines():
+            try:
+                dest_dir, shard, result = json.loads(line)
+            except ValueError:
+                continue  # torn by the crash
+            self.results[(dest_dir, shard)] = result
+        self.fd = os.open(
+            path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o644
+        )
+        if data and not data.endswith(b"\n"):
+            os.write(self.fd, b"\n")
+
+    def result(self, dest_dir: bytes, shard: None | str = None):
+        # what record() was given for the set (shard None) or shard, None if unfinished
+        return self.results.get((os.fsdecode(dest_dir), shard))
+
+    def record(self, dest_dir: bytes, shard: None | str, result) -> None:
+        key = (os.fsdecode(dest_dir), shard)
+        os.write(self.fd, (json.dumps([*key, result]) + "\n").encode("utf8"))
+        self.results[key] = result
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+# what angryfiles keeps in a root_dir besides the test sets, verify_tree() and
+# --stdout leave them out
+MARKER_NAME = b".angryfiles"
+JOURNAL_NAME = b".angryfiles-journal"
+
+
+def default_journal_path(root_dir: Path) -> Path:
+    # inside root_dir, so it is never left behind by a tree that is gone
+    return root_dir / os.fsdecode(JOURNAL_NAME)
+
+
+def read_marker(root_dir: bytes | Path) -> str:
+    # the test_sets_key() of the sets root_dir was made from, see write_marker()
+    with open(os.path.join(os.fsencode(root_dir), MARKER_NAME), "rb") as fh:
+        return json.load(fh)["test_sets"]
+
+
+def write_marker(
+    root_dir: Path, test_sets: list[partial], *, resume: bool = False
+) -> None:
+    """
+    mark a new root_dir as made by angryfiles from test_sets, clean_tree()
+    removes nothing from a dir without it. with resume root_dir must already
+    have the marker of the same test sets instead
+    """
+    key = test_sets_key(test_sets, template_contents=False)
+    if not resume:
+        with open(os.path.join(os.fsencode(root_dir), MARKER_NAME), "x") as fh:
+            json.dump({"version": _package_version(), "test_sets": key}, fh)
+        return
+    try:
+        found = read_marker(root_dir)
+    except FileNotFoundError:
+        raise ValueError(
+            f"{root_dir} has no {os.fsdecode(MARKER_NAME)}, angryfiles did not make it"
+        ) from None
+    if found != key:
+        raise ValueError(f"{root_dir} was made with other test set options")
+
+
+def size_matrix_test_sets(*, max_size: int, sparse: bool = True) -> list[partial]:
+    if not max_size:
+        return []
+    return [
+        partial(
+            make_size_matrix,
+            dest_dir=f"sizes/{'sparse' if sparse else 'data'}_max_{max_size}".encode(),
+            max_size=max_size,
+            sparse=sparse,
+        )
+    ]
+
+
+def metadata_matrix_test_sets(*, enabled: bool) -> list[partial]:
+    if not enabled:
+        return []
+    # dirs that lose r or x and other owners can only be made and read back by root
+    test_sets = [
+        partial(
+            make_metadata_matrix,
+            dest_dir=b"metadata/modes_files",
+            matrix="modes",
+            file_type="file",
+        ),
+        partial(
+            make_metadata_matrix,
+            dest_dir=b"metadata/times_files",
+            matrix="times",
+            file_type="file",
+        ),
+        partial(
+            make_metadata_matrix,
+            dest_dir=b"metadata/times_dirs",
+            matrix="times",
+            file_type="dir",
+        ),
+    ]
+    if os.geteuid() == 0:
+        test_sets += [
+            partial(
+                make_metadata_matrix,
+                dest_dir=b"metadata/modes_dirs",
+                matrix="modes",
+                file_type="dir",
+            ),
+            partial(
+                make_metadata_matrix,
+                dest_dir=b"metadata/owners_files",
+                matrix="owners",
+                file_type="file",
+            ),
+            partial(
+                make_metadata_matrix,
+                dest_dir=b"metadata/owners_dirs",
+                matrix="owners",
+                file_type="dir",
+            ),
+        ]
+    return test_sets
+
+
+def xattr_matrix_test_sets(*, enabled: bool) -> list[partial]:
+    # trusted. xattrs need root
+    if not enabled:
+        return []
+    namespaces = [b"user."]
+    if os.geteuid() == 0:
+        namespaces.append(b"trusted.")
+    return [
+        partial(
+            make_xattr_matrix,
+            dest_dir=b"xattrs/%s_%s_%ss"
+            % (namespace.rstrip(b"."), names.encode("utf8"), file_type.encode("utf8")),
+            names=names,
+            namespace=namespace,
+            file_type=file_type,
+        )
+        for namespace in namespaces
+        for names in ("one_byte", "all_length", "value_sizes")
+        for file_type in ("file", "dir")
+    ]
+
+
+def deep_tree_test_sets(*, path_length: int, every_byte: bool) -> list[partial]:
+    """
+    ~/~/~ (the todo's max nested /~/~/~/) and NAME_MAX names nested until a
+    path is path_length bytes, every_byte adds a tree for every 1 byte name
+    """
+    if not path_length:
+        return []
+    names = {b"tilde": b"~", b"name_max": b"a" * 255}
+    if every_byte:
+        for byte in sorted(valid_filename_bytes() - {b"."}):
+            names[b"every_byte_%03d" % ord(byte)] = byte
+    return [
+        partial(
+            make_deep_tree,
+            dest_dir=b"deep/%s_%d" % (dest_dir, path_length),
+            name=name,
+            path_length=path_length,
+        )
+        for dest_dir, name in names.items()
+    ]
+
+
+def symlink_graph_test_sets(*, enabled: bool, cycle_max: int) -> list[partial]:
+    """
+    symlink chains past MAXSYMLINKS and cycles (iter_symlink_graph()), and
+    every 1 byte name as next_symlink (one cycle through all of them) and
+    next_symlinkable_byte
+    """
+    if not enabled:
+        return []
+    return [
+        partial(make_symlink_graph, dest_dir=b"symlinks/graph", cycle_max=cycle_max),
+        *(
+            partial(
+                make_all_one_byte_objects,
+                dest_dir=b"symlinks/all_1_byte_%s_names" % file_type.encode("utf8"),
+                file_type=file_type,
+                count=253,
+                target=None,
+                self_content=False,
+            )
+            for file_type in ("next_symlink", "next_symlinkable_byte")
+        ),
+    ]
+
+
+def hardlink_test_sets(
+    *, count: int, per_dir: int, link_max: bool = False
+) -> list[partial]:
+    """
+    every 1 byte and every length name hardlinked to one file, and a file
+    with count st_nlink from links per_dir to a dir, or with link_max as
+    many as the LINK_MAX of the fs it is made on
+    """
+    if not count:
+        return []
+    return [
+        partial(make_hardlinks, dest_dir=b"hardlinks/one_byte", names="one_byte"),
+        partial(make_hardlinks, dest_dir=b"hardlinks/all_length", names="all_length"),
+        partial(
+            make_hardlinks,
+            dest_dir=b"hardlinks/spread_%s_per_dir_%d"
+            % (b"link_max" if link_max else b"%d" % count, per_dir),
+            names="spread",
+            count=None if link_max else count,
+            per_dir=per_dir,
+        ),
+    ]
+
+
+def dedup_corpus_test_sets(
+    *,
+    count: int,
+    seed: None | int = None,
+    ratio: float = 0.5,
+    near_ratio: float = 0.05,
+    sizes: str = "lognormal",
+    max_size: int = 2**20,
+) -> list[partial]:
+    # the seed is in the dest_dir, pass it back with --dedup-seed to replay a corpus
+    if not count:
+        return []
+    if ratio + near_ratio > 1:
+        raise ValueError(f"duplicate ratio {ratio} + near ratio {near_ratio} is over 1")
+    if seed is None:
+        seed = int.from_bytes(os.urandom(4), "big")
+        print("dedup corpus seed:", seed, file=sys.stderr)
+    return [
+        partial(
+            make_dedup_corpus,
+            dest_dir=f"dedup/seed_{seed}_count_{count}_ratio_{ratio}_near_{near_ratio}_{sizes}_max_{max_size}".encode(),
+            seed=seed,
+            count=count,
+            ratio=ratio,
+            near_ratio=near_ratio,
+            sizes=sizes,
+            max_size=max_size,
+        )
+    ]
+
+
+def raise_open_file_limit() -> int:
+    """
+    soft RLIMIT_NOFILE up to the hard limit, returns it
+
+    walk_at() and remove_tree_at() hold two fds per level (theirs and the
+    dup scandir() makes), so half of it is how deep a tree can be verified,
+    cloned or cleaned
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        with open("/proc/sys/fs/nr_open", encoding="utf8") as fh:
+            hard = int(fh.read())
+    if soft != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    return soft
+
+
+def run_timed_test_set(test_set: partial, root_dir: Path) -> dict:
+    """
+    run test_set, returns its wall time, object count and PHASE_NS split
+
+    the counts are deltas of TOTALS_DICT and PHASE_NS, so only sets running
+    one at a time in a process get an exact split
+    """
+    objects_before = sum(TOTALS_DICT.values())
+    phase_ns_before = PHASE_NS.copy()
+    start_ns = time.perf_counter_ns()
+    result = test_set(root_dir=root_dir)
+    wall_s = (time.perf_counter_ns() - start_ns) / 1e9
+    objects = sum(TOTALS_DICT.values()) - objects_before
+    metrics = {
+        "test_set": test_set.func.__name__,
+        "dest_dir": os.fsdecode(test_set.keywords["dest_dir"]),
+        "wall_s": wall_s,
+        "objects": objects,
+        "objects_per_s": objects / wall_s if wall_s else None,
+        "phases_s": {
+            phase: (ns - phase_ns_before[phase]) / 1e9 for phase, ns in PHASE_NS.items()
+        },
+    }
+    if isinstance(result, dict):
+        metrics["result"] = result  # what the set reports about itself
+    return metrics
+
+
+def _run_test_set(
+    test_set: partial,
+    root_dir: Path,
+    verbose: bool | float,
+    journal_path: None | Path = None,
+    in_flight: int = 1,
+    latency_s: float = 0.0,
+) -> tuple[dict[str, int], dict]:
+    # runs in a worker process, TOTALS_DICT is per process so return this sets counts
+    global JOURNAL, IN_FLIGHT, SIMULATED_LATENCY_S
+    IN_FLIGHT = in_flight
+    SIMULATED_LATENCY_S = latency_s
+    if not verbose:
+        ic.disable()
+    TOTALS_DICT.clear()
+    PHASE_NS.clear()
+    if journal_path is not None:
+        JOURNAL = Journal(journal_path)
+    try:
+        metrics = run_timed_test_set(test_set, root_dir)
+    finally:
+        if JOURNAL is not None:
+            JOURNAL.close()
+            JOURNAL = None
+    return dict(TOTALS_DICT), metrics
+
+
+# these pick up their partial dest_dir by shard, any other set is remade whole
+RESUMABLE_TEST_SETS = {make_all_two_byte_objects, make_hash_index_tree}
+
+
+def _unfinished_test_sets(root_dir: Path, test_sets: list[partial]) -> list[partial]:
+    # adds the totals of the sets JOURNAL has to TOTALS_DICT, returns the rest
+    unfinished = []
+    with open_dir_fd(os.fsencode(root_dir)) as root_fd:
+        for test_set in test_sets:
+            dest_dir = test_set.keywords["dest_dir"]
+            totals = JOURNAL.result(dest_dir)
+            if totals is not None:
+                for key, value in totals.items():
+                    count_total(key, value)
+                continue
+            if test_set.func not in RESUMABLE_TEST_SETS:
+                try:
+                    remove_tree_at(root_fd, dest_dir)
+                except FileNotFoundError:
+                    pass
+            unfinished.append(test_set)
+    ic(len(test_sets), len(unfinished))
+    return unfinished
+
+
+def run_test_sets(
+    *,
+    root_dir: Path,
+    test_sets: list[partial],
+    jobs: int,
+    verbose: bool | float = False,
+    journal_path: None | Path = None,
+    in_flight: int = 1,
+    latency_s: float = 0.0,
+) -> list[dict]:
+    """
+    make test_sets under root_dir, returns the run_timed_test_set() metrics of
+    each set made, in test_sets order
+
+    with journal_path the sets and shards the journal has are skipped and
+    what they finish is journaled
+
+    in_flight is the number of creates each set keeps going at once, for
+    filesystems where every op is a round trip. latency_s sleeps that long
+    before each create to stand in for one on a local filesystem
+    """
+    global JOURNAL, IN_FLIGHT, SIMULATED_LATENCY_S
+    IN_FLIGHT = in_flight
+    SIMULATED_LATENCY_S = latency_s
+    if journal_path is not None:
+        JOURNAL = Journal(journal_path)
+        test_sets = _unfinished_test_sets(root_dir, test_sets)
+    try:
+        if jobs == 1:
+            metrics = []
+            for test_set in test_sets:
+                totals_before = TOTALS_DICT.copy()
+                metrics.append(run_timed_test_set(test_set, root_dir))
+                if JOURNAL is not None:
+                    JOURNAL.record(
+                        test_set.keywords["dest_dir"],
+                        None,
+                        {
+                            key: value - totals_before.get(key, 0)
+                            for key, value in TOTALS_DICT.items()
+                        },
+                    )
+            return metrics
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(
+                    _run_test_set,
+                    test_set,
+                    root_dir,
+                    verbose,
+                    journal_path,
+                    in_flight,
+                    latency_s,
+                ): test_set
+                for test_set in test_sets
+            }
+            metrics = {}
+            for future in as_completed(futures):
+                totals, metrics[futures[future]] = future.result()
+                for key, value in totals.items():
+                    count_total(key, value)
+                if JOURNAL is not None:
+                    JOURNAL.record(futures[future].keywords["dest_dir"], None, totals)
+        return [metrics[test_set] for test_set in test_sets]
+    finally:
+        IN_FLIGHT = 1
+        SIMULATED_LATENCY_S = 0.0
+        if JOURNAL is not None:
+            JOURNAL.close()
+            JOURNAL = None
+
+
+def main(
+    root_dir,
+    long_tests: bool,
+    jobs: int = 1,
+    shard_jobs: int = 1,
+    verbose: bool | float = False,
+):
+    run_test_sets(
+        root_dir=root_dir,
+        test_sets=angry_test_sets(long_tests=long_tests, shard_jobs=shard_jobs),
+        jobs=jobs,
+        verbose=verbose,
+    )
+
+
+def filesystem_type(path: bytes | str | Path) -> None | str:
+    # type of the mount holding path, from /proc/mounts, None off linux
+    path = os.path.realpath(os.fsdecode(path))
+    fs_type = None
+    mount_point_length = -1
+    try:
+        with open("/proc/mounts", encoding="utf8", errors="surrogateescape") as fh:
+            for line in fh:
+                _, mount_point, _fs_type = line.split()[:3]
+                # spaces, tabs, newlines and backslashes are octal escaped
+                mount_point = re.sub(
+                    r"\\([0-7]{3})", lambda m: chr(int(m[1], 8)), mount_point
+                )
+                if path != mount_point and not path.startswith(
+                    mount_point.rstrip("/") + "/"
+                ):
+                    continue
+                if len(mount_point) >= mount_point_length:  # later mounts cover earlier
+                    fs_type = _fs_type
+                    mount_point_length = len(mount_point)
+    except FileNotFoundError:
+        return None
+    return fs_type
+
+
+def metrics_report(
+    *,
+    root_dir: Path,
+    phases_s: dict[str, float],
+    test_set_metrics: list[dict],
+    verification: VerificationResult,
+    jobs: int,
+    shard_jobs: int,
+) -> dict:
+    # everything --metrics-json writes, phases_s is the wall time of each cli phase
+    phases_s = dict(phases_s)
+    for metrics in test_set_metrics:
+        for phase, seconds in metrics["phases_s"].items():
+            phases_s[phase] = phases_s.get(phase, 0.0) + seconds
+    wall_s = sum(
+        phases_s.get(phase, 0.0) for phase in ("generate", "clone", "verify")
+    )
+    return {
+        "version": _package_version(),
+        "root_dir": os.fsdecode(root_dir),
+        "filesystem": filesystem_type(root_dir),
+        "jobs": jobs,
+        "shard_jobs": shard_jobs,
+        "wall_s": wall_s,
+        "objects": verification.entry_count,
+        "objects_per_s": verification.entry_count / wall_s if wall_s else None,
+        "phases_s": phases_s,
+        "test_sets": test_set_metrics,
+        "totals": dict(TOTALS_DICT),
+        "verified": verification.ok,
+        "mismatch_count": len(verification.mismatches),
+        "xattr_counts": {
+            os.fsdecode(path): count
+            for path, count in verification.xattr_counts.items()
+        },
+    }
+
+
+def _package_version() -> str:
+    try:
+        return importlib.metadata.version("angryfiles")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME", "~/.cache")
+    return Path(cache_home).expanduser() / "angryfiles"
+
+
+def _file_digest(path: bytes | str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(partial(fh.read, 2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def test_sets_key(
+    test_sets: list[partial],
+    template_file: None | bytes | str = None,
+    *,
+    template_contents: bool = True,
+) -> str:
+    """
+    digest of everything about test_sets that changes the tree they make,
+    template files by their contents, not their paths. without
+    template_contents the template options are left out, they change what
+    is in the files but not which entries there are
+    """
+    spec = []
+    digests: dict[bytes, str] = {}
+    if template_file and template_contents:
+        digests[os.fsencode(template_file)] = _file_digest(template_file)
+        spec.append(f"template_file={digests[os.fsencode(template_file)]}")
+    for test_set in test_sets:
+        spec.append(test_set.func.__name__)
+        for key, value in sorted(test_set.keywords.items()):
+            if key in {"jobs", "verbose"}:
+                continue  # only changes how, not what
+            if key in {"template_file", "template_hardlink"} and not template_contents:
+                continue
+            if key == "template_file" and value:
+                path = os.fsencode(value)
+                if path not in digests:
+                    digests[path] = _file_digest(path)
+                spec.append(f"{key}={digests[path]!r}")
+                continue
+            spec.append(f"{key}={value!r}")
+    return hashlib.sha256("\0".join(spec).encode("utf8")).hexdigest()
+
+
+def cache_key(
+    test_sets: list[partial],
+    template_file: None | bytes | str = None,
+) -> str:
+    # test_sets_key() of this package version, another may make another tree
+    key = f"{_package_version()}\0{test_sets_key(test_sets, template_file)}"
+    return hashlib.sha256(key.encode("utf8")).hexdigest()
+
+
+def clone_tree(
+    *,
+    src_dir: bytes | Path,
+    dest_dir: bytes | Path,
+    clone_mode: str = "auto",
+) -> dict[str, int]:
+    """
+    recreate the tree under src_dir inside the existing dest_dir
+
+    files are reflinked, hardlinked or copied (clone_mode auto tries them in
+    that order), everything is relative to the fd of the parent dir so depth
+    is not limited by PATH_MAX. times, modes and (as root) owners are kept,
+    dirs get theirs when they are left. names of a file already cloned are
+    hardlinked to its clone ("link"), an inode that could run out of
+    links is copied.
+    returns how many files each method handled
+    """
+    assert clone_mode in {"auto", "reflink", "hardlink", "copy"}
+    methods: dict[str, int] = defaultdict(int)
+    try_reflink = clone_mode in {"auto", "reflink"}
+    try_hardlink = clone_mode in {"auto", "hardlink"}
+    with open_dir_fd(os.fsencode(src_dir)) as src_root_fd, open_dir_fd(
+        os.fsencode(dest_dir)
+    ) as dest_root_fd:
+        # the metadata each dest dir walk_at() is in gets when it is left. only
+        # the fd of the current one is held, its parent is opened through ..
+        dest_fd = os.dup(dest_root_fd)
+        dir_metadata = []
+        # (st_dev, st_ino) of files with more than one name: path of the clone
+        cloned_inodes: dict[tuple[int, int], bytes] = {}
+        link_max = os.fpathconf(dest_root_fd, "PC_LINK_MAX")
+
+        def leave_dir() -> None:
+            nonlocal dest_fd
+            parent_fd = os.open(
+                b"..", os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC, dir_fd=dest_fd
+            )
+            os.close(dest_fd)
+            dest_fd = parent_fd
+            apply_metadata([dir_metadata.pop()], dir_fd=dest_fd)
+
+        try:
+            for src_fd, name, path, entry_type, depth in walk_at(src_root_fd):
+                while len(dir_metadata) > depth:
+                    leave_dir()
+                _stat = os.stat(name, dir_fd=src_fd, follow_symlinks=False)
+                metadata = _as_angry_object(name, entry_type, _stat, dir_fd=src_fd)
+                if entry_type == "dir":
+                    os.mkdir(name, dir_fd=dest_fd)
+                    child_fd = os.open(
+                        name,
+                        os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC,
+                        dir_fd=dest_fd,
+                    )
+                    os.close(dest_fd)
+                    dest_fd = child_fd
+                    dir_metadata.append(metadata)
+                    continue
+                if entry_type == "symlink":
+                    os.symlink(os.readlink(name, dir_fd=src_fd), name, dir_fd=dest_fd)
+                elif entry_type == "other":
+                    assert stat.S_ISFIFO(_stat.st_mode)
+                    os.mkfifo(name, stat.S_IMODE(_stat.st_mode), dir_fd=dest_fd)
+                else:
+                    inode = (_stat.st_dev, _stat.st_ino)
+                    if _stat.st_nlink > 1:
+                        if inode in cloned_inodes:
+                            os.link(
+                                cloned_inodes[inode],
+                                name,
+                                src_dir_fd=dest_root_fd,
+                                dst_dir_fd=dest_fd,
+                                follow_symlinks=False,
+                            )
+                            methods["link"] += 1
+                            continue  # the clone has the metadata
+                        cloned_inodes[inode] = path
+                    # every other name of the file may be linked to the clone too
+                    if (
+                        try_hardlink
+                        and not try_reflink
+                        and 2 * _stat.st_nlink <= link_max
+                    ):
+                        try:
+                            os.link(
+                                name,
+                                name,
+                                src_dir_fd=src_fd,
+                                dst_dir_fd=dest_fd,
+                                follow_symlinks=False,
+                            )
+                            methods["hardlink"] += 1
+                            continue  # same inode, nothing to copy
+                        except OSError as e:
+                            if e.errno == errno.EMLINK:
+                                pass  # only this inode is out of links, it is copied
+                            elif clone_mode == "hardlink" or e.errno not in {
+                                errno.EXDEV,
+                                errno.EPERM,
+                            }:
+                                raise
+                            else:
+                                try_hardlink = False
+                    src_file_fd = os.open(
+                        name, os.O_RDONLY | os.O_NOFOLLOW | os.O_CLOEXEC, dir_fd=src_fd
+                    )
+                    try:
+                        dst_file_fd = os.open(
+                            name,
+                            os.O_WRONLY
+                            | os.O_CREAT
+                            | os.O_EXCL
+                            | os.O_NOFOLLOW
+                            | os.O_CLOEXEC,
+                            stat.S_IMODE(_stat.st_mode),
+                            dir_fd=dest_fd,
+                        )
+                        try:
+                            method = clone_file(src_file_fd, dst_file_fd)
+                        finally:
+                            os.close(dst_file_fd)
+                    finally:
+                        os.close(src_file_fd)
+                    methods[method] += 1
+                    if method != "reflink" and try_reflink:
+                        if clone_mode == "reflink":
+                            raise OSError(
+                                errno.EOPNOTSUPP, "reflink not supported", path
+                            )
+                        try_reflink = False  # auto falls back to a hardlink farm
+                apply_metadata([metadata], dir_fd=dest_fd)
+            while dir_metadata:
+                leave_dir()
+        finally:
+            os.close(dest_fd)
+    return dict(methods)
+
+
+def _as_angry_object(
+    path: bytes,
+    entry_type: str,
+    _stat: os.stat_result,
+    *,
+    dir_fd: int,
+) -> AngryObject:
+    # the metadata of path for apply_metadata(), owners only as root
+    owned = os.geteuid() == 0
+    xattrs = None
+    if entry_type != "symlink":
+        fd = _open_for_xattrs(path, dir_fd=dir_fd)
+        try:
+            xattrs = tuple(
+                (os.fsencode(name), os.getxattr(fd, name))
+                for name in os.listxattr(fd)
+                if os.fsencode(name).startswith(XATTR_NAMESPACES)
+            )
+        finally:
+            os.close(fd)
+    return AngryObject(
+        path=path,
+        file_type=entry_type if entry_type != "other" else "fifo",
         target=None,
+        content=None,
+        atime_ns=_stat.st_atime_ns,
+        mtime_ns=_stat.st_mtime_ns,
+        mode=stat.S_IMODE(_stat.st_mode),
+        uid=_stat.st_uid if owned else None,
+        gid=_stat.st_gid if owned else None,
+        xattrs=xattrs or None,
     )
-    make_all_one_byte_objects(
-        root_dir=root_dir,
-        dest_dir=b"symlinks/all_1_byte_symlink_names_to_dot",
-        file_type="symlink",
-        count=253,
-        self_content=False,
-        target=b".",
-    )  # can cause code to fail on recursion +/+/+/+ -> .
-    make_all_one_byte_objects(
-        root_dir=root_dir,
-        dest_dir=b"symlinks/all_1_byte_symlink_names_to_dotdot",
-        file_type="symlink",
-        count=253,
-        self_content=False,
-        target=b"..",
-    )
-    make_all_one_byte_objects(
-        root_dir=root_dir,
-        dest_dir=b"symlinks/all_1_byte_symlink_names_to_dev_null",
-        file_type="symlink",
-        count=253,
-        self_content=False,
-        target=b"/dev/null",
-    )
-    make_all_one_byte_objects(
-        root_dir=root_dir,
-        dest_dir=b"symlinks/all_1_byte_broken_symlink_names",
-        file_type="broken_symlink",
-        count=253,
-        self_content=False,
-        target=b".",
-    )
-    make_all_one_byte_objects(
-        root_dir=root_dir,
-        dest_dir=b"symlinks/all_1_byte_self_symlink_names",
-        file_type="self_symlink",
-        count=253,
-        self_content=False,
-        target=b".",
+
+
+def _tree_size(root_dir: Path) -> int:
+    size = 0
+    with open_dir_fd(os.fsencode(root_dir)) as root_fd:
+        for fd, name, _, _, _ in walk_at(root_fd):
+            size += os.stat(name, dir_fd=fd, follow_symlinks=False).st_blocks * 512
+    return size
+
+
+def remove_cache_entry(entry: Path) -> None:
+    """
+    renamed aside first, so an interrupted removal never leaves an entry
+    with a meta.json, then removed with remove_tree_at() since a deep tree
+    is past the recursion limit of rmtree()
+    """
+    aside = entry.with_name(f"{entry.name}.removing-{os.getpid()}")
+    entry.rename(aside)
+    with open_dir_fd(os.fsencode(entry.parent)) as cache_fd:
+        remove_tree_at(cache_fd, os.fsencode(aside.name))
+
+
+def evict_cache(
+    *,
+    cache_dir: Path,
+    max_bytes: int,
+    keep: None | str = None,
+) -> list[str]:
+    # least recently used first, last use is the mtime of the entries meta.json
+    entries = []
+    for entry in cache_dir.iterdir():
+        meta_file = entry / "meta.json"
+        if not meta_file.exists():
+            continue
+        with open(meta_file, encoding="utf8") as fh:
+            size_bytes = json.load(fh)["size_bytes"]
+        entries.append((meta_file.stat().st_mtime_ns, entry.name, size_bytes))
+    entries.sort()
+    total = sum(size_bytes for _, _, size_bytes in entries)
+    evicted = []
+    for _, key, size_bytes in entries:
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        remove_cache_entry(cache_dir / key)
+        total -= size_bytes
+        evicted.append(key)
+    return evicted
+
+
+def clone_cached_tree(
+    *,
+    root_dir: Path,
+    test_sets: list[partial],
+    cache_dir: Path,
+    max_bytes: int,
+    clone_mode: str = "auto",
+    template_file: None | bytes | str = None,
+    jobs: int = 1,
+    verbose: bool | float = False,
+) -> dict[str, int]:
+    """
+    fill the existing root_dir from the cache, generating the cache entry first if needed
+
+    returns the TOTALS_DICT the tree was generated with
+    """
+    key = cache_key(test_sets, template_file)
+    entry = cache_dir / key
+    meta_file = entry / "meta.json"
+    if not meta_file.exists():
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_entry = cache_dir / f"{key}.tmp-{os.getpid()}"
+        tmp_tree = tmp_entry / "tree"
+        tmp_tree.mkdir(parents=True)
+        _totals = TOTALS_DICT.copy()
+        TOTALS_DICT.clear()
+        run_test_sets(
+            root_dir=tmp_tree,
+            test_sets=test_sets,
+            jobs=jobs,
+            verbose=verbose,
+        )
+        verification = verify_tree(root_dir=tmp_tree, test_sets=test_sets, jobs=jobs)
+        if not verification.ok:
+            remove_cache_entry(tmp_entry)
+            raise ValueError(f"not caching a bad tree: {verification.mismatches}")
+        meta = {
+            "version": _package_version(),
+            "totals": dict(TOTALS_DICT),
+            "size_bytes": _tree_size(tmp_tree),
+        }
+        TOTALS_DICT.clear()
+        TOTALS_DICT.update(_totals)
+        with open(tmp_entry / "meta.json", "x", encoding="utf8") as fh:
+            json.dump(meta, fh)
+        try:
+            tmp_entry.rename(entry)
+        except OSError as e:
+            if e.errno not in {errno.EEXIST, errno.ENOTEMPTY}:
+                raise
+            remove_cache_entry(tmp_entry)  # another run cached it first
+    os.utime(meta_file)  # mark as most recently used
+    with open(meta_file, encoding="utf8") as fh:
+        meta = json.load(fh)
+    methods = clone_tree(
+        src_dir=entry / "tree", dest_dir=root_dir, clone_mode=clone_mode
     )
+    ic(key, methods)
+    evict_cache(cache_dir=cache_dir, max_bytes=max_bytes, keep=key)
+    return meta["totals"]
+
+
+def one_mad_file_test_sets(template_file) -> list[partial]:
+    return [
+        partial(
+            make_one_all_byte_file,
+            dest_dir=b"one_mad_file",
+            template_file=template_file,
+        )
+    ]
+
 
-    # all length objects
-    # expected file count = 255
-    make_all_length_objects(
+def one_mad_file(root_dir, template_file):
+    run_test_sets(
         root_dir=root_dir,
-        dest_dir=b"files/all_length_file_names",
-        file_type="file",
-        count=255,
-        self_content=False,
-        target=None,
-        all_bytes=False,
+        test_sets=one_mad_file_test_sets(template_file),
+        jobs=1,
     )
-    make_all_length_objects(
-        root_dir=root_dir,
-        dest_dir=b"files/all_length_file_names_self_content",
-        file_type="file",
-        count=255,
-        self_content=True,
-        target=None,
-        all_bytes=False,
+
+
+test_set_options = [
+    click.option("--long-tests", is_flag=True),
+    click.option("--one-angry-file", is_flag=True),
+    click.option(
+        "--template-file",
+        type=click.Path(
+            exists=True, dir_okay=False, file_okay=True, path_type=str, allow_dash=True
+        ),
+        help="Every file without its own content is a copy of this one, reflinked when the fs can.",
+    ),
+    click.option(
+        "--template-hardlink",
+        is_flag=True,
+        help="Template copies are hardlinks to one inode per test set, so they share times and mode.",
+    ),
+    click.option(
+        "--hash-tree-count",
+        type=click.IntRange(min=0),
+        default=0,
+        help="Add a hash prefix index tree with this many leaves.",
+    ),
+    click.option("--hash-tree-depth", type=click.IntRange(min=1, max=5), default=3),
+    click.option(
+        "--hash-tree-width",
+        type=click.IntRange(min=1),
+        default=1,
+        help="Hex chars per level, fan-out is 16**width.",
+    ),
+    click.option(
+        "--hash-tree-algorithm",
+        type=click.Choice(["sha1", "sha256", "sha3_256"]),
+        default="sha1",
+    ),
+    click.option(
+        "--random-tree-count",
+        type=click.IntRange(min=0),
+        default=0,
+        help="Add a random tree of this many files and dirs.",
+    ),
+    click.option(
+        "--random-tree-seed",
+        type=click.IntRange(min=0),
+        help="Replay a random tree, a new seed is printed to stderr when not given.",
+    ),
+    click.option(
+        "--random-tree-name-lengths",
+        type=(click.IntRange(min=1, max=255), click.IntRange(min=1, max=255)),
+        default=(1, 255),
+        help="MIN MAX, name lengths are uniform over this range.",
+    ),
+    click.option(
+        "--random-tree-max-depth",
+        type=click.IntRange(min=0),
+        default=4,
+        help="Paths must fit in PATH_MAX, so at most 4096 // (MAX + 1) - 1.",
+    ),
+    click.option(
+        "--random-tree-dir-ratio",
+        type=click.FloatRange(min=0, max=1),
+        default=0.1,
+        help="Chance each object above the max depth is a dir.",
+    ),
+    click.option(
+        "--random-tree-utf8",
+        is_flag=True,
+        help="Random tree names are valid utf8 instead of any bytes.",
+    ),
+    click.option(
+        "--size-matrix-max",
+        type=click.IntRange(min=0),
+        default=0,
+        help="Add files of every size to 1KiB, every KiB to 1MiB and around each power of two up to this size.",
+    ),
+    click.option(
+        "--size-matrix-data",
+        is_flag=True,
+        help="Fill the size matrix with a byte pattern, it is sparse (plus one file as large as the fs allows) otherwise.",
+    ),
+    click.option(
+        "--metadata-matrix",
+        is_flag=True,
+        help="Add every mode, edge timestamps and (as root) owners, set in a pass after the files and dirs are made.",
+    ),
+    click.option(
+        "--deep-tree-path-length",
+        type=click.IntRange(min=0),
+        default=0,
+        help="Add ~/~/~ and 255 byte name trees nested until a path is this long, 8192 is twice PATH_MAX on linux.",
+    ),
+    click.option(
+        "--deep-tree-every-byte",
+        is_flag=True,
+        help="Add a deep tree for every 1 byte name too.",
+    ),
+    click.option(
+        "--symlink-graph",
+        is_flag=True,
+        help="Add symlink chains up to and past the ELOOP limit ending in each object type, symlink cycles and next_symlink rings, with the time to resolve each chain in the metrics.",
+    ),
+    click.option(
+        "--symlink-cycle-max",
+        type=click.IntRange(1, 253),
+        default=MAXSYMLINKS + 1,
+        show_default=True,
+        help="Add --symlink-graph cycles of every length up to this.",
+    ),
+    click.option(
+        "--hardlinks",
+        type=click.IntRange(min=0),
+        default=0,
+        help="Add every 1 byte and every length name hardlinked to one file, and a file with this many links spread across dirs, 65000 is the ext4 limit.",
+    ),
+    click.option(
+        "--hardlinks-per-dir",
+        type=click.IntRange(1, 64515),
+        default=1000,
+        show_default=True,
+        help="Put this many of the --hardlinks links in each dir.",
+    ),
+    click.option(
+        "--hardlinks-link-max",
+        is_flag=True,
+        help="Give the --hardlinks spread file as many links as the LINK_MAX of the fs allows instead, --hardlinks only turns the sets on.",
+    ),
+    click.option(
+        "--dedup-count",
+        type=click.IntRange(min=0),
+        default=0,
+        help="Add a dedup corpus of this many files in a/ and b/ with a manifest.json of the duplicate groups.",
+    ),
+    click.option(
+        "--dedup-seed",
+        type=click.IntRange(min=0),
+        help="Replay a dedup corpus, a new seed is printed to stderr when not given.",
+    ),
+    click.option(
+        "--dedup-ratio",
+        type=click.FloatRange(min=0, max=1),
+        default=0.5,
+        show_default=True,
+        help="Chance each file is a duplicate of an earlier one.",
+    ),
+    click.option(
+        "--dedup-near-ratio",
+        type=click.FloatRange(min=0, max=1),
+        default=0.05,
+        show_default=True,
+        help="Chance each file is an earlier content with one byte inverted.",
+    ),
+    click.option(
+        "--dedup-sizes",
+        type=click.Choice(DEDUP_SIZE_DISTRIBUTIONS),
+        default="lognormal",
+        show_default=True,
+        help="fixed is every file --dedup-max-size, lognormal is mostly small files (4KiB median) with a long tail.",
+    ),
+    click.option(
+        "--dedup-max-size",
+        type=click.IntRange(min=DEDUP_MIN_SIZE),
+        default=2**20,
+        show_default=True,
+    ),
+    click.option(
+        "--xattrs",
+        is_flag=True,
+        help="Add files and dirs with every 1 byte and every length xattr name, and values up to the fs limit.",
+    ),
+]
+
+
+def build_test_sets(
+    *,
+    long_tests: bool,
+    one_angry_file: bool,
+    template_file: None | str,
+    template_hardlink: bool,
+    hash_tree_count: int,
+    hash_tree_depth: int,
+    hash_tree_width: int,
+    hash_tree_algorithm: str,
+    random_tree_count: int,
+    random_tree_seed: None | int,
+    random_tree_name_lengths: tuple[int, int],
+    random_tree_max_depth: int,
+    random_tree_dir_ratio: float,
+    random_tree_utf8: bool,
+    size_matrix_max: int,
+    size_matrix_data: bool,
+    metadata_matrix: bool,
+    xattrs: bool,
+    deep_tree_path_length: int,
+    deep_tree_every_byte: bool,
+    symlink_graph: bool,
+    symlink_cycle_max: int,
+    hardlinks: int,
+    hardlinks_per_dir: int,
+    hardlinks_link_max: bool,
+    dedup_count: int,
+    dedup_seed: None | int,
+    dedup_ratio: float,
+    dedup_near_ratio: float,
+    dedup_sizes: str,
+    dedup_max_size: int,
+    shard_jobs: int = 1,
+) -> list[partial]:
+    # the test sets test_set_options select, shared by every command
+    if one_angry_file:
+        test_sets = one_mad_file_test_sets(template_file)
+    else:
+        test_sets = angry_test_sets(long_tests=long_tests, shard_jobs=shard_jobs)
+    test_sets += hash_index_test_sets(
+        count=hash_tree_count,
+        algorithm=hash_tree_algorithm,
+        depth=hash_tree_depth,
+        width=hash_tree_width,
+        jobs=shard_jobs,
     )
-    make_all_length_objects(
-        root_dir=root_dir,
-        dest_dir=b"files/all_length_file_names_all_bytes__self_content",
-        file_type="file",
-        count=255,
-        self_content=True,
-        all_bytes=True,
-        target=b".",
+    if random_tree_count:
+        min_name_length, max_name_length = random_tree_name_lengths
+        if min_name_length > max_name_length:
+            raise click.BadParameter(
+                f"MIN {min_name_length} is more than MAX {max_name_length}",
+                param_hint="--random-tree-name-lengths",
+            )
+        # iter_random_tree() paths are made whole and must fit in PATH_MAX
+        if (random_tree_max_depth + 1) * (max_name_length + 1) > 4096:
+            raise click.BadParameter(
+                f"{max_name_length} byte names nest at most "
+                f"{4096 // (max_name_length + 1) - 1} dirs deep within PATH_MAX",
+                param_hint="--random-tree-max-depth",
+            )
+    test_sets += random_tree_test_sets(
+        count=random_tree_count,
+        seed=random_tree_seed,
+        min_name_length=random_tree_name_lengths[0],
+        max_name_length=random_tree_name_lengths[1],
+        max_depth=random_tree_max_depth,
+        dir_ratio=random_tree_dir_ratio,
+        utf8=random_tree_utf8,
     )
-    make_all_length_objects(
-        root_dir=root_dir,
-        dest_dir=b"symlinks/all_length_symlink_names_to_dot",
-        file_type="symlink",
-        count=255,
-        self_content=False,
-        target=b".",
-        all_bytes=False,
+    test_sets += size_matrix_test_sets(
+        max_size=size_matrix_max,
+        sparse=not size_matrix_data,
     )
-    make_all_length_objects(
-        root_dir=root_dir,
-        dest_dir=b"symlinks/all_length_symlink_names_to_dotdot",
-        file_type="symlink",
-        count=255,
-        target=b"..",
-        self_content=False,
-        all_bytes=False,
-    )
-    make_all_length_objects(
-        root_dir=root_dir,
-        dest_dir=b"symlinks/all_length_symlink_names_to_dev_null",
-        file_type="symlink",
-        count=255,
-        target=b"/dev/null",
-        self_content=False,
-        all_bytes=False,
-    )
-    make_all_length_objects(
-        root_dir=root_dir,
-        dest_dir=b"symlinks/all_length_broken_symlink_names",
-        file_type="broken_symlink",
-        count=255,
-        self_content=False,
-        target=b".",
-        all_bytes=False,
+    test_sets += metadata_matrix_test_sets(enabled=metadata_matrix)
+    test_sets += xattr_matrix_test_sets(enabled=xattrs)
+    if deep_tree_path_length:
+        # ~ is the deepest tree, 1 byte names
+        depth = deep_tree_depth(name_length=1, path_length=deep_tree_path_length)
+        open_file_limit = raise_open_file_limit()
+        if walk_open_files(depth) > open_file_limit:
+            raise click.BadParameter(
+                f"walking {depth} levels needs {walk_open_files(depth)} open files, "
+                f"RLIMIT_NOFILE allows {open_file_limit}",
+                param_hint="--deep-tree-path-length",
+            )
+    test_sets += deep_tree_test_sets(
+        path_length=deep_tree_path_length,
+        every_byte=deep_tree_every_byte,
     )
-    make_all_length_objects(
-        root_dir=root_dir,
-        dest_dir=b"symlinks/all_length_self_symlink_names",
-        file_type="self_symlink",
-        count=255,
-        self_content=False,
-        target=b".",
-        all_bytes=False,
+    test_sets += symlink_graph_test_sets(
+        enabled=symlink_graph, cycle_max=symlink_cycle_max
     )
-    make_all_length_objects(
-        root_dir=root_dir,
-        dest_dir=b"dirs/all_length_dir_names",
-        file_type="dir",
-        count=255,
-        self_content=False,
-        target=None,
-        all_bytes=False,
+    test_sets += hardlink_test_sets(
+        count=hardlinks, per_dir=hardlinks_per_dir, link_max=hardlinks_link_max
     )
-    make_times_around_epoch_to_32bit_limit(
-        root_dir=root_dir,
-        dest_dir=b"files/32bit_limit_times",
-        file_type="file",
-        count=127,
-        target=None,
+    test_sets += dedup_corpus_test_sets(
+        count=dedup_count,
+        seed=dedup_seed,
+        ratio=dedup_ratio,
+        near_ratio=dedup_near_ratio,
+        sizes=dedup_sizes,
+        max_size=dedup_max_size,
     )
+    if template_file:
+        test_sets = [
+            partial(
+                test_set,
+                template_file=os.fsencode(template_file),
+                template_hardlink=template_hardlink,
+            )
+            if "template_file" in inspect.signature(test_set.func).parameters
+            else test_set
+            for test_set in test_sets
+        ]
+    return test_sets
 
-    if long_tests:
-        # 2 byte names
-        # expected file count = (255 - 1) * (255 - 1) = 64516 - 1 = 64515
-        # since only NULL and / are invalid, and there is no '..' file
-        # /bin/ls -A -f --hide-control-chars 1/2_byte_file_names | wc -l returns 64515
-        make_all_two_byte_objects(
-            root_dir=root_dir,
-            dest_dir=b"files/all_2_byte_file_names",
-            file_type="file",
-            count=64515,
-            target=None,
-        )
-        make_all_two_byte_objects(
-            root_dir=root_dir,
-            dest_dir=b"dirs/all_2_byte_dir_names",
-            file_type="dir",
-            count=64515,
-            target=None,
-        )  # takes forever to delete
-        make_all_two_byte_objects(
-            root_dir=root_dir,
-            dest_dir=b"symlinks/all_2_byte_symlink_names_to_dot",
-            file_type="symlink",
-            count=64515,
-            target=b".",
-        )
-        make_all_two_byte_objects(
-            root_dir=root_dir,
-            dest_dir=b"symlinks/all_2_byte_symlink_names_to_dotdot",
-            file_type="symlink",
-            count=64515,
-            target=b"..",
-        )
-        make_all_two_byte_objects(
-            root_dir=root_dir,
-            dest_dir=b"symlinks/all_2_byte_symlink_names_to_dev_null",
-            file_type="symlink",
-            count=64515,
-            target=b"/dev/null",
-        )
-        make_all_two_byte_objects(
-            root_dir=root_dir,
-            dest_dir=b"symlinks/all_2_byte_broken_symlink_names",
-            file_type="broken_symlink",
-            count=64515,
-            target=b".",
+
+BENCH_STRATEGIES = ("os.walk", "scandir", "getdents", "find", "fd_walk")
+
+
+def _scandir_count(path: bytes) -> int:
+    count = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            count += 1
+            if entry.is_dir(follow_symlinks=False):
+                count += _scandir_count(entry.path)
+    return count
+
+
+def bench_count(strategy: str, root_dir: bytes) -> int:
+    # entries below root_dir, not counting root_dir
+    if strategy == "noop":
+        return 0
+    if strategy == "os.walk":
+        return sum(
+            len(dirnames) + len(filenames)
+            for _, dirnames, filenames in os.walk(root_dir)
         )
+    if strategy == "scandir":
+        return _scandir_count(root_dir)
+    if strategy == "getdents":
+        return sum(1 for _ in paths(root_dir))
+    if strategy == "find":
+        # one byte per entry, names with newlines cant throw the count off
+        found = subprocess.run(
+            [b"find", root_dir, b"-printf", b"x"],
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout
+        return len(found) - 1
+    if strategy == "fd_walk":
+        with open_dir_fd(root_dir) as root_fd:
+            return sum(1 for _ in iter_tree_at(root_fd))
+    raise ValueError(strategy)
 
-    # TODO max length objects
 
+def _bench_child(strategy: str, root_dir: str) -> None:
+    # runs in the child process bench_strategy() starts, so imports are not timed
+    start = time.perf_counter()
+    entries = bench_count(strategy, os.fsencode(root_dir))
+    seconds = time.perf_counter() - start
+    print(json.dumps({"entries": entries, "seconds": seconds}))
+
+
+def _strace_total_calls(strace_file: Path) -> int:
+    # last line: % time, seconds, usecs/call, calls, [errors,] total
+    lines = strace_file.read_text(encoding="utf8").strip().splitlines()
+    return int(lines[-1].split()[3])
+
+
+def _run_bench_child(
+    strategy: str, root_dir: bytes, *, strace_file: None | Path = None
+) -> tuple[dict, int]:
+    # (what _bench_child() printed, peak RSS in KiB), under strace -c with strace_file
+    command = [
+        sys.executable,
+        "-c",
+        "import sys; from angryfiles.angryfiles import _bench_child; _bench_child(sys.argv[1], sys.argv[2])",
+        strategy,
+        os.fsdecode(root_dir),
+    ]
+    if strace_file is not None:
+        command = ["strace", "-f", "-c", "-o", str(strace_file), *command]
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+        stdout = process.stdout.read()
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return json.loads(stdout.decode("utf8").splitlines()[-1]), rusage.ru_maxrss
 
-def one_mad_file(root_dir, template_file):
-    make_one_all_byte_file(
-        root_dir=root_dir,
-        dest_dir=b"one_mad_file",
-        template_file=template_file,
-    )
+
+def bench_strategy(
+    *,
+    strategy: str,
+    root_dir: bytes,
+    strace: bool,
+) -> dict:
+    """
+    time one traversal strategy in a fresh child process
+
+    peak RSS comes from wait4() of the child. with strace the syscalls are
+    counted by strace -c in a second child that is not timed, under ptrace
+    every syscall is slower (they include interpreter startup, see the noop
+    strategy)
+    """
+    result, peak_rss_kib = _run_bench_child(strategy, root_dir)
+    result["strategy"] = strategy
+    result["peak_rss_kib"] = peak_rss_kib
+    result["syscalls"] = None
+    if strace:
+        with TemporaryDirectory(prefix="tmp-angryfiles-bench-") as tmp_dir:
+            strace_file = Path(tmp_dir) / "strace"
+            _run_bench_child(strategy, root_dir, strace_file=strace_file)
+            result["syscalls"] = _strace_total_calls(strace_file)
+    return result
+
+
+def bench_tree(
+    *,
+    root_dir: bytes,
+    strategies: Iterable[str],
+    repeat: int,
+    strace: bool,
+) -> dict:
+    # the noop run is the baseline subtracted for the *_net values
+    baseline = bench_strategy(strategy="noop", root_dir=root_dir, strace=strace)
+    results = []
+    for strategy in strategies:
+        runs = [
+            bench_strategy(strategy=strategy, root_dir=root_dir, strace=strace)
+            for _ in range(repeat)
+        ]
+        seconds = sorted(run["seconds"] for run in runs)
+        best = runs[0] | {"seconds": seconds[0]}
+        best["seconds_median"] = seconds[len(seconds) // 2]
+        best["entries_per_second"] = best["entries"] / max(seconds[0], 1e-9)
+        best["peak_rss_kib"] = max(run["peak_rss_kib"] for run in runs)
+        best["peak_rss_net_kib"] = best["peak_rss_kib"] - baseline["peak_rss_kib"]
+        if strace:
+            best["syscalls_net"] = best["syscalls"] - baseline["syscalls"]
+        results.append(best)
+    return {
+        "root_dir": os.fsdecode(root_dir),
+        "baseline": baseline,
+        "results": results,
+    }
 
 
 @click.command()
 @click.argument(
-    "output_dir", type=click.Path(exists=False, path_type=str, allow_dash=True), nargs=1
+    "output_dir",
+    type=click.Path(exists=False, path_type=str, allow_dash=True),
+    nargs=1,
+    required=False,
 )  # todo recursive bug...
 @click.option("--stdout", is_flag=True)
-@click.option("--long-tests", is_flag=True)
-@click.option("--one-angry-file", is_flag=True)
 @click.option(
-    "--template-file",
-    type=click.Path(
-        exists=True, dir_okay=False, file_okay=True, path_type=str, allow_dash=True
-    ),
+    "--stream",
+    type=click.Choice(["nul", "length", "tar"]),
+    help="Write the objects to stdout (as paths, records or a pax tar) without creating them, output_dir is not used.",
+)
+@click_add_options(test_set_options)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Run this many test sets at once in a process pool.",
+)
+@click.option(
+    "--shard-jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Threads per 2 byte test set, each working one first byte shard.",
+)
+@click.option(
+    "--in-flight",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Creates each test set keeps going at once, for NFS, FUSE and other high latency filesystems.",
+)
+@click.option(
+    "--simulate-latency-ms",
+    type=click.FloatRange(min=0),
+    default=0.0,
+    help="Sleep this long before every create, to try --in-flight on a local filesystem.",
+)
+@click.option("--cache", is_flag=True, help="Clone the tree from the snapshot cache.")
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=default_cache_dir,
+)
+@click.option(
+    "--cache-max-bytes",
+    type=click.IntRange(min=0),
+    default=10 * 1024**3,
+    help="Evict least recently used trees above this size.",
+)
+@click.option(
+    "--cache-clone",
+    type=click.Choice(["auto", "reflink", "hardlink", "copy"]),
+    default="auto",
+    help="hardlink shares inodes with the cache, writing to the files changes the cache.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Finish an interrupted run in output_dir, skipping what its journal has.",
+)
+@click.option(
+    "--metrics-json",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Write per phase and per test set timings, throughput and the filesystem type here.",
 )
 @click_add_options(click_global_options)
 @click.pass_context
@@ -844,12 +5926,51 @@ def cli(
     *,
     output_dir: str,
     stdout: bool,
+    stream: None | str,
     long_tests: bool,
     one_angry_file: bool,
+    hash_tree_count: int,
+    hash_tree_depth: int,
+    hash_tree_width: int,
+    hash_tree_algorithm: str,
+    random_tree_count: int,
+    random_tree_seed: None | int,
+    random_tree_name_lengths: tuple[int, int],
+    random_tree_max_depth: int,
+    random_tree_dir_ratio: float,
+    random_tree_utf8: bool,
+    size_matrix_max: int,
+    size_matrix_data: bool,
+    metadata_matrix: bool,
+    xattrs: bool,
+    deep_tree_path_length: int,
+    deep_tree_every_byte: bool,
+    symlink_graph: bool,
+    symlink_cycle_max: int,
+    hardlinks: int,
+    hardlinks_per_dir: int,
+    hardlinks_link_max: bool,
+    dedup_count: int,
+    dedup_seed: None | int,
+    dedup_ratio: float,
+    dedup_near_ratio: float,
+    dedup_sizes: str,
+    dedup_max_size: int,
     template_file: str,
+    template_hardlink: bool,
+    cache: bool,
+    cache_dir: Path,
+    cache_max_bytes: int,
+    cache_clone: str,
+    resume: bool,
+    metrics_json: None | Path,
+    jobs: int,
+    shard_jobs: int,
+    in_flight: int,
+    simulate_latency_ms: float,
     verbose_inf: bool,
     dict_output: bool,
-    verbose: bool | int | float = False,
+    verbose: bool | float = False,
 ):
     tty, verbose = tv(
         ctx=ctx,
@@ -859,6 +5980,58 @@ def cli(
 
     if not verbose:
         ic.disable()
+    raise_open_file_limit()
+
+    test_sets = build_test_sets(
+        long_tests=long_tests,
+        one_angry_file=one_angry_file,
+        template_file=template_file,
+        template_hardlink=template_hardlink,
+        hash_tree_count=hash_tree_count,
+        hash_tree_depth=hash_tree_depth,
+        hash_tree_width=hash_tree_width,
+        hash_tree_algorithm=hash_tree_algorithm,
+        random_tree_count=random_tree_count,
+        random_tree_seed=random_tree_seed,
+        random_tree_name_lengths=random_tree_name_lengths,
+        random_tree_max_depth=random_tree_max_depth,
+        random_tree_dir_ratio=random_tree_dir_ratio,
+        random_tree_utf8=random_tree_utf8,
+        size_matrix_max=size_matrix_max,
+        size_matrix_data=size_matrix_data,
+        metadata_matrix=metadata_matrix,
+        xattrs=xattrs,
+        deep_tree_path_length=deep_tree_path_length,
+        deep_tree_every_byte=deep_tree_every_byte,
+        symlink_graph=symlink_graph,
+        symlink_cycle_max=symlink_cycle_max,
+        hardlinks=hardlinks,
+        hardlinks_per_dir=hardlinks_per_dir,
+        hardlinks_link_max=hardlinks_link_max,
+        dedup_count=dedup_count,
+        dedup_seed=dedup_seed,
+        dedup_ratio=dedup_ratio,
+        dedup_near_ratio=dedup_near_ratio,
+        dedup_sizes=dedup_sizes,
+        dedup_max_size=dedup_max_size,
+        shard_jobs=shard_jobs,
+    )
+
+    if stream:
+        if stream == "tar":
+            write_tar(
+                iter_test_sets(test_sets),
+                fh=sys.stdout.buffer,
+                template_file=template_file,
+            )
+        else:
+            write_stream(
+                iter_test_sets(test_sets),
+                stream_format=stream,
+                fh=sys.stdout.buffer,
+            )
+        sys.stdout.buffer.flush()
+        return
 
     if not output_dir:
         assert stdout
@@ -874,52 +6047,87 @@ def cli(
             Path(output_dir).expanduser().absolute()
         )  # hmmm. ~ is a valid path name Bug.
 
-    if root_dir.exists():
+    if resume and cache:
+        raise ValueError("--resume can not be used with --cache")
+    if not resume and root_dir.exists():
         raise ValueError(f"output_dir: {root_dir} already exists")
-    root_dir.mkdir()
+    resuming = root_dir.exists()
+    root_dir.mkdir(exist_ok=resume)
+    write_marker(root_dir, test_sets, resume=resuming)
 
-    os.chdir(root_dir)
-    if one_angry_file:
-        one_mad_file(root_dir=root_dir, template_file=template_file)
+    phases_s = {}
+    test_set_metrics = []
+    start_ns = time.perf_counter_ns()
+    if cache:
+        TOTALS_DICT.update(
+            clone_cached_tree(
+                root_dir=root_dir,
+                test_sets=test_sets,
+                cache_dir=cache_dir,
+                max_bytes=cache_max_bytes,
+                clone_mode=cache_clone,
+                template_file=template_file,
+                jobs=jobs,
+                verbose=verbose,
+            )
+        )
+        phases_s["clone"] = (time.perf_counter_ns() - start_ns) / 1e9
     else:
-        assert not template_file
-        main(root_dir=root_dir, long_tests=long_tests)
+        test_set_metrics = run_test_sets(
+            root_dir=root_dir,
+            test_sets=test_sets,
+            jobs=jobs,
+            verbose=verbose,
+            journal_path=default_journal_path(root_dir),
+            in_flight=in_flight,
+            latency_s=simulate_latency_ms / 1000,
+        )
+        phases_s["generate"] = (time.perf_counter_ns() - start_ns) / 1e9
 
     TOTALS_DICT["all_symlinks"] = (
         TOTALS_DICT["symlink"]
         + TOTALS_DICT["broken_symlink"]
         + TOTALS_DICT["self_symlink"]
         + TOTALS_DICT["circular_symlink"]
+        + TOTALS_DICT["next_symlink"]
+        + TOTALS_DICT["next_symlinkable_byte"]
     )
-    command = " ".join(
-        ["/usr/bin/find", root_dir.as_posix(), "-printf '\n' |", "wc -l"]
-    )
-    final_count = int(
-        subprocess.check_output(command, stderr=subprocess.STDOUT, shell=True)
-    )
+    start_ns = time.perf_counter_ns()
+    verification = verify_tree(root_dir=root_dir, test_sets=test_sets, jobs=jobs)
+    phases_s["verify"] = (time.perf_counter_ns() - start_ns) / 1e9
+    final_count = verification.entry_count
 
-    if one_angry_file:
-        top_level = 1  # root_dir
-    else:
-        top_level = 4  # top level dirs: root_dir/dirs
-        #                                        /files
-        #                                        /symlinks
+    # root_dir and the top level dirs only holding dest_dirs: root_dir/dirs
+    #                                                                  /files
+    #                                                                  /symlinks
+    top_level = 1 + len(
+        {
+            test_set.keywords["dest_dir"].split(b"/")[0]
+            for test_set in test_sets
+            if b"/" in test_set.keywords["dest_dir"]
+        }
+    )
 
     expected_final_count = (
         TOTALS_DICT["all_symlinks"]
         + TOTALS_DICT["file"]
+        + TOTALS_DICT["sparse_file"]
+        + TOTALS_DICT["link"]
+        + TOTALS_DICT["fifo"]
         + TOTALS_DICT["dir"]
         + TOTALS_DICT["working_dir"]
         + top_level
     )
 
     # symlink verification
-    # broken_symlink + circular_symlink + self_symlink + symlink == all_symlinks
+    # broken_symlink + circular_symlink + self_symlink + next_* + symlink == all_symlinks
     # note 'symlink' should be named 'unbroken_symlinks_to_another_location'
     assert (
         TOTALS_DICT["broken_symlink"]
         + TOTALS_DICT["circular_symlink"]
         + TOTALS_DICT["self_symlink"]
+        + TOTALS_DICT["next_symlink"]
+        + TOTALS_DICT["next_symlinkable_byte"]
         + TOTALS_DICT["symlink"]
     ) == TOTALS_DICT["all_symlinks"]
 
@@ -931,15 +6139,298 @@ def cli(
         pprint.pprint(TOTALS_DICT)
         print("final_count:", final_count)
         print("expected_final_count:", expected_final_count)
+        if verification.xattr_counts:
+            print(
+                "xattr_count:",
+                sum(verification.xattr_counts.values()),
+                "on",
+                len(verification.xattr_counts),
+                "objects",
+            )
+    if metrics_json:
+        with open(metrics_json, "w", encoding="utf8") as fh:
+            json.dump(
+                metrics_report(
+                    root_dir=root_dir,
+                    phases_s=phases_s,
+                    test_set_metrics=test_set_metrics,
+                    verification=verification,
+                    jobs=jobs,
+                    shard_jobs=shard_jobs,
+                ),
+                fh,
+                indent=2,
+            )
+    for mismatch in verification.mismatches:
+        print("mismatch:", mismatch, file=sys.stderr)
+    if not verification.ok:
+        ctx.exit(1)
     assert final_count == expected_final_count
+    default_journal_path(root_dir).unlink(missing_ok=True)
 
     if stdout:
+        marker = os.path.join(os.fsencode(root_dir), MARKER_NAME)
         for path in paths(
             root_dir,
         ):
+            if os.fsencode(path.path) == marker:
+                continue
             output(
                 path.path,
                 reason=path,
                 tty=tty,
                 dict_output=dict_output,
             )
+
+
+@click.command()
+@click.option(
+    "--root-dir",
+    type=click.Path(exists=True, file_okay=False, path_type=str),
+    help="Benchmark this existing tree instead of generating one.",
+)
+@click_add_options(test_set_options)
+@click.option(
+    "--strategy",
+    "strategies",
+    type=click.Choice(BENCH_STRATEGIES),
+    multiple=True,
+    help="Repeat to pick strategies, default is all of them.",
+)
+@click.option("--repeat", type=click.IntRange(min=1), default=3)
+@click.option(
+    "--strace/--no-strace",
+    default=None,
+    help="Count syscalls with strace -c in an extra untimed run of each strategy, default is on when strace is installed.",
+)
+@click.option("--jobs", type=click.IntRange(min=1), default=1)
+@click_add_options(click_global_options)
+@click.pass_context
+def bench(
+    ctx,
+    *,
+    root_dir: None | str,
+    long_tests: bool,
+    one_angry_file: bool,
+    template_file: None | str,
+    template_hardlink: bool,
+    hash_tree_count: int,
+    hash_tree_depth: int,
+    hash_tree_width: int,
+    hash_tree_algorithm: str,
+    random_tree_count: int,
+    random_tree_seed: None | int,
+    random_tree_name_lengths: tuple[int, int],
+    random_tree_max_depth: int,
+    random_tree_dir_ratio: float,
+    random_tree_utf8: bool,
+    size_matrix_max: int,
+    size_matrix_data: bool,
+    metadata_matrix: bool,
+    xattrs: bool,
+    deep_tree_path_length: int,
+    deep_tree_every_byte: bool,
+    symlink_graph: bool,
+    symlink_cycle_max: int,
+    hardlinks: int,
+    hardlinks_per_dir: int,
+    hardlinks_link_max: bool,
+    dedup_count: int,
+    dedup_seed: None | int,
+    dedup_ratio: float,
+    dedup_near_ratio: float,
+    dedup_sizes: str,
+    dedup_max_size: int,
+    strategies: tuple[str, ...],
+    repeat: int,
+    strace: None | bool,
+    jobs: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool | float = False,
+):
+    """
+    time how fast each strategy walks an angryfiles tree, JSON to stdout
+    """
+    del dict_output  # the report is always JSON
+    _, verbose = tv(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+    )
+
+    if not verbose:
+        ic.disable()
+    raise_open_file_limit()
+
+    if strace is None:
+        strace = shutil.which("strace") is not None
+    if not strategies:
+        strategies = BENCH_STRATEGIES
+
+    with TemporaryDirectory(prefix="tmp-angryfiles-bench-", dir="/tmp") as tmp_dir:
+        if root_dir is None:
+            root_dir = os.path.join(tmp_dir, "tree")
+            os.mkdir(root_dir)
+            test_sets = build_test_sets(
+                long_tests=long_tests,
+                one_angry_file=one_angry_file,
+                template_file=template_file,
+                template_hardlink=template_hardlink,
+                hash_tree_count=hash_tree_count,
+                hash_tree_depth=hash_tree_depth,
+                hash_tree_width=hash_tree_width,
+                hash_tree_algorithm=hash_tree_algorithm,
+                random_tree_count=random_tree_count,
+                random_tree_seed=random_tree_seed,
+                random_tree_name_lengths=random_tree_name_lengths,
+                random_tree_max_depth=random_tree_max_depth,
+                random_tree_dir_ratio=random_tree_dir_ratio,
+                random_tree_utf8=random_tree_utf8,
+                size_matrix_max=size_matrix_max,
+                size_matrix_data=size_matrix_data,
+                metadata_matrix=metadata_matrix,
+                xattrs=xattrs,
+                deep_tree_path_length=deep_tree_path_length,
+                deep_tree_every_byte=deep_tree_every_byte,
+                symlink_graph=symlink_graph,
+                symlink_cycle_max=symlink_cycle_max,
+                hardlinks=hardlinks,
+                hardlinks_per_dir=hardlinks_per_dir,
+                hardlinks_link_max=hardlinks_link_max,
+                dedup_count=dedup_count,
+                dedup_seed=dedup_seed,
+                dedup_ratio=dedup_ratio,
+                dedup_near_ratio=dedup_near_ratio,
+                dedup_sizes=dedup_sizes,
+                dedup_max_size=dedup_max_size,
+            )
+            run_test_sets(
+                root_dir=Path(root_dir),
+                test_sets=test_sets,
+                jobs=jobs,
+                verbose=verbose,
+            )
+        report = bench_tree(
+            root_dir=os.fsencode(root_dir),
+            strategies=strategies,
+            repeat=repeat,
+            strace=strace,
+        )
+    print(json.dumps(report, indent=2))
+
+
+@click.command()
+@click.argument(
+    "output_dir",
+    type=click.Path(exists=True, file_okay=False, path_type=str),
+    nargs=1,
+)
+@click_add_options(test_set_options)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Threads unlinking at once.",
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def clean(
+    ctx,
+    *,
+    output_dir: str,
+    long_tests: bool,
+    one_angry_file: bool,
+    template_file: None | str,
+    template_hardlink: bool,
+    hash_tree_count: int,
+    hash_tree_depth: int,
+    hash_tree_width: int,
+    hash_tree_algorithm: str,
+    random_tree_count: int,
+    random_tree_seed: None | int,
+    random_tree_name_lengths: tuple[int, int],
+    random_tree_max_depth: int,
+    random_tree_dir_ratio: float,
+    random_tree_utf8: bool,
+    size_matrix_max: int,
+    size_matrix_data: bool,
+    metadata_matrix: bool,
+    xattrs: bool,
+    deep_tree_path_length: int,
+    deep_tree_every_byte: bool,
+    symlink_graph: bool,
+    symlink_cycle_max: int,
+    hardlinks: int,
+    hardlinks_per_dir: int,
+    hardlinks_link_max: bool,
+    dedup_count: int,
+    dedup_seed: None | int,
+    dedup_ratio: float,
+    dedup_near_ratio: float,
+    dedup_sizes: str,
+    dedup_max_size: int,
+    jobs: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool | float = False,
+):
+    """
+    remove a tree angryfiles made, pass the same test set options it was made with
+
+    anything else found in it is listed and left, with the dirs it is in
+    """
+    del dict_output  # the counts are always pprinted
+    _, verbose = tv(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+    )
+
+    if not verbose:
+        ic.disable()
+    raise_open_file_limit()
+
+    test_sets = build_test_sets(
+        long_tests=long_tests,
+        one_angry_file=one_angry_file,
+        template_file=template_file,
+        template_hardlink=template_hardlink,
+        hash_tree_count=hash_tree_count,
+        hash_tree_depth=hash_tree_depth,
+        hash_tree_width=hash_tree_width,
+        hash_tree_algorithm=hash_tree_algorithm,
+        random_tree_count=random_tree_count,
+        random_tree_seed=random_tree_seed,
+        random_tree_name_lengths=random_tree_name_lengths,
+        random_tree_max_depth=random_tree_max_depth,
+        random_tree_dir_ratio=random_tree_dir_ratio,
+        random_tree_utf8=random_tree_utf8,
+        size_matrix_max=size_matrix_max,
+        size_matrix_data=size_matrix_data,
+        metadata_matrix=metadata_matrix,
+        xattrs=xattrs,
+        deep_tree_path_length=deep_tree_path_length,
+        deep_tree_every_byte=deep_tree_every_byte,
+        symlink_graph=symlink_graph,
+        symlink_cycle_max=symlink_cycle_max,
+        hardlinks=hardlinks,
+        hardlinks_per_dir=hardlinks_per_dir,
+        hardlinks_link_max=hardlinks_link_max,
+        dedup_count=dedup_count,
+        dedup_seed=dedup_seed,
+        dedup_ratio=dedup_ratio,
+        dedup_near_ratio=dedup_near_ratio,
+        dedup_sizes=dedup_sizes,
+        dedup_max_size=dedup_max_size,
+    )
+    counts = clean_tree(
+        root_dir=Path(output_dir).expanduser().absolute(),
+        test_sets=test_sets,
+        jobs=jobs,
+    )
+    for path in counts["left"]:
+        print("left:", path, file=sys.stderr)
+    pprint.pprint(counts | {"left": len(counts["left"])})
+    if counts["left"]:
+        ctx.exit(1)
@@ -26,6 +26,8 @@ setup(
     entry_points={
         "console_scripts": [
             "angryfiles = angryfiles.angryfiles:cli",
+            "angryfiles-bench = angryfiles.angryfiles:bench",
+            "angryfiles-clean = angryfiles.angryfiles:clean",
         ],
     },
     classifiers=[
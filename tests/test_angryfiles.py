@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import stat
+from functools import partial
+from itertools import islice
+from pathlib import Path
+
+import pytest
+
+from angryfiles import angryfiles
+from angryfiles.angryfiles import FilenameSpace
+from angryfiles.angryfiles import VirtualAngryTree
+from angryfiles.angryfiles import angry_test_sets
+from angryfiles.angryfiles import clean_tree
+from angryfiles.angryfiles import dedup_corpus_test_sets
+from angryfiles.angryfiles import hash_index_test_sets
+from angryfiles.angryfiles import random_tree_test_sets
+from angryfiles.angryfiles import run_test_sets
+from angryfiles.angryfiles import write_marker
+
+SKIPPED = {angryfiles.MARKER_NAME, angryfiles.JOURNAL_NAME}
+
+
+def make_tree(root_dir: Path, test_sets, **kwargs) -> None:
+    # like cli(), a marked root_dir
+    root_dir.mkdir(exist_ok=True)
+    if not (root_dir / os.fsdecode(angryfiles.MARKER_NAME)).exists():
+        write_marker(root_dir, test_sets)
+    run_test_sets(root_dir=root_dir, test_sets=test_sets, jobs=1, **kwargs)
+
+
+def listing(root_dir: Path) -> dict[bytes, tuple]:
+    # path: (file type, symlink target or file digest) of everything below root_dir
+    root_dir = os.fsencode(root_dir)
+    found = {}
+    for top, dirs, files in os.walk(root_dir):
+        for name in dirs + files:
+            path = os.path.join(top, name)
+            relative = os.path.relpath(path, root_dir)
+            if relative in SKIPPED:
+                continue
+            mode = os.lstat(path).st_mode
+            if stat.S_ISLNK(mode):
+                found[relative] = ("symlink", os.readlink(path))
+            elif stat.S_ISREG(mode):
+                with open(path, "rb") as fh:
+                    found[relative] = ("file", hashlib.sha256(fh.read()).hexdigest())
+            else:
+                found[relative] = (stat.S_IFMT(mode), None)
+    return found
+
+
+@pytest.mark.parametrize("length", [1, 2, 3])
+def test_filename_space_rank_unrank(length):
+    space = FilenameSpace(length)
+    step = max(1, len(space) // 5000)
+    for index in range(0, len(space), step):
+        assert space.rank(space.unrank(index)) == index
+    assert space.rank(space.unrank(len(space) - 1)) == len(space) - 1
+    assert b"." * length not in space or length > 2
+
+
+def test_filename_space_order_and_exclude():
+    space = FilenameSpace(2)
+    names = list(space)
+    assert names == sorted(names)
+    assert len(names) == len(set(names)) == len(space) == 254**2 - 1
+    assert b".." not in names
+    assert all(b"/" not in name and b"\x00" not in name for name in names)
+
+
+def test_filename_space_shard():
+    space = FilenameSpace(2)
+    shards = [space.shard(first_byte) for first_byte in FilenameSpace(1)]
+    shards.append(space.shard(b"."))
+    assert sorted(name for shard in shards for name in shard) == list(space)
+    for prefix in (b"\x01", b".", b"a", b"\xff"):
+        shard = space.shard(prefix)
+        expected = [name for name in space if name.startswith(prefix)]
+        assert list(shard) == expected
+        assert shard.index(expected[-1]) == len(expected) - 1
+    assert list(space[10:20]) == [space[index] for index in range(10, 20)]
+
+
+def test_virtual_tree_matches_made_tree(tmp_path):
+    test_sets = angry_test_sets(long_tests=False)
+    make_tree(tmp_path / "root", test_sets)
+    made = {}
+    for path, (file_type, _) in listing(tmp_path / "root").items():
+        made[path] = file_type
+    virtual = {}
+    tree = VirtualAngryTree(test_sets)
+    for top, dirs, files in tree.walk(b""):
+        for name in dirs + files:
+            path = os.path.join(top, name)
+            mode = tree.lstat(path).st_mode
+            if stat.S_ISLNK(mode):
+                virtual[path] = "symlink"
+            elif stat.S_ISREG(mode):
+                virtual[path] = "file"
+            else:
+                virtual[path] = stat.S_IFMT(mode)
+    assert made
+    assert virtual == made
+
+
+class Killed(Exception):
+    pass
+
+
+def test_resume_after_kill_matches_fresh_run(tmp_path, monkeypatch):
+    # the random tree is journaled whole, the hash index by shard
+    test_sets = random_tree_test_sets(count=200, seed=1) + [
+        partial(test_set, batch_size=64)
+        for test_set in hash_index_test_sets(count=1000, depth=2)
+    ]
+    make_tree(tmp_path / "fresh", test_sets)
+
+    create_objects = angryfiles._create_objects
+    calls = 0
+
+    def killed_create_objects(angry_objects, **kwargs):
+        # the 20th shard dies half way through
+        nonlocal calls
+        calls += 1
+        if calls == 20:
+            angry_objects = list(angry_objects)
+            create_objects(islice(angry_objects, len(angry_objects) // 2), **kwargs)
+            raise Killed
+        return create_objects(angry_objects, **kwargs)
+
+    root_dir = tmp_path / "resumed"
+    journal_path = root_dir / os.fsdecode(angryfiles.JOURNAL_NAME)
+    monkeypatch.setattr(angryfiles, "_create_objects", killed_create_objects)
+    with pytest.raises(Killed):
+        make_tree(root_dir, test_sets, journal_path=journal_path)
+    monkeypatch.undo()
+    assert listing(root_dir) != listing(tmp_path / "fresh")
+    make_tree(root_dir, test_sets, journal_path=journal_path)
+    assert listing(root_dir) == listing(tmp_path / "fresh")
+
+
+def test_dedup_manifest_matches_files(tmp_path):
+    test_sets = dedup_corpus_test_sets(
+        count=300, seed=7, ratio=0.5, near_ratio=0.2, max_size=2**16
+    )
+    make_tree(tmp_path, test_sets)
+    dest_dir = tmp_path / os.fsdecode(test_sets[0].keywords["dest_dir"])
+    manifest = json.loads((dest_dir / "manifest.json").read_bytes())
+    files = {
+        path.relative_to(dest_dir).as_posix(): path.read_bytes()
+        for path in dest_dir.rglob("*")
+        if path.is_file() and path.name != "manifest.json"
+    }
+    assert manifest["files"] == len(files) == 300
+    assert manifest["bytes"] == sum(len(content) for content in files.values())
+    digests = {
+        path: hashlib.sha256(content).digest() for path, content in files.items()
+    }
+    assert manifest["contents"] == len(set(digests.values()))
+    grouped = set()
+    for group in manifest["groups"]:
+        assert len({digests[path] for path in group["paths"]}) == 1
+        assert all(len(files[path]) == group["size"] for path in group["paths"])
+        grouped.update(group["paths"])
+    # a file in no group has content no other file has
+    ungrouped = [digests[path] for path in files if path not in grouped]
+    assert len(ungrouped) == len(set(ungrouped))
+    assert not set(ungrouped) & {digests[path] for path in grouped}
+    assert manifest["near_duplicates"]
+    for near_duplicate in manifest["near_duplicates"]:
+        content = files[near_duplicate["path"]]
+        of = files[near_duplicate["of"]]
+        assert len(content) == len(of)
+        offset = near_duplicate["offset"]
+        assert content[offset] == of[offset] ^ 0xFF
+        assert content[:offset] == of[:offset]
+        assert content[offset + 1 :] == of[offset + 1 :]
+
+
+def test_clean_tree_removes_marked_tree(tmp_path):
+    test_sets = angry_test_sets(long_tests=False) + random_tree_test_sets(
+        count=100, seed=2
+    )
+    root_dir = tmp_path / "root"
+    make_tree(root_dir, test_sets)
+    made = listing(root_dir)
+    result = clean_tree(root_dir=root_dir, test_sets=test_sets)
+    assert result["left"] == []
+    assert result["removed"] == len(made) + 1  # and root_dir
+    assert not root_dir.exists()
+
+
+def test_clean_tree_keeps_what_it_did_not_make(tmp_path):
+    test_sets = random_tree_test_sets(count=50, seed=3)
+    root_dir = tmp_path / "root"
+    make_tree(root_dir, test_sets)
+    dest_dir = root_dir / os.fsdecode(test_sets[0].keywords["dest_dir"])
+    (dest_dir / "planted").write_bytes(b"")
+    (root_dir / "planted").mkdir()
+    result = clean_tree(root_dir=root_dir, test_sets=test_sets)
+    assert result["left"] == sorted(
+        [b"planted", os.path.relpath(dest_dir / "planted", root_dir).encode()]
+    )
+    assert sorted(path.name for path in root_dir.rglob("*")) == sorted(
+        [angryfiles.MARKER_NAME.decode(), "planted", "planted", "random", dest_dir.name]
+    )
+
+
+def test_clean_tree_refuses_unmarked_or_other_tree(tmp_path):
+    test_sets = random_tree_test_sets(count=50, seed=4)
+    (tmp_path / "unmarked").mkdir()
+    (tmp_path / "unmarked" / "file").write_bytes(b"")
+    with pytest.raises(ValueError):
+        clean_tree(root_dir=tmp_path / "unmarked", test_sets=test_sets)
+    assert (tmp_path / "unmarked" / "file").exists()
+
+    make_tree(tmp_path / "root", test_sets)
+    before = listing(tmp_path / "root")
+    with pytest.raises(ValueError):
+        clean_tree(
+            root_dir=tmp_path / "root",
+            test_sets=random_tree_test_sets(count=50, seed=5),
+        )
+    assert listing(tmp_path / "root") == before